@@ -2,22 +2,27 @@ from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QPushButton, QLineEdit, QListWidget, QStackedWidget,
                              QScrollArea, QFrame, QTextEdit, QDialog, QFormLayout,
                              QListWidgetItem, QCheckBox, QGroupBox, QDateEdit, QMessageBox,
-                             QProgressDialog, QApplication, QMenu, QCompleter, QComboBox)
-from PyQt5.QtCore import Qt, pyqtSignal, QThread, QStringListModel, QSize
+                             QProgressDialog, QApplication, QMenu, QCompleter, QComboBox, QSpinBox)
+from PyQt5.QtCore import Qt, pyqtSignal, QThread, QStringListModel, QSize, QObject
 from PyQt5.QtGui import QFont, QColor, QPalette, QIcon, QTextCharFormat, QSyntaxHighlighter, QPixmap
 from PyQt5.QtCore import QDate
 import os
 import sys
+import shutil
 from datetime import datetime
 import json
 
 from newYear.utils.volcano_api import VolcanoAPI
+from newYear.utils.chat_sampler import SAMPLE_STRATEGIES
+from newYear.utils.token_budget import TokenBudget
 from newYear.utils.data_processor import DataProcessor
 from newYear.utils.search_helper import SearchHelper
 from newYear.ui.result_display import ResultDisplay
 from app.components.CAvatar import CAvatar
-from newYear.utils.version_manager import VersionManager
-from newYear.utils.card_util import generate_card
+from newYear.utils.version_manager import create_version_manager
+from newYear.utils.render_farm import get_render_farm
+from newYear.utils.card_output import OUTPUT_PRESETS
+from newYear.utils.card_utils import get_preview_path
 
 class SearchHighlighter(QSyntaxHighlighter):
     """搜索结果高亮器"""
@@ -47,34 +52,40 @@ class GenerateWorker(QThread):
     finished = pyqtSignal(bool, str)  # 完成信号
     result = pyqtSignal(dict)  # 结果信号
     
-    def __init__(self, api, data_processor, contact_info, time_range, style_prompt):
+    def __init__(self, api, data_processor, contact_info, time_range, style_prompt, budget=None, chat_analysis=None):
         super().__init__()
         self.api = api
         self.data_processor = data_processor
         self.contact_info = contact_info
         self.time_range = time_range
         self.style_prompt = style_prompt
+        self.budget = budget  # 整批生成共用的Token预算
+        self.chat_analysis = chat_analysis  # 批量预估时已得到的聊天记录分析结果
         
     def run(self):
         try:
-            # 获取聊天记录 (20%)
-            self.progress.emit(10, f"正在获取与{self.contact_info['name']}的聊天记录...")
-            chat_history = self.data_processor.get_chat_history(
-                self.contact_info['wxid'],
-                self.time_range['start_date'],
-                self.time_range['end_date']
-            )
-            
-            # 分析聊天内容 (40%)
-            self.progress.emit(20, "正在分析聊天记录...")
-            chat_analysis = self.data_processor.analyze_chat_content(chat_history)
+            chat_history = None
+            if self.chat_analysis is None:
+                # 获取聊天记录 (20%)
+                self.progress.emit(10, f"正在获取与{self.contact_info['name']}的聊天记录...")
+                chat_history = self.data_processor.get_chat_history(
+                    self.contact_info['wxid'],
+                    self.time_range['start_date'],
+                    self.time_range['end_date']
+                )
+                
+                # 分析聊天内容 (40%)
+                self.progress.emit(20, "正在分析聊天记录...")
+                self.data_processor.analyze_chat_content(chat_history)
             
             # 生成祝福内容 (60%)
             self.progress.emit(30, "正在生成新年祝福...")
             result = self.api.generate_greeting(
                 self.contact_info,
                 chat_history,
-                self.style_prompt
+                self.style_prompt,
+                budget=self.budget,
+                chat_analysis=self.chat_analysis
             )
             
             # 准备生成贺卡 (70%)
@@ -93,6 +104,61 @@ class GenerateWorker(QThread):
         except Exception as e:
             self.finished.emit(False, str(e))
 
+class EstimateWorker(QThread):
+    """批量生成前在后台读取并分析各联系人的聊天记录，得出预估用量
+    
+    完成后 estimate 为预估结果，analyses 为 wxid 到聊天记录分析结果的映射（生成时直接使用），
+    失败时 error 为错误信息。
+    """
+    
+    def __init__(self, api, data_processor, contacts, time_range, style_prompt, concurrency=1):
+        super().__init__()
+        self.api = api
+        self.data_processor = data_processor
+        self.contacts = contacts
+        self.time_range = time_range
+        self.style_prompt = style_prompt
+        self.concurrency = concurrency
+        self.estimate = None
+        self.analyses = None
+        self.error = None
+        self._cancelled = False
+        
+    def cancel(self):
+        """在分析完当前联系人后停止"""
+        self._cancelled = True
+        
+    def run(self):
+        try:
+            analyses = self.api.analyze_chat_histories(
+                self.contacts,
+                lambda wxid: self.data_processor.get_chat_history(
+                    wxid, self.time_range['start_date'], self.time_range['end_date']
+                ),
+                cancelled=lambda: self._cancelled
+            )
+            if self._cancelled:
+                return
+            self.estimate = self.api.estimate_batch(
+                self.contacts, self.style_prompt, chat_analyses=analyses, concurrency=self.concurrency
+            )
+            self.analyses = analyses
+        except Exception as e:
+            self.error = str(e)
+
+class RenderResultBridge(QObject):
+    """把渲染农场后台线程中的回调转发到界面线程"""
+    finished = pyqtSignal(str, str, str)  # 任务ID, 图片路径, 错误信息
+    preview_finished = pyqtSignal(str, str, str)  # 任务ID, 预览图路径, 错误信息
+
+    def callback(self, job_id, img_path, error):
+        """渲染农场的回调"""
+        self.finished.emit(job_id, img_path or '', str(error) if error else '')
+
+    def preview_callback(self, job_id, img_path, error):
+        """渲染任务中预览图就绪时的回调"""
+        self.preview_finished.emit(job_id, img_path or '', str(error) if error else '')
+
 class ContactItem(QWidget):
     """自定义联系人列表项"""
     def __init__(self, contact_name, contact_id, parent=None):
@@ -175,6 +241,24 @@ class APIConfigDialog(QDialog):
         self.api_key_input.setPlaceholderText('请输入您的火山引擎API Key')
         api_layout.addRow('API Key:', self.api_key_input)
         
+        # 每批次Token上限
+        self.batch_token_input = QSpinBox()
+        self.batch_token_input.setRange(0, 100000000)
+        self.batch_token_input.setSingleStep(10000)
+        self.batch_token_input.setSpecialValueText('不限制')
+        api_layout.addRow('批次Token上限:', self.batch_token_input)
+        
+        # 聊天记录过长时提取关键词使用的采样策略
+        self.sample_strategy_input = QComboBox()
+        for strategy, label in SAMPLE_STRATEGIES.items():
+            self.sample_strategy_input.addItem(label, strategy)
+        api_layout.addRow('聊天记录采样:', self.sample_strategy_input)
+        
+        # 提示词日志目录，留空时不记录
+        self.prompt_log_dir_input = QLineEdit()
+        self.prompt_log_dir_input.setPlaceholderText('留空则不记录发送的提示词')
+        api_layout.addRow('提示词日志目录:', self.prompt_log_dir_input)
+        
         api_group.setLayout(api_layout)
         layout.addWidget(api_group)
         
@@ -211,6 +295,9 @@ class APIConfigDialog(QDialog):
         """获取配置信息"""
         return {
             'api_key': self.api_key_input.text(),
+            'batch_token_budget': self.batch_token_input.value(),
+            'sample_strategy': self.sample_strategy_input.currentData(),
+            'prompt_log_dir': self.prompt_log_dir_input.text().strip(),
             'start_date': self.start_date.date().toString('yyyy-MM-dd'),
             'end_date': self.end_date.date().toString('yyyy-MM-dd')
         }
@@ -219,6 +306,12 @@ class APIConfigDialog(QDialog):
         """设置配置信息"""
         if config.get('api_key'):
             self.api_key_input.setText(config['api_key'])
+        if config.get('batch_token_budget'):
+            self.batch_token_input.setValue(config['batch_token_budget'])
+        if config.get('sample_strategy'):
+            self.sample_strategy_input.setCurrentIndex(self.sample_strategy_input.findData(config['sample_strategy']))
+        if config.get('prompt_log_dir'):
+            self.prompt_log_dir_input.setText(config['prompt_log_dir'])
         if config.get('start_date'):
             self.start_date.setDate(QDate.fromString(config['start_date'], 'yyyy-MM-dd'))
         if config.get('end_date'):
@@ -266,6 +359,12 @@ class StyleButton(QPushButton):
 class NewYearGreetingWindow(QMainWindow):
     """新年祝福生成器主窗口"""
     
+    # 生成后用于预览和发送微信的贺卡使用体积较小的JPEG，导出到桌面时再重新渲染高清PNG
+    CARD_OUTPUT = 'send'
+    EXPORT_OUTPUT = 'export'
+    # 同时进行的生成任务数（批量生成时逐个联系人调用接口），API客户端的连接池按此大小创建
+    GENERATE_CONCURRENCY = 1
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("新年祝福生成器")
@@ -284,12 +383,15 @@ class NewYearGreetingWindow(QMainWindow):
         # 初始化配置
         self.config = {
             'api_key': '',
+            'batch_token_budget': 0,  # 0 表示不限制
+            'sample_strategy': 'reservoir',  # 见 chat_sampler.SAMPLE_STRATEGIES
+            'prompt_log_dir': '',  # 为空时不记录提示词
             'start_date': '',
             'end_date': ''
         }
         
         # 初始化版本管理器
-        self.version_manager = VersionManager()
+        self.version_manager = create_version_manager()
         
         # 初始化UI
         self.init_ui()
@@ -297,6 +399,16 @@ class NewYearGreetingWindow(QMainWindow):
         # 加载联系人列表
         self.load_contacts()
         
+        # 贺卡在渲染农场的多个进程中生成，渲染进程在第一次提交任务时才启动
+        self.render_farm = get_render_farm()
+        self.render_bridge = RenderResultBridge()
+        self.render_bridge.finished.connect(self.handle_render_finished)
+        self.render_bridge.finished.connect(self.handle_export_render_finished)
+        self.render_bridge.preview_finished.connect(self.handle_preview_finished)
+        self._render_jobs = {}  # 任务ID -> (版本信息, 联系人信息, 风格, 风格提示词)
+        self._export_jobs = {}  # 导出任务ID -> (联系人文件夹, 联系人ID, 联系人名称, 已生成的图片)
+        self._export_state = None  # 进行中的导出：导出文件夹、失败的联系人、进度对话框
+        
         self.current_style = 'formal'  # 默认正式风格
         self.custom_prompt = ''  # 存储自定义提示词
         self.current_template = 1  # 默认使用模板1
@@ -479,6 +591,18 @@ class NewYearGreetingWindow(QMainWindow):
         dialog.set_config(self.config)  # 设置当前配置
         if dialog.exec_() == QDialog.Accepted:
             self.config = dialog.get_config()  # 获取新的配置
+            # 提前创建共享的API客户端并预热连接
+            if self.config.get('api_key'):
+                self.get_api().warm_up_async()
+            
+    def get_api(self):
+        """按当前配置获取共享的API实例（复用连接池）"""
+        return VolcanoAPI.get_shared(
+            self.config['api_key'],
+            concurrency=self.GENERATE_CONCURRENCY,
+            sample_strategy=self.config.get('sample_strategy') or 'reservoir',
+            prompt_log_dir=self.config.get('prompt_log_dir') or None
+        )
             
     def get_message_time_range(self):
         """获取消息记录的时间范围"""
@@ -843,8 +967,14 @@ class NewYearGreetingWindow(QMainWindow):
         time_range = self.get_message_time_range()
         
         try:
-            # 创建API实例
-            api = VolcanoAPI(self.config['api_key'])
+            # 获取共享的API实例（复用连接池）
+            api = self.get_api()
+            
+            # 批量生成前预估Token用量、耗时和费用（聊天记录的分析结果在生成时直接使用）
+            chat_analyses = self.confirm_batch_estimate(api, selected_contacts, style_prompt, time_range)
+            if chat_analyses is None:
+                return
+            budget = TokenBudget(self.config.get('batch_token_budget') or None)
             
             # 禁用生成按钮
             self.generate_btn.setEnabled(False)
@@ -858,35 +988,45 @@ class NewYearGreetingWindow(QMainWindow):
             progress.show()
             QApplication.processEvents()
             
-            # 为每个选中的联系人创建生成任务
-            for contact in selected_contacts:
-                if progress.wasCanceled():
-                    break
+            # 整批生成期间保持API客户端可用（更换配置后旧客户端在本批结束后才关闭）
+            with api.in_use():
+                # 为每个选中的联系人创建生成任务
+                for contact in selected_contacts:
+                    if progress.wasCanceled():
+                        break
                     
-                progress.setLabelText(f"正在为 {contact['name']} 生成祝福...")
-                QApplication.processEvents()
+                    # 批次Token预算已用完时停止后续生成
+                    remaining = budget.remaining_tokens
+                    if remaining is not None and remaining < api.EXPECTED_COMPLETION_TOKENS:
+                        QMessageBox.warning(self, '提示', '已达到批次Token上限，剩余联系人未生成')
+                        break
+                    
+                    progress.setLabelText(f"正在为 {contact['name']} 生成祝福...")
+                    QApplication.processEvents()
                 
-                # 创建工作线程
-                worker = GenerateWorker(
-                    api,
-                    self.data_processor,
-                    contact,
-                    time_range,
-                    style_prompt
-                )
+                    # 创建工作线程
+                    worker = GenerateWorker(
+                        api,
+                        self.data_processor,
+                        contact,
+                        time_range,
+                        style_prompt,
+                        budget,
+                        chat_analysis=chat_analyses.get(contact['wxid'])
+                    )
                 
-                # 连接信号
-                worker.progress.connect(progress.setValue)
-                worker.result.connect(lambda r, c=contact: self.handle_generation_result(r, c, style, style_prompt))  # 传递风格信息
-                worker.finished.connect(lambda s, e, c=contact: self.handle_generation_finished(c['wxid'], s, e))
+                    # 连接信号
+                    worker.progress.connect(progress.setValue)
+                    worker.result.connect(lambda r, c=contact: self.handle_generation_result(r, c, style, style_prompt))  # 传递风格信息
+                    worker.finished.connect(lambda s, e, c=contact: self.handle_generation_finished(c['wxid'], s, e))
                 
-                # 启动工作线程
-                worker.start()
+                    # 启动工作线程
+                    worker.start()
                 
-                # 等待完成
-                while not worker.isFinished():
-                    QApplication.processEvents()
-                    QThread.msleep(100)
+                    # 等待完成
+                    while not worker.isFinished():
+                        QApplication.processEvents()
+                        QThread.msleep(100)
                     
         except Exception as e:
             QMessageBox.critical(self, '错误', f'生成失败：{str(e)}')
@@ -894,6 +1034,64 @@ class NewYearGreetingWindow(QMainWindow):
             # 恢复生成按钮
             self.generate_btn.setEnabled(True)
             
+    def confirm_batch_estimate(self, api, contacts, style_prompt, time_range):
+        """展示批量生成的预估用量，由用户确认是否继续
+        
+        各联系人的聊天记录在后台线程中读取和分析，界面保持响应；分析结果返回给调用方，生成时不再重复分析。
+        
+        Returns:
+            Optional[Dict]: 继续生成时为 wxid 到聊天记录分析结果的映射（单个联系人不预估，为空字典），
+                取消时为None
+        """
+        if len(contacts) < 2:
+            return {}
+            
+        # 按各联系人实际的聊天记录构建提示词来估算
+        worker = EstimateWorker(api, self.data_processor, contacts, time_range, style_prompt,
+                                concurrency=self.GENERATE_CONCURRENCY)
+        progress = QProgressDialog("正在读取聊天记录并预估用量...", "取消", 0, 0, self)
+        progress.setWindowTitle("生成预估")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.show()
+        worker.start()
+        while not worker.isFinished():
+            if progress.wasCanceled():
+                worker.cancel()
+            QApplication.processEvents()
+            QThread.msleep(50)
+        # 关闭对话框会触发 canceled，先记下用户是否取消
+        cancelled = progress.wasCanceled()
+        progress.close()
+        if cancelled:
+            return None
+        if worker.error:
+            QMessageBox.warning(self, '提示', f'预估失败：{worker.error}')
+            return None
+        estimate = worker.estimate
+        minutes, seconds = divmod(int(estimate['estimated_seconds']), 60)
+        message = (
+            f"即将为 {estimate['contacts']} 位联系人生成祝福，预估：\n\n"
+            f"提示词Token：约 {estimate['prompt_tokens']}\n"
+            f"生成Token：约 {estimate['completion_tokens']}\n"
+            f"耗时：约 {minutes} 分 {seconds} 秒\n"
+            f"费用：约 {estimate['estimated_cost']} 元\n"
+        )
+        if estimate['oversized']:
+            names = {contact['wxid']: contact['name'] for contact in contacts}
+            message += (
+                f"\n以下 {len(estimate['oversized'])} 位联系人的提示词超过单次上限（{api.max_prompt_tokens} Token），"
+                f"将不会生成：\n{'、'.join(names.get(wxid, wxid) for wxid in estimate['oversized'])}\n"
+            )
+        batch_budget = self.config.get('batch_token_budget')
+        if batch_budget and estimate['total_tokens'] > batch_budget:
+            message += (
+                f"\n预估用量超过批次Token上限（{batch_budget}），"
+                f"超出部分的联系人将不会生成，建议减少选中的联系人。\n"
+            )
+        message += "\n是否继续？"
+        reply = QMessageBox.question(self, '生成预估', message, QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        return worker.analyses if reply == QMessageBox.Yes else None
+        
     def handle_generation_result(self, result, contact_info, style, style_prompt):
         """处理生成结果"""
         print("\n=== 处理生成结果 ===")
@@ -928,6 +1126,7 @@ class NewYearGreetingWindow(QMainWindow):
                 'signature': self.signature_input.text() or contact_info['name'],  # 优先使用用户输入的签名，如果没有则使用联系人名称
                 'year': '2025',                              # 年份
             }
+            version_info['signature'] = template_data['signature']
             print(f"\n2. 模板数据已准备")
             
             # 确保generate_img目录存在
@@ -938,119 +1137,86 @@ class NewYearGreetingWindow(QMainWindow):
                 print(f"\n3. generate_img目录已存在")
             
             # 生成图片文件名
-            img_filename = f"{contact_info['wxid']}.png"
+            img_filename = f"{contact_info['wxid']}.{OUTPUT_PRESETS[self.CARD_OUTPUT].ext}"
             img_path = os.path.join('newYear/generate_img', img_filename)
             print(f"\n4. 图片将保存至: {img_path}")
             
-            # 使用generate_card生成图片
-            print(f"\n5. 开始生成贺卡图片...")
+            # 交给渲染农场生成图片，完成后在 handle_render_finished 中保存版本；
+            # 同一次页面加载中先截取的低分辨率预览图在 handle_preview_finished 中先行展示
+            print(f"\n5. 提交贺卡渲染任务...")
             print(f"   - 使用模板: {self.current_template}")
             print(f"   - 用户ID: {contact_info['wxid']}")
-            img_path = generate_card(
+            job_id = self.render_farm.submit(
                 template_number=self.current_template,
                 data=template_data,
-                user_id=contact_info['wxid']
+                user_id=contact_info['wxid'],
+                callback=self.render_bridge.callback,
+                output=self.CARD_OUTPUT,
+                preview_callback=self.render_bridge.preview_callback
             )
-            print(f"\n6. 贺卡图片生成完成: {img_path}")
-            
-            # 将图片路径添加到版本信息中
-            version_info['image_path'] = img_path
-            
-            # 更新JSON文件
-            json_path = os.path.join('newYear/version_history', f"{contact_info['wxid']}.json")
-            print(f"\n7. 准备更新JSON文件: {json_path}")
-            
-            # 读取现有的JSON文件（如果存在）
-            existing_data = []
-            if os.path.exists(json_path):
-                try:
-                    with open(json_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # 确保data是列表类型
-                        if isinstance(data, list):
-                            existing_data = data
-                        elif isinstance(data, dict):
-                            # 如果是旧格式（字典），将其转换为列表
-                            if 'latest_version' in data:
-                                existing_data = [data['latest_version']]
-                        print(f"8. 成功读取现有JSON文件")
-                except json.JSONDecodeError:
-                    print(f"Warning: 无法解析现有的JSON文件: {json_path}")
-                except Exception as e:
-                    print(f"Warning: 读取JSON文件时出错: {str(e)}")
-            
-            # 创建用于保存的数据副本，移除二进制数据
-            save_version_info = {
-                'create_time': version_info['create_time'],
-                'style': version_info['style'],
-                'contact': {
-                    'wxid': contact_info['wxid'],
-                    'name': contact_info['name']
-                },
-                'greeting': version_info['greeting'],  # 新年祝福寄语
-                'poem': version_info['poem'],         # 新年祝福诗
-                'idioms': version_info['idioms'],     # 新年祝福成语
-                'wishes': version_info['wishes'],     # 新年祝福愿望
-                'template_number': version_info['template_number'],
-                'image_path': version_info['image_path']
-            }
-            
-            # 保存风格相关内容
-            if style == 'custom':
-                save_version_info['custom_prompt'] = style_prompt
-                save_version_info['style_content'] = style_prompt
-            else:
-                save_version_info['style_prompt'] = style_prompt
-                save_version_info['style_content'] = style_prompt
-            
-            # 添加新版本到数组
-            existing_data.append(save_version_info)
-            
-            # 确保version_history目录存在
-            version_history_dir = os.path.dirname(json_path)
-            if not os.path.exists(version_history_dir):
-                os.makedirs(version_history_dir)
-                
-            # 保存更新后的JSON文件
-            try:
-                with open(json_path, 'w', encoding='utf-8') as f:
-                    json.dump(existing_data, f, ensure_ascii=False, indent=4)
-                print(f"\n10. JSON文件已保存")
-            except Exception as e:
-                print(f"Error: 保存JSON文件失败: {str(e)}")
-                raise
-            
+            self._render_jobs[job_id] = (version_info, contact_info, style, style_prompt)
+            print(f"   - 任务ID: {job_id}")
         except Exception as e:
             error_msg = f"生成贺卡图片失败: {str(e)}"
             print(f"\nError: {error_msg}")
             QMessageBox.warning(self, '警告', error_msg)
+            
+    def handle_preview_finished(self, job_id, img_path, error_msg):
+        """预览图生成后先展示，完整贺卡仍在后台生成"""
+        if job_id not in self._render_jobs or error_msg:
+            if error_msg:
+                print(f"生成预览图失败: {error_msg}")
+            return
+        version_info = self._render_jobs[job_id][0]
+        print(f"预览图已生成: {img_path}")
+        self.result_display.update_content(dict(version_info, image_path=img_path), preview=True)
+        
+    def handle_render_finished(self, job_id, img_path, error_msg):
+        """贺卡渲染完成后保存版本并更新界面"""
+        if job_id not in self._render_jobs:
+            return
+        version_info, contact_info, style, style_prompt = self._render_jobs.pop(job_id)
+        # 完整贺卡已完成（或失败），预览图不再需要
+        preview_path = get_preview_path(contact_info['wxid'])
+        if os.path.exists(preview_path):
+            try:
+                os.remove(preview_path)
+            except OSError as e:
+                print(f"删除预览图失败: {str(e)}")
+        print(f"\n=== 贺卡渲染完成: {contact_info['name']} ({contact_info['wxid']}) ===")
+        
+        if error_msg:
+            error_msg = f"生成贺卡图片失败: {error_msg}"
+            print(f"\nError: {error_msg}")
+            QMessageBox.warning(self, '警告', error_msg)
             version_info['image_path'] = None
             return
+        print(f"\n6. 贺卡图片生成完成: {img_path}")
+        
+        # 将图片路径添加到版本信息中
+        version_info['image_path'] = img_path
         
         # 保存风格内容
         if style == 'custom':
-            print(f"\n11. 保存自定义提示词: {style_prompt}")
+            print(f"\n7. 保存自定义提示词: {style_prompt}")
             version_info['custom_prompt'] = style_prompt
             version_info['style_content'] = style_prompt
         else:
-            print(f"\n11. 保存预设风格提示词: {style_prompt}")
+            print(f"\n7. 保存预设风格提示词: {style_prompt}")
             version_info['style_prompt'] = style_prompt
             version_info['style_content'] = style_prompt
         
-        # 添加到版本管理器
-        print(f"\n12. 添加到版本管理器")
+        # 添加到版本管理器（每次生成只写入一次）
+        print(f"\n8. 保存版本")
+        # 版本列表通过版本管理器的变化通知只更新该联系人的一行
         self.version_manager.add_version(version_info)
         
         # 更新结果显示
-        print(f"\n13. 更新结果显示")
+        print(f"\n9. 更新结果显示")
         self.result_display.update_content(version_info)
         
-        # 刷新版本历史
-        print(f"\n14. 刷新版本历史")
-        self.result_display.load_version_history()
-        
         # 更新联系人状态
-        print(f"\n15. 更新联系人状态")
+        print(f"\n10. 更新联系人状态")
         self.update_contact_status(contact_info['wxid'], True)
         print("=== 生成结果处理完成 ===\n")
         
@@ -1124,6 +1290,17 @@ class NewYearGreetingWindow(QMainWindow):
         dialog = VersionCompareDialog(versions, self)
         dialog.exec_()
         
+    def version_to_template_data(self, version):
+        """由版本信息还原注入模板的数据"""
+        return {
+            'greeting_text': version.get('greeting', ''),
+            'poem_text': version.get('poem', ''),
+            'idioms_text': version.get('idioms', ''),
+            'wishes_text': version.get('wishes', ''),
+            'signature': version.get('signature') or version.get('contact', {}).get('name', ''),
+            'year': '2025',
+        }
+        
     def get_style_prompt_by_style(self, style):
         """根据风格获取提示词"""
         style_prompts = {
@@ -1173,22 +1350,12 @@ class NewYearGreetingWindow(QMainWindow):
             QApplication.processEvents()
             
             try:
-                # 读取联系人的JSON数据
-                json_path = os.path.join('newYear/version_history', f"{contact.contact_id}.json")
-                if not os.path.exists(json_path):
+                # 获取联系人的最新版本
+                latest_version = self.version_manager.get_latest_version(contact.contact_id)
+                if not latest_version:
                     failed_contacts.append(f"{contact.contact_id} (无生成记录)")
                     continue
                     
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    versions = json.load(f)
-                    
-                if not versions:
-                    failed_contacts.append(f"{contact.contact_id} (无版本记录)")
-                    continue
-                    
-                # 获取最新版本（数组中的最后一个元素）
-                latest_version = versions[-1]
-                    
                 # 获取图片路径
                 image_path = latest_version.get('image_path')
                 name = latest_version.get('contact').get('name')
@@ -1245,8 +1412,10 @@ class NewYearGreetingWindow(QMainWindow):
             progress.show()
             
             # 获取版本管理器
-            version_manager = VersionManager()
+            version_manager = self.version_manager
             failed_contacts = []  # 记录导出失败的联系人
+            # 需要重新渲染高清贺卡的联系人，按模板分组后批量提交：模板编号 -> [(用户ID, 数据, 导出信息)]
+            export_batches = {}
             
             # 遍历选中的联系人
             for i, contact in enumerate(selected_contacts):
@@ -1288,15 +1457,17 @@ class NewYearGreetingWindow(QMainWindow):
                         with open(json_path, 'w', encoding='utf-8') as f:
                             json.dump(export_versions, f, ensure_ascii=False, indent=2)
                         
-                        # 导出最新版本的图片
-                        latest_version = versions[-1]
-                        if 'image_path' in latest_version:
-                            original_image = latest_version['image_path']
-                            if os.path.exists(original_image):
-                                image_name = os.path.basename(original_image)
-                                new_image_path = os.path.join(contact_folder, image_name)
-                                import shutil
-                                shutil.copy2(original_image, new_image_path)
+                        # 导出最新版本的图片：交给渲染农场按导出配置重新渲染高清图片，
+                        # 完成后在 handle_export_render_finished 中复制到导出文件夹，失败时复制已生成的图片
+                        latest_version = max(versions, key=lambda v: v.get('version_number', 0))
+                        if latest_version.get('template_number'):
+                            export_batches.setdefault(latest_version['template_number'], []).append((
+                                f"{contact_id}_export",
+                                self.version_to_template_data(latest_version),
+                                (contact_folder, contact_id, contact_name, latest_version.get('image_path'))
+                            ))
+                        else:
+                            self.copy_export_image(latest_version.get('image_path'), contact_folder, contact_id)
                     else:
                         failed_contacts.append(f"{contact_name} (无生成记录)")
                         
@@ -1304,21 +1475,92 @@ class NewYearGreetingWindow(QMainWindow):
                     print(f"导出失败 - 联系人: {contact_name}, 错误: {str(e)}")
                     failed_contacts.append(f"{contact_name} (错误: {str(e)})")
             
-            progress.setValue(len(selected_contacts))
+            # 同一模板的贺卡作为批量任务提交，每个渲染进程只加载一次模板页面
+            if not progress.wasCanceled():
+                for template_number, entries in export_batches.items():
+                    job_ids = self.render_farm.submit_batch(
+                        template_number,
+                        [(user_id, data) for user_id, data, _ in entries],
+                        callback=self.render_bridge.callback,
+                        output=self.EXPORT_OUTPUT
+                    )
+                    for job_id, (_, _, export_info) in zip(job_ids, entries):
+                        self._export_jobs[job_id] = export_info
             
-            # 显示导出结果
-            if failed_contacts:
-                failed_msg = "\n".join(failed_contacts)
-                QMessageBox.warning(
-                    self,
-                    '导出结果',
-                    f'部分联系人导出失败：\n\n{failed_msg}\n\n其他联系人已成功导出到桌面的"2025新年祝福整理"文件夹'
-                )
-            else:
-                QMessageBox.information(self, '导出成功', f'数据已成功导出到桌面的"2025新年祝福整理"文件夹')
+            self._export_state = {'folder': export_folder, 'failed': failed_contacts, 'progress': progress}
+            if not self._export_jobs or progress.wasCanceled():
+                self.finish_export()
+                return
+                
+            # 等待高清贺卡在后台渲染完成，界面保持响应
+            progress.setRange(0, len(self._export_jobs))
+            progress.setValue(0)
+            progress.setLabelText(f"正在渲染高清贺卡 (0/{len(self._export_jobs)})...")
+            progress.canceled.connect(self.finish_export)
             
-            # 打开导出文件夹
-            os.startfile(export_folder)
+        except Exception as e:
+            self._export_jobs.clear()
+            self._export_state = None
+            QMessageBox.critical(self, '导出失败', f'导出过程中发生错误：{str(e)}')
             
+    def copy_export_image(self, image_path, contact_folder, contact_id):
+        """把已生成的贺卡图片复制到导出文件夹
+        
+        Returns:
+            bool: 是否复制成功
+        """
+        if not image_path or not os.path.exists(image_path):
+            return False
+        shutil.copy2(image_path, os.path.join(contact_folder, f"{contact_id}{os.path.splitext(image_path)[1]}"))
+        return True
+        
+    def handle_export_render_finished(self, job_id, img_path, error_msg):
+        """导出用的高清贺卡渲染完成后移动到导出文件夹"""
+        if job_id not in self._export_jobs:
+            return
+        contact_folder, contact_id, contact_name, original_image = self._export_jobs.pop(job_id)
+        try:
+            if error_msg:
+                print(f"重新渲染高清贺卡失败，改为复制已生成的图片: {error_msg}")
+                self.copy_export_image(original_image, contact_folder, contact_id)
+            else:
+                shutil.move(img_path, os.path.join(contact_folder, f"{contact_id}{os.path.splitext(img_path)[1]}"))
         except Exception as e:
-            QMessageBox.critical(self, '导出失败', f'导出过程中发生错误：{str(e)}') 
+            print(f"导出图片失败 - 联系人: {contact_name}, 错误: {str(e)}")
+            if self._export_state:
+                self._export_state['failed'].append(f"{contact_name} (错误: {str(e)})")
+                
+        if self._export_state is None:
+            return
+        progress = self._export_state['progress']
+        done = progress.maximum() - len(self._export_jobs)
+        progress.setLabelText(f"正在渲染高清贺卡 ({done}/{progress.maximum()})...")
+        if self._export_jobs:
+            progress.setValue(done)
+        else:
+            self.finish_export()
+            
+    def finish_export(self):
+        """导出完成（或取消）后显示结果"""
+        state, self._export_state = self._export_state, None
+        if state is None:
+            return
+        # 取消时不再等待尚未完成的渲染任务
+        self._export_jobs.clear()
+        # 关闭对话框会再次发出 canceled 信号，此时 _export_state 已清空
+        state['progress'].close()
+        
+        # 显示导出结果
+        failed_contacts = state['failed']
+        if failed_contacts:
+            failed_msg = "\n".join(failed_contacts)
+            QMessageBox.warning(
+                self,
+                '导出结果',
+                f'部分联系人导出失败：\n\n{failed_msg}\n\n其他联系人已成功导出到桌面的"2025新年祝福整理"文件夹'
+            )
+        else:
+            QMessageBox.information(self, '导出成功', f'数据已成功导出到桌面的"2025新年祝福整理"文件夹')
+            
+        # 打开导出文件夹
+        os.startfile(state['folder']) 
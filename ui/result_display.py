@@ -18,19 +18,25 @@ class ResultDisplay(QWidget):
     regenerate_requested = pyqtSignal(dict)  # 请求重新生成
     version_selected = pyqtSignal(dict)  # 版本被选中
     export_requested = pyqtSignal(dict)  # 请求导出
+    version_changed = pyqtSignal(str, dict)  # 版本管理器中的版本发生变化（可能来自后台线程）
+    
+    CARD_IMAGE_HEIGHT = 360  # 贺卡图片的显示高度
     
     def __init__(self, version_manager=None, parent=None):
         super().__init__(parent)
         self.current_version = None
         self.versions = []  # 存储所有版本
+        self.version_items = {}  # 联系人ID -> 版本列表中的行
         self.version_manager = version_manager  # 保存版本管理器引用
         self.search_helper = SearchHelper()  # 初始化搜索助手
         self.parent_window = parent  # 保存父窗口引用
         self.init_ui()
         self.set_styles()  # 应用样式
         
-        # 加载已有版本
+        # 加载已有版本，之后只按变化通知更新对应的行
         if self.version_manager:
+            self.version_changed.connect(self.on_version_changed)
+            self.version_manager.add_listener(self.version_changed.emit)
             self.load_version_history()
             
     def init_ui(self):
@@ -198,6 +204,14 @@ class ResultDisplay(QWidget):
         content_widget = QWidget()
         content_layout = QVBoxLayout(content_widget)
         
+        # 贺卡图片（先显示预览图，高清图生成后替换）
+        self.card_image_label = QLabel()
+        self.card_image_label.setObjectName("card-image")
+        self.card_image_label.setAlignment(Qt.AlignCenter)
+        self.card_image_label.setFixedHeight(self.CARD_IMAGE_HEIGHT)
+        self.card_image_label.hide()
+        content_layout.addWidget(self.card_image_label)
+        
         # 新年祝福寄语
         greeting_group = self.create_content_group("新年祝福寄语", "greeting")
         content_layout.addWidget(greeting_group)
@@ -258,6 +272,13 @@ class ResultDisplay(QWidget):
         regenerate_btn.clicked.connect(self.on_regenerate_clicked)
         button_layout.addWidget(regenerate_btn)
         
+        # 星标按钮，星标版本不会被保留策略删除
+        self.star_btn = QPushButton("☆ 星标")
+        self.star_btn.setObjectName("secondary-button")
+        self.star_btn.setFixedWidth(80)  # 固定按钮宽度
+        self.star_btn.clicked.connect(self.on_star_clicked)
+        button_layout.addWidget(self.star_btn)
+        
         # 导出按钮
         # export_btn = QPushButton("导出")
         # export_btn.setObjectName("secondary-button")
@@ -379,11 +400,12 @@ class ResultDisplay(QWidget):
         
     def load_version_history(self):
         """加载版本历史"""
-        # 获取所有版本数据
-        all_versions = self.version_manager.get_all_versions()
+        # 只读取每个联系人最新版本的摘要，完整内容在选中时再加载
+        summaries = self.version_manager.get_version_index()
         
         # 清空当前版本列表
         self.versions = []
+        self.version_items = {}
         
         # 清空版本列表UI
         while self.version_list.layout().count():
@@ -391,24 +413,74 @@ class ResultDisplay(QWidget):
             if item.widget():
                 item.widget().deleteLater()
                 
-        # 添加所有版本，每个联系人只保留最新版本
-        for wxid, versions in all_versions.items():
-            if versions:  # 确保有版本
-                # 按版本号排序，获取最新版本
-                latest_version = max(versions, key=lambda x: x.get('version_number', 0))
-                self.add_version(latest_version)
+        # 每个联系人显示最新版本
+        for summary in summaries:
+            self.add_version(summary)
                 
         # 如果有版本，显示最新的一个
         if self.versions:
             self.select_version(self.versions[-1])
             
-    def update_content(self, version_info):
-        """更新内容显示"""
+    def on_version_changed(self, event, version_info):
+        """版本新增、修改或删除后只更新该联系人的一行
+        
+        Args:
+            event: 'added'、'updated' 或 'deleted'
+            version_info: 变化的版本
+        """
+        contact_id = version_info['contact']['wxid']
+        item = self.version_items.get(contact_id)
+        # 变化的不是该联系人的最新版本时，列表无需变化
+        if item and version_info.get('version_number', 0) < item.property('version_number'):
+            return
+        if event == 'deleted':
+            if item:
+                self.remove_version_item(contact_id)
+                latest = self.version_manager.get_latest_version(contact_id)
+                if latest:
+                    self.add_version(latest)
+            return
+        self.add_version(version_info, move_to_end=(event == 'added'))
+        
+    def remove_version_item(self, contact_id):
+        """从版本列表中移除联系人的一行"""
+        item = self.version_items.pop(contact_id, None)
+        if item:
+            self.version_list.layout().removeWidget(item)
+            item.deleteLater()
+        self.versions = [v for v in self.versions if v['contact']['wxid'] != contact_id]
+        
+    def show_card_image(self, image_path, preview=False):
+        """显示贺卡图片
+        
+        Args:
+            image_path: 图片路径，为空或文件不存在时隐藏图片
+            preview: 是否为低分辨率预览图
+        """
+        pixmap = QPixmap(image_path) if image_path and os.path.exists(image_path) else QPixmap()
+        if pixmap.isNull():
+            self.card_image_label.clear()
+            self.card_image_label.hide()
+            return
+        self.card_image_label.setPixmap(
+            pixmap.scaledToHeight(self.CARD_IMAGE_HEIGHT, Qt.SmoothTransformation)
+        )
+        self.card_image_label.setToolTip("预览图，高清贺卡生成中..." if preview else "")
+        self.card_image_label.show()
+        
+    def update_content(self, version_info, preview=False):
+        """更新内容显示
+        
+        Args:
+            version_info: 版本信息
+            preview: version_info 中的图片是否为低分辨率预览图
+        """
         if not version_info:
             self.clear_content()
             return
             
         self.current_version = version_info
+        self.star_btn.setText("★ 已星标" if version_info.get('starred') else "☆ 星标")
         
         # 更新联系人信息
         contact = version_info.get('contact', {})
@@ -441,6 +513,9 @@ class ResultDisplay(QWidget):
         self.idioms_text.setText(version_info.get('idioms', ''))     # 新年祝福成语
         self.wishes_text.setText(version_info.get('wishes', ''))     # 新年祝福愿望
         
+        # 更新贺卡图片
+        self.show_card_image(version_info.get('image_path'), preview)
+        
         # 更新版本列表选中状态
         self.update_version_selection(version_info)
         
@@ -460,6 +535,12 @@ class ResultDisplay(QWidget):
         print("\n=== 开始选择版本 ===")
         print(f"选择版本: 联系人={version_info['contact'].get('name', '')}, 版本号=V{version_info.get('version_number', '')}")
         
+        # 列表中的摘要只含基本信息，选中时再加载完整的版本内容
+        if version_info.get('is_summary') and self.version_manager:
+            full_version = self.version_manager.get_latest_version(version_info['contact']['wxid'])
+            if full_version:
+                version_info = full_version
+        
         # 更新显示内容
         self.update_content(version_info)
         
@@ -535,6 +616,19 @@ class ResultDisplay(QWidget):
         self.regenerate_requested.emit(regenerate_info)
         print("=== 重新生成流程结束 ===\n")
         
+    def on_star_clicked(self):
+        """切换当前版本的星标"""
+        if not self.current_version or not self.version_manager:
+            return
+        version = self.version_manager.set_starred(
+            self.current_version['contact']['wxid'],
+            self.current_version.get('version_number'),
+            not self.current_version.get('starred', False)
+        )
+        if version:
+            self.current_version = version
+            self.star_btn.setText("★ 已星标" if version.get('starred') else "☆ 星标")
+            
     def get_style_display_text(self, style):
         """获取风格的显示文本"""
         style_texts = {
@@ -583,6 +677,7 @@ class ResultDisplay(QWidget):
         self.poem_text.clear()      # 新年祝福诗
         self.idioms_text.clear()    # 新年祝福成语
         self.wishes_text.clear()    # 新年祝福愿望
+        self.show_card_image(None)
         
     def set_styles(self):
         """设置样式"""
@@ -786,17 +881,17 @@ class ResultDisplay(QWidget):
             }
         """) 
 
-    def add_version(self, version_info):
-        """添加新版本"""
+    def add_version(self, version_info, move_to_end=True):
+        """添加新版本
+        
+        Args:
+            version_info: 版本信息
+            move_to_end: 已有该联系人的行时是否移到列表末尾（列表按时间排列，修改版本时不移动）
+        """
         contact_id = version_info['contact']['wxid']
         
         # 检查是否已存在该联系人的版本项
-        existing_version = None
-        for i in range(self.version_list.layout().count()):
-            widget = self.version_list.layout().itemAt(i).widget()
-            if widget and widget.property('contact_id') == contact_id:
-                existing_version = widget
-                break
+        existing_version = self.version_items.get(contact_id)
         
         if existing_version:
             # 更新现有版本项的显示
@@ -805,6 +900,13 @@ class ResultDisplay(QWidget):
             time_label = existing_version.findChild(QLabel, "version-time")
             time_label.setText(version_info.get('create_time', '').split()[1])
             existing_version.mousePressEvent = lambda e, v=version_info: self.select_version(v)
+            existing_version.setProperty('version_number', version_info['version_number'])
+            
+            # 列表按时间排列，新版本的行移到末尾
+            if move_to_end:
+                self.version_list.layout().removeWidget(existing_version)
+                self.version_list.layout().addWidget(existing_version)
+            self.versions = [v for v in self.versions if v['contact']['wxid'] != contact_id]
             self.versions.append(version_info)
         else:
             # 创建新的版本项
@@ -885,8 +987,10 @@ class ResultDisplay(QWidget):
             # 设置点击事件
             version_item.mousePressEvent = lambda e, v=version_info: self.select_version(v)
             version_item.setProperty('contact_id', contact_id)
+            version_item.setProperty('version_number', version_info['version_number'])
             version_item.setCursor(Qt.PointingHandCursor)
             
             # 添加到版本列表
             self.version_list.layout().addWidget(version_item)
+            self.version_items[contact_id] = version_item
             self.versions.append(version_info) 
@@ -0,0 +1,308 @@
+"""
+按内容哈希寻址的二进制文件存储，用于版本历史中的头像和贺卡图片
+
+相同内容只保存一份，文件按哈希前两位分目录存放（blobs/ab/abcd...）；
+每个对象记录引用计数，引用计数降为0时删除文件。
+引用计数的变化追加到 refs.log，积累到一定行数后才合并重写 refs.json，每次修改的写入量与对象总数无关。
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+
+class BlobStore:
+    """内容寻址的二进制存储
+
+    对象的键为内容的SHA-256，保存文件时附带原文件的扩展名（如 abcd....jpg），便于直接打开。
+    引用计数的修改先保存在内存中，调用 flush() 时写入文件并删除不再被引用的对象。
+    """
+
+    REFS_FILE = 'refs.json'
+    REFS_LOG = 'refs.log'
+    # refs.log 超过该行数时合并到 refs.json
+    REFS_LOG_LIMIT = 1000
+    # 内存中缓存的小对象（头像）数量和大小上限
+    CACHE_SIZE = 256
+    CACHE_MAX_BYTES = 256 * 1024
+
+    def __init__(self, blob_dir: str):
+        """
+        Args:
+            blob_dir: 存储目录
+        """
+        self.blob_dir = blob_dir
+        os.makedirs(blob_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._log_lines = 0
+        # 引用计数文件损坏时不能据此删除对象，需先 rebuild_refs
+        self._refs_trusted = True
+        self._refs: Dict[str, int] = self._load_refs()
+        # 尚未写入 refs.log 的变化
+        self._deltas: Dict[str, int] = {}
+        # 需要重写 refs.json
+        self._refs_dirty = False
+        self._garbage = set()
+        self._cache: 'OrderedDict[str, bytes]' = OrderedDict()
+
+    def _load_refs(self) -> Dict[str, int]:
+        """读取引用计数快照并重放 refs.log"""
+        refs = {}
+        try:
+            with open(os.path.join(self.blob_dir, self.REFS_FILE), 'r', encoding='utf-8') as f:
+                refs = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取引用计数失败: {str(e)}")
+            self._refs_trusted = False
+
+        log_path = os.path.join(self.blob_dir, self.REFS_LOG)
+        try:
+            with open(log_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return refs
+        if data and not data.endswith(b'\n'):
+            # 写入时崩溃留下的半行
+            data = data[:data.rfind(b'\n') + 1]
+            with open(log_path, 'r+b') as f:
+                f.truncate(len(data))
+        lines = data.decode('utf-8').splitlines()
+        for line in lines:
+            key, _, delta = line.rpartition(' ')
+            try:
+                refs[key] = refs.get(key, 0) + int(delta)
+            except ValueError:
+                continue
+            if refs[key] <= 0:
+                refs.pop(key)
+        self._log_lines = len(lines)
+        return refs
+
+    def path(self, key: str) -> str:
+        """对象的文件路径"""
+        return os.path.join(self.blob_dir, key[:2], key)
+
+    def exists(self, key: Optional[str]) -> bool:
+        """对象是否存在"""
+        return bool(key) and os.path.exists(self.path(key))
+
+    def put(self, data: bytes, ext: str = '') -> str:
+        """保存二进制内容（内容已存在时直接返回）
+
+        Args:
+            data: 二进制内容
+            ext: 文件扩展名（含点），如 '.jpg'
+
+        Returns:
+            str: 对象的键
+        """
+        key = hashlib.sha256(data).hexdigest() + ext.lower()
+        path = self.path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        else:
+            # 更新修改时间，避免刚写入、尚未增加引用计数的对象被 collect_garbage 删除
+            os.utime(path, None)
+        self._remember(key, data)
+        return key
+
+    def put_file(self, file_path: str) -> str:
+        """保存文件内容，对象的键带有原文件的扩展名
+
+        Returns:
+            str: 对象的键
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        key = digest.hexdigest() + os.path.splitext(file_path)[1].lower()
+        path = self.path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, path)
+        else:
+            os.utime(path, None)
+        return key
+
+    def get(self, key: Optional[str]) -> Optional[bytes]:
+        """读取对象内容，不存在时返回None"""
+        if not key:
+            return None
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def _remember(self, key: str, data: bytes):
+        """缓存小对象，同一联系人的多个版本共用一份头像"""
+        if len(data) > self.CACHE_MAX_BYTES:
+            return
+        with self._lock:
+            self._cache[key] = data
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def refcount(self, key: str) -> int:
+        """对象的引用计数"""
+        with self._lock:
+            return self._refs.get(key, 0)
+
+    def refcounts(self) -> Dict[str, int]:
+        """所有对象的引用计数"""
+        with self._lock:
+            return dict(self._refs)
+
+    def incref(self, key: Optional[str], count: int = 1):
+        """增加引用计数"""
+        if not key:
+            return
+        with self._lock:
+            self._refs[key] = self._refs.get(key, 0) + count
+            self._deltas[key] = self._deltas.get(key, 0) + count
+            self._garbage.discard(key)
+
+    def decref(self, key: Optional[str], count: int = 1):
+        """减少引用计数，降为0的对象在 flush() 时删除"""
+        if not key:
+            return
+        with self._lock:
+            remaining = self._refs.get(key, 0) - count
+            self._deltas[key] = self._deltas.get(key, 0) - min(count, self._refs.get(key, 0))
+            if remaining > 0:
+                self._refs[key] = remaining
+            else:
+                self._refs.pop(key, None)
+                self._garbage.add(key)
+
+    def flush(self):
+        """写入引用计数并删除不再被引用的对象"""
+        with self._lock:
+            deltas = {key: delta for key, delta in self._deltas.items() if delta}
+            try:
+                if self._refs_dirty or self._log_lines + len(deltas) > self.REFS_LOG_LIMIT:
+                    self._write_refs()
+                elif deltas:
+                    with open(os.path.join(self.blob_dir, self.REFS_LOG), 'a', encoding='utf-8') as f:
+                        f.write(''.join(f"{key} {delta:+d}\n" for key, delta in deltas.items()))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._log_lines += len(deltas)
+            except Exception as e:
+                print(f"保存引用计数失败: {str(e)}")
+                return
+            self._deltas.clear()
+            garbage, self._garbage = self._garbage, set()
+            for key in garbage:
+                if key in self._refs:
+                    continue
+                self._cache.pop(key, None)
+                try:
+                    os.remove(self.path(key))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"删除对象失败: {key}, 错误: {str(e)}")
+
+    def _write_refs(self):
+        """重写 refs.json 并清空 refs.log"""
+        refs_path = os.path.join(self.blob_dir, self.REFS_FILE)
+        tmp_path = f"{refs_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._refs, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, refs_path)
+        log_path = os.path.join(self.blob_dir, self.REFS_LOG)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        self._log_lines = 0
+        self._refs_dirty = False
+
+    def rebuild_refs(self, keys: Iterable[str]):
+        """按实际引用重建引用计数，并删除未被引用的对象
+
+        Args:
+            keys: 所有引用（同一对象被引用几次就出现几次）
+        """
+        refs: Dict[str, int] = {}
+        for key in keys:
+            if key:
+                refs[key] = refs.get(key, 0) + 1
+        with self._lock:
+            self._refs = refs
+            self._refs_dirty = True
+            self._refs_trusted = True
+            self._garbage = {key for key in self.keys() if key not in refs}
+        self.flush()
+
+    def collect_garbage(self, min_age: float = 3600) -> int:
+        """删除引用计数为0的对象和残留的临时文件（写入后崩溃、未记录引用的图片）
+
+        Args:
+            min_age: 只删除修改时间早于该秒数的文件，避免删除刚写入、尚未增加引用计数的对象
+
+        Returns:
+            int: 删除的文件数
+        """
+        if not self._refs_trusted:
+            print("引用计数未能正确加载，跳过清理未引用的对象")
+            return 0
+        removed = 0
+        cutoff = time.time() - min_age
+        for entry in os.scandir(self.blob_dir):
+            if not entry.is_dir():
+                continue
+            for blob in os.scandir(entry.path):
+                if not blob.is_file():
+                    continue
+                with self._lock:
+                    if blob.name in self._refs:
+                        continue
+                    try:
+                        if blob.stat().st_mtime >= cutoff:
+                            continue
+                        os.remove(blob.path)
+                    except FileNotFoundError:
+                        continue
+                    except OSError as e:
+                        print(f"删除对象失败: {blob.name}, 错误: {str(e)}")
+                        continue
+                    self._cache.pop(blob.name, None)
+                    removed += 1
+        return removed
+
+    def keys(self):
+        """存储中的所有对象"""
+        for entry in os.scandir(self.blob_dir):
+            if not entry.is_dir():
+                continue
+            for blob in os.scandir(entry.path):
+                if blob.is_file() and not blob.name.endswith('.tmp'):
+                    yield blob.name
@@ -0,0 +1,107 @@
+"""
+贺卡图片的输出选项：格式、质量、压缩级别和输出尺寸
+"""
+import io
+from typing import Dict, Optional, Union
+
+
+class OutputOptions:
+    """贺卡图片的输出选项
+
+    浏览器渲染时格式、质量和缩放直接交给截图接口完成，只有指定PNG压缩级别时才用Pillow重新编码；
+    Pillow渲染时在保存图片时一并处理。
+    """
+
+    # 格式 -> 文件扩展名
+    FORMATS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+    def __init__(self, format: str = 'png', quality: int = 90, compression_level: Optional[int] = None,
+                 width: Optional[int] = None, scale: float = 1.0):
+        """
+        Args:
+            format: 图片格式，'png'、'jpeg' 或 'webp'
+            quality: JPEG/WebP 的质量（1~100），PNG忽略
+            compression_level: PNG压缩级别（0~9），为None时使用浏览器默认编码，不再重新压缩
+            width: 输出图片的宽度（像素），指定后忽略 scale
+            scale: 相对于模板尺寸的缩放比例（设备像素比）
+        """
+        format = format.lower()
+        if format == 'jpg':
+            format = 'jpeg'
+        if format not in self.FORMATS:
+            raise ValueError(f'不支持的图片格式: {format}')
+        self.format = format
+        self.quality = max(1, min(100, int(quality)))
+        self.compression_level = compression_level
+        self.width = width
+        self.scale = scale
+
+    @property
+    def ext(self) -> str:
+        """文件扩展名"""
+        return self.FORMATS[self.format]
+
+    def scale_for(self, source_width: float) -> float:
+        """计算相对于模板宽度的缩放比例"""
+        if self.width and source_width:
+            return self.width / source_width
+        return self.scale
+
+    def to_dict(self) -> Dict:
+        """转换为字典（用于渲染缓存的键）"""
+        return {
+            'format': self.format,
+            'quality': self.quality if self.format != 'png' else None,
+            'compression_level': self.compression_level if self.format == 'png' else None,
+            'width': self.width,
+            'scale': None if self.width else self.scale
+        }
+
+    def save_image(self, image, output_path: str):
+        """按输出选项缩放并保存Pillow图片"""
+        from PIL import Image
+
+        scale = self.scale_for(image.width)
+        if scale != 1:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+        if self.format == 'png':
+            image.save(output_path, 'PNG', compress_level=6 if self.compression_level is None else self.compression_level)
+        elif self.format == 'jpeg':
+            image.convert('RGB').save(output_path, 'JPEG', quality=self.quality, optimize=True)
+        else:
+            image.save(output_path, 'WEBP', quality=self.quality)
+
+    def recompress_png(self, data: bytes) -> bytes:
+        """按指定的压缩级别重新编码PNG数据"""
+        if self.format != 'png' or self.compression_level is None:
+            return data
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data)) as image:
+            buffer = io.BytesIO()
+            image.save(buffer, 'PNG', optimize=self.compression_level >= 9, compress_level=self.compression_level)
+        return buffer.getvalue()
+
+
+# 常用的输出配置：预览用小图，发送微信用适中的JPEG，导出用高清PNG
+OUTPUT_PRESETS = {
+    'preview': OutputOptions(format='jpeg', quality=70, scale=0.5),
+    'send': OutputOptions(format='jpeg', quality=88, scale=1.0),
+    'export': OutputOptions(format='png', compression_level=9, scale=2.0),
+}
+
+
+def get_output_options(output: Union[None, str, OutputOptions] = None) -> OutputOptions:
+    """获取输出选项
+
+    Args:
+        output: None（PNG原尺寸）、预设名称（见 OUTPUT_PRESETS）或 OutputOptions 实例
+    """
+    if output is None:
+        return OutputOptions()
+    if isinstance(output, OutputOptions):
+        return output
+    if output not in OUTPUT_PRESETS:
+        raise ValueError(f'未知的输出预设: {output}')
+    return OUTPUT_PRESETS[output]
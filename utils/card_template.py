@@ -0,0 +1,199 @@
+"""
+贺卡模板注册表：模板只从磁盘读取一次，内联其引用的CSS、字体和图片，
+并预先编译为“文本片段 + 占位符”列表，渲染时一次拼接完成
+"""
+import os
+import re
+import base64
+import hashlib
+import pathlib
+import mimetypes
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+# 模板中支持的占位符
+PLACEHOLDER_KEYS = (
+    'year', 'greeting_text', 'idioms_text_1', 'idioms_text_2',
+    'wishes_text', 'signature', 'tag_1', 'tag_2', 'tag_3'
+)
+_PLACEHOLDER_PATTERN = re.compile(r'\{(' + '|'.join(PLACEHOLDER_KEYS) + r')\}')
+
+_STYLESHEET_LINK_PATTERN = re.compile(
+    r'<link\b[^>]*\brel\s*=\s*["\']?stylesheet["\']?[^>]*>', re.IGNORECASE
+)
+_HREF_PATTERN = re.compile(r'\bhref\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+_STYLE_BLOCK_PATTERN = re.compile(r'(<style\b[^>]*>)(.*?)(</style>)', re.IGNORECASE | re.DOTALL)
+_CSS_URL_PATTERN = re.compile(r'url\(\s*(["\']?)([^"\')]+)\1\s*\)', re.IGNORECASE)
+_IMG_SRC_PATTERN = re.compile(r'(<img\b[^>]*\bsrc\s*=\s*)(["\'])([^"\']+)\2', re.IGNORECASE)
+_HEAD_PATTERN = re.compile(r'<head[^>]*>', re.IGNORECASE)
+
+# mimetypes 在部分系统上缺少字体类型
+_EXTRA_MIME_TYPES = {
+    '.woff2': 'font/woff2',
+    '.woff': 'font/woff',
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.svg': 'image/svg+xml',
+    '.webp': 'image/webp',
+}
+
+
+class CardTemplate:
+    """编译后的贺卡模板"""
+
+    def __init__(self, path: str, base_dir: Optional[str] = None):
+        """
+        Args:
+            path: 模板文件路径
+            base_dir: 解析模板中相对路径的目录，默认为当前工作目录（与原先页面所在目录一致），
+                找不到时再相对于模板所在目录查找
+        """
+        self.path = path
+        self.base_dir = os.path.abspath(base_dir or os.getcwd())
+        self.template_dir = os.path.dirname(os.path.abspath(path))
+        self.content_hash = ''
+        self._segments = ([''], [])  # (文本片段列表, 占位符列表)
+        self._dependencies: Dict[str, float] = {}
+        self.load()
+
+    def load(self):
+        """读取模板、内联资源并编译占位符"""
+        self._dependencies = {}
+        source = self._read_text(self.path)
+        source = self._inline_stylesheets(source)
+        source = _STYLE_BLOCK_PATTERN.sub(
+            lambda m: m.group(1) + self._inline_css_urls(m.group(2), self.template_dir) + m.group(3),
+            source
+        )
+        source = _IMG_SRC_PATTERN.sub(self._inline_img_src, source)
+        source = self._add_base_href(source)
+        self.content_hash = hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+        # 编译为交替的文本片段和占位符：literals[0] key[0] literals[1] key[1] ... literals[n]
+        parts = _PLACEHOLDER_PATTERN.split(source)
+        self._segments = (parts[0::2], parts[1::2])
+
+    @property
+    def placeholders(self) -> set:
+        """模板中出现的占位符"""
+        return set(self._segments[1])
+
+    def is_stale(self) -> bool:
+        """模板文件或其引用的资源是否在加载后被修改"""
+        for path, mtime in self._dependencies.items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def render(self, replace_data: Dict) -> str:
+        """将数据填入模板，返回完整HTML"""
+        literals, keys = self._segments
+        out = [literals[0]]
+        for i, key in enumerate(keys):
+            out.append(str(replace_data.get(key, '{' + key + '}')))
+            out.append(literals[i + 1])
+        return ''.join(out)
+
+    def _read_text(self, path: str) -> str:
+        """读取文本文件并记录修改时间"""
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        self._dependencies[path] = os.path.getmtime(path)
+        return content
+
+    def _resolve(self, url: str, relative_to: str) -> Optional[str]:
+        """将模板中的相对地址解析为本地文件路径，远程地址和data地址返回None"""
+        if url.lower().startswith('file:'):
+            path = url2pathname(urlparse(url).path)
+            return path if os.path.isfile(path) else None
+        if re.match(r'^(?:[a-z][a-z0-9+.-]*:|//|#)', url, re.IGNORECASE):
+            return None
+        url = url.split('#', 1)[0].split('?', 1)[0]
+        for directory in (relative_to, self.base_dir, self.template_dir):
+            candidate = os.path.normpath(os.path.join(directory, url))
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def _data_uri(self, path: str) -> str:
+        """将本地文件转换为data地址并记录修改时间"""
+        ext = os.path.splitext(path)[1].lower()
+        mime = _EXTRA_MIME_TYPES.get(ext) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        with open(path, 'rb') as f:
+            data = f.read()
+        self._dependencies[path] = os.path.getmtime(path)
+        return f'data:{mime};base64,{base64.b64encode(data).decode("ascii")}'
+
+    def _inline_stylesheets(self, html: str) -> str:
+        """把本地样式表链接替换为内联的<style>"""
+        def replace(match):
+            href = _HREF_PATTERN.search(match.group(0))
+            path = self._resolve(href.group(1), self.base_dir) if href else None
+            if not path:
+                return match.group(0)
+            css = self._read_text(path)
+            return '<style>' + self._inline_css_urls(css, os.path.dirname(path)) + '</style>'
+        return _STYLESHEET_LINK_PATTERN.sub(replace, html)
+
+    def _inline_css_urls(self, css: str, css_dir: str) -> str:
+        """把CSS中引用的本地字体和图片替换为data地址"""
+        def replace(match):
+            path = self._resolve(match.group(2), css_dir)
+            if not path:
+                return match.group(0)
+            return f'url("{self._data_uri(path)}")'
+        return _CSS_URL_PATTERN.sub(replace, css)
+
+    def _inline_img_src(self, match) -> str:
+        """把<img>引用的本地图片替换为data地址"""
+        path = self._resolve(match.group(3), self.base_dir)
+        if not path:
+            return match.group(0)
+        return f'{match.group(1)}{match.group(2)}{self._data_uri(path)}{match.group(2)}'
+
+    def _add_base_href(self, html: str) -> str:
+        """插入<base>，使未能内联的相对路径仍相对于 base_dir 解析"""
+        base_tag = f'<base href="{pathlib.Path(self.base_dir).as_uri()}/">'
+        match = _HEAD_PATTERN.search(html)
+        if match:
+            return html[:match.end()] + base_tag + html[match.end():]
+        return base_tag + html
+
+
+class TemplateRegistry:
+    """贺卡模板注册表，按路径缓存编译后的模板，文件修改后自动重新加载"""
+
+    def __init__(self):
+        self._templates: Dict[str, CardTemplate] = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_path: str) -> CardTemplate:
+        """获取编译后的模板"""
+        key = os.path.abspath(template_path)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                template = CardTemplate(template_path)
+                self._templates[key] = template
+            elif template.is_stale():
+                print(f"模板已修改，重新加载: {template_path}")
+                template.load()
+            return template
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._templates.clear()
+
+
+_registry = TemplateRegistry()
+
+
+def get_template_registry() -> TemplateRegistry:
+    """获取进程内共享的模板注册表"""
+    return _registry
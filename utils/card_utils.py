@@ -3,20 +3,29 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 import os
 import json
+import base64
+import queue
+import atexit
 import shutil
-from datetime import datetime
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from newYear.utils.card_template import get_template_registry
+from newYear.utils.render_cache import get_render_cache
+from newYear.utils.card_output import get_output_options
 
 def ensure_directory(directory):
     """确保目录存在，如果不存在则创建"""
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-def inject_data_to_template(template_path, data):
-    """将数据注入到模板中
+def build_replace_data(data):
+    """将贺卡数据转换为模板占位符对应的替换数据
     Args:
-        template_path: 模板文件路径
         data: 包含以下字段的字典：
             - year: 年份
             - greeting_text: 新年祝福寄语（主标题）
@@ -25,9 +34,6 @@ def inject_data_to_template(template_path, data):
             - wishes_text: 新年祝福愿望
             - signature: 署名
     """
-    with open(template_path, 'r', encoding='utf-8') as f:
-        template_content = f.read()
-    
     # 处理祝福诗（分割成两句）
     poem_lines = data.get('poem_text', '梦想飞扬似朝阳,岁岁安康伴春寒').split(',')
     if len(poem_lines) < 2:
@@ -39,7 +45,7 @@ def inject_data_to_template(template_path, data):
         idioms.append(idioms[-1])
     
     # 准备所有替换数据
-    replace_data = {
+    return {
         'year': data.get('year', '2025'),
         'greeting_text': data.get('greeting_text', '新年快乐'),
         'idioms_text_1': poem_lines[0],
@@ -50,21 +56,205 @@ def inject_data_to_template(template_path, data):
         'tag_2': idioms[1],
         'tag_3': idioms[2]
     }
+
+def inject_data_to_template(template_path, data, work_dir=None):
+    """将数据注入到模板中
+    Args:
+        template_path: 模板文件路径
+        data: 贺卡数据，字段见 build_replace_data
+        work_dir: 存放生成HTML的目录，为None时为本次任务新建一个独立的临时目录，
+            使用完毕后由调用方删除
+
+    Returns:
+        str: 生成的HTML文件路径
+    """
+    # 模板只在首次使用或文件修改后编译，样式、字体和图片已内联
+    template = get_template_registry().get(template_path)
+    html = template.render(build_replace_data(data))
     
-    # 替换所有占位符
-    for key, value in replace_data.items():
-        placeholder = '{' + key + '}'
-        template_content = template_content.replace(placeholder, str(value))
-    
-    # 创建临时文件来存储注入数据后的HTML
-    temp_html_path = 'temp_generated.html'
+    # 每个任务使用独立的目录存放注入数据后的HTML，多个任务可以同时渲染
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='card_render_')
+    temp_html_path = os.path.join(work_dir, 'card.html')
     with open(temp_html_path, 'w', encoding='utf-8') as f:
-        f.write(template_content)
+        f.write(html)
     
     return temp_html_path
 
-def capture_local_html(html_path, output_path, wait_time=2):
-    """截取HTML页面为图片"""
+def create_chrome_driver():
+    """创建无头Chrome实例"""
+    chrome_options = Options()
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--hide-scrollbars')
+    chrome_options.add_argument('--disable-gpu')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    # 设置足够大的初始窗口，确保能完整显示内容
+    chrome_options.add_argument('--window-size=1920,1080')
+    return webdriver.Chrome(options=chrome_options)
+
+
+class BrowserPool:
+    """无头浏览器池
+
+    预先启动并复用若干个Chrome实例，每个截图任务只需重新加载页面，
+    避免每张贺卡都启动和关闭一次浏览器。
+    """
+
+    def __init__(self, size=2):
+        """
+        Args:
+            size: 池中浏览器实例的最大数量，即可同时进行的截图任务数
+        """
+        self.size = size
+        self._idle = queue.LifoQueue()  # 优先复用最近使用过的实例
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        # 新建浏览器实例后以chromedriver的进程ID调用，渲染进程借此向主进程报告（见 render_farm）
+        self.on_driver_started = None
+
+    def warm_up(self, count=None):
+        """预先启动浏览器实例
+
+        Args:
+            count: 预热的实例数量，默认为池大小
+        """
+        count = self.size if count is None else min(count, self.size)
+        drivers = []
+        try:
+            for _ in range(count):
+                driver = self._acquire(timeout=0)
+                if driver is None:
+                    break
+                drivers.append(driver)
+        except Exception as e:
+            print(f"预热浏览器池失败: {str(e)}")
+        for driver in drivers:
+            self._release(driver, healthy=True)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """租用一个浏览器实例，使用完毕后自动归还
+
+        Args:
+            timeout: 池中没有空闲实例时的最长等待时间（秒），None表示一直等待
+        """
+        driver = self._acquire(timeout)
+        if driver is None:
+            raise TimeoutError('等待空闲浏览器实例超时')
+        healthy = True
+        try:
+            yield driver
+        except Exception:
+            healthy = self._is_alive(driver)
+            raise
+        finally:
+            self._release(driver, healthy)
+
+    def shutdown(self):
+        """关闭池中所有浏览器实例"""
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(driver)
+
+    def _acquire(self, timeout):
+        """获取空闲实例，不足时新建；池已满时等待归还"""
+        if self._closed:
+            raise RuntimeError('浏览器池已关闭')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                print("\n初始化Chrome WebDriver...")
+                driver = create_chrome_driver()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            if self.on_driver_started:
+                self.on_driver_started(driver.service.process.pid)
+            return driver
+
+        if timeout == 0:
+            return None
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _release(self, driver, healthy):
+        """归还实例，失效的实例直接关闭"""
+        if healthy and not self._closed:
+            self._idle.put(driver)
+            return
+        self._quit(driver)
+
+    def _quit(self, driver):
+        """关闭浏览器实例"""
+        with self._lock:
+            self._created -= 1
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"关闭WebDriver失败: {str(e)}")
+
+    @staticmethod
+    def _is_alive(driver):
+        """检查浏览器实例是否仍可用"""
+        try:
+            driver.execute_script('return 1')
+            return True
+        except Exception:
+            return False
+
+
+_browser_pool = None
+_browser_pool_lock = threading.Lock()
+
+
+def get_browser_pool(size=None):
+    """获取进程内共享的浏览器池
+
+    Args:
+        size: 池大小，仅在首次创建时生效；默认读取环境变量 CARD_BROWSER_POOL_SIZE，未设置时为2
+    """
+    global _browser_pool
+    with _browser_pool_lock:
+        if _browser_pool is None:
+            if size is None:
+                size = int(os.environ.get('CARD_BROWSER_POOL_SIZE', 2))
+            _browser_pool = BrowserPool(size)
+            atexit.register(_browser_pool.shutdown)
+        return _browser_pool
+
+
+def capture_local_html(html_path, output_path, ready_timeout=10, pool=None, output=None, preview=None):
+    """截取HTML页面为图片
+
+    Args:
+        html_path: HTML文件路径
+        output_path: 图片输出路径
+        ready_timeout: 等待页面渲染就绪的最长时间（秒），超时后直接截图
+        pool: 浏览器池，默认使用进程内共享的浏览器池
+        output: 输出选项（见 card_output.get_output_options），默认为原尺寸PNG
+        preview: (预览图路径, 回调) 元组，指定时在同一次页面加载中先截取低分辨率预览图，
+            保存后以其路径调用回调，再截取完整图片
+
+    Returns:
+        bool: 截图时页面是否已渲染就绪（等待超时后直接截图时为False）
+    """
     print(f"\n=== 开始截取HTML页面 ===")
     print(f"HTML文件路径: {html_path}")
     print(f"输出路径: {output_path}")
@@ -78,99 +268,507 @@ def capture_local_html(html_path, output_path, wait_time=2):
     file_url = f'file:///{abs_path}'
     print(f"文件URL: {file_url}")
     
-    chrome_options = Options()
-    chrome_options.add_argument('--headless')
-    chrome_options.add_argument('--hide-scrollbars')
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--no-sandbox')
-    chrome_options.add_argument('--disable-dev-shm-usage')
-    # 设置足够大的初始窗口，确保能完整显示内容
-    chrome_options.add_argument('--window-size=1920,1080')
+    if pool is None:
+        pool = get_browser_pool()
     
-    driver = None
     try:
-        print("\n1. 初始化Chrome WebDriver...")
-        driver = webdriver.Chrome(options=chrome_options)
-        
-        print("\n2. 加载HTML页面...")
-        driver.get(file_url)
-        
-        print("\n3. 等待页面元素加载...")
-        wait = WebDriverWait(driver, 10)
-        card_container = wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'card-container')))
-        
-        print(f"\n4. 等待页面渲染 ({wait_time}秒)...")
-        import time
-        time.sleep(wait_time)
-        
-        print("\n5. 获取卡片位置和尺寸...")
-        # 获取卡片容器的精确位置和尺寸
-        card_rect = driver.execute_script("""
-            const container = document.querySelector('.card-container');
-            const rect = container.getBoundingClientRect();
-            return {
-                left: rect.left,
-                top: rect.top,
-                width: rect.width,
-                height: rect.height,
-                devicePixelRatio: window.devicePixelRatio
-            };
-        """)
-        
-        print(f"卡片信息: {card_rect}")
-        
-        print("\n6. 截取完整页面...")
-        driver.save_screenshot('temp_full.png')
-        
-        print("\n7. 裁剪卡片区域...")
-        from PIL import Image
-        img = Image.open('temp_full.png')
-        
-        # 计算裁剪坐标（考虑设备像素比）
-        dpr = card_rect['devicePixelRatio']
-        left = int(card_rect['left'] * dpr)
-        top = int(card_rect['top'] * dpr)
-        right = int((card_rect['left'] + card_rect['width']) * dpr)
-        bottom = int((card_rect['top'] + card_rect['height']) * dpr)
-        
-        print(f"裁剪坐标: left={left}, top={top}, right={right}, bottom={bottom}")
-        
-        # 确保裁剪区域不超出图片范围
-        img_width, img_height = img.size
-        left = max(0, left)
-        top = max(0, top)
-        right = min(img_width, right)
-        bottom = min(img_height, bottom)
-        
-        # 裁剪并保存
-        card_img = img.crop((left, top, right, bottom))
-        
-        # 确保输出目录存在
-        output_dir = os.path.dirname(output_path)
-        if output_dir:
-            ensure_directory(output_dir)
-            
-        print("\n8. 保存卡片图片...")
-        card_img.save(output_path, quality=100)  # 使用最高质量
-        print(f'卡片截图已保存至: {output_path}')
-        
-        print("\n9. 清理临时文件...")
-        os.remove('temp_full.png')
-        print("=== 截图完成 ===\n")
+        print("\n1. 从浏览器池获取WebDriver...")
+        with pool.lease() as driver:
+            return _capture_page(driver, file_url, output_path, ready_timeout, get_output_options(output), preview)
         
     except Exception as e:
         error_msg = f'截图过程发生错误: {str(e)}'
         print(f"\nError: {error_msg}")
         raise Exception(error_msg)
+
+
+# 页面渲染就绪检测脚本：等待字体、<img> 图片、CSS背景图加载完成，
+# 以及模板自行发出的渲染完成信号（仅当 .card-container 带有 data-render-signal 属性时），
+# 最后再等待两帧，确保布局和绘制已经完成
+RENDER_READY_SCRIPT = """
+const done = arguments[arguments.length - 1];
+const waits = [];
+if (document.fonts && document.fonts.ready) {
+    waits.push(document.fonts.ready);
+}
+document.querySelectorAll('img').forEach(img => {
+    if (!img.complete) {
+        waits.push(new Promise(resolve => {
+            img.addEventListener('load', resolve, {once: true});
+            img.addEventListener('error', resolve, {once: true});
+        }));
+    } else if (img.decode) {
+        waits.push(img.decode().catch(() => {}));
+    }
+});
+const bgUrls = new Set();
+document.querySelectorAll('*').forEach(el => {
+    const bg = getComputedStyle(el).backgroundImage;
+    (bg.match(/url\\([^)]+\\)/g) || []).forEach(u => {
+        bgUrls.add(u.slice(4, -1).replace(/^["']|["']$/g, ''));
+    });
+});
+bgUrls.forEach(url => waits.push(new Promise(resolve => {
+    const img = new Image();
+    img.onload = img.onerror = resolve;
+    img.src = url;
+})));
+const container = document.querySelector('.card-container');
+if (container && container.hasAttribute('data-render-signal')) {
+    waits.push(new Promise(resolve => {
+        if (window.__cardRendered) {
+            resolve();
+        } else {
+            window.addEventListener('card-rendered', resolve, {once: true});
+        }
+    }));
+}
+Promise.all(waits).then(() => requestAnimationFrame(() => requestAnimationFrame(() => done(true))));
+"""
+
+
+def wait_for_render_ready(driver, timeout):
+    """等待页面渲染就绪
+
+    模板如需在脚本完成排版后再截图，可给 .card-container 加上 data-render-signal 属性，
+    并在完成时设置 window.__cardRendered = true 且派发 window 上的 card-rendered 事件。
+
+    Args:
+        driver: WebDriver实例
+        timeout: 最长等待时间（秒）
+
+    Returns:
+        bool: 是否在超时前就绪
+    """
+    driver.set_script_timeout(timeout)
+    try:
+        driver.execute_async_script(RENDER_READY_SCRIPT)
+        return True
+    except TimeoutException:
+        print(f"警告: 等待页面渲染超时（{timeout}秒），直接截图")
+        return False
+
+
+def capture_element_image(driver, rect, output=None):
+    """通过DevTools协议直接截取指定区域，返回编码后的图片数据
+
+    只截取卡片所在区域，无需先截取整页再裁剪，也不经过临时文件；
+    格式、质量和缩放由浏览器在截图时完成。
+
+    Args:
+        driver: WebDriver实例
+        rect: 区域在文档中的位置和尺寸，包含 left、top、width、height（CSS像素）
+        output: 输出选项，默认为原尺寸PNG
+
+    Returns:
+        bytes: 图片数据
+    """
+    output = get_output_options(output)
+    params = {
+        'format': output.format,
+        'clip': {
+            'x': rect['left'],
+            'y': rect['top'],
+            'width': rect['width'],
+            'height': rect['height'],
+            'scale': output.scale_for(rect['width'])
+        },
+        'captureBeyondViewport': True,
+        'fromSurface': True
+    }
+    if output.format != 'png':
+        params['quality'] = output.quality
+    result = driver.execute_cdp_cmd('Page.captureScreenshot', params)
+    return output.recompress_png(base64.b64decode(result['data']))
+
+
+# 获取卡片容器在文档中的精确位置和尺寸
+CARD_RECT_SCRIPT = """
+    const container = document.querySelector('.card-container');
+    const rect = container.getBoundingClientRect();
+    return {
+        left: rect.left + window.scrollX,
+        top: rect.top + window.scrollY,
+        width: rect.width,
+        height: rect.height,
+        devicePixelRatio: window.devicePixelRatio
+    };
+"""
+
+
+def _write_image(output_path, image_bytes):
+    """保存图片数据，输出目录不存在时先创建"""
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        ensure_directory(output_dir)
+    with open(output_path, 'wb') as f:
+        f.write(image_bytes)
+
+
+def _capture_page(driver, file_url, output_path, ready_timeout, output, preview=None):
+    """在已启动的浏览器中加载页面并截取卡片区域（preview 见 capture_local_html）
+
+    Returns:
+        bool: 截图时页面是否已渲染就绪
+    """
+    print("\n2. 加载HTML页面...")
+    driver.get(file_url)
+    
+    print("\n3. 等待页面元素加载...")
+    wait = WebDriverWait(driver, 10)
+    card_container = wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'card-container')))
+    
+    print(f"\n4. 等待页面渲染就绪（最长{ready_timeout}秒）...")
+    ready = wait_for_render_ready(driver, ready_timeout)
+    
+    print("\n5. 获取卡片位置和尺寸...")
+    # 获取卡片容器在文档中的精确位置和尺寸
+    card_rect = driver.execute_script(CARD_RECT_SCRIPT)
+    
+    print(f"卡片信息: {card_rect}")
+    
+    if preview is not None:
+        # 预览图和完整图片来自同一次页面加载，预览失败不影响完整图片
+        preview_path, preview_callback = preview
+        try:
+            _write_image(preview_path, capture_element_image(driver, card_rect, 'preview'))
+            print(f'预览图已保存至: {preview_path}')
+            preview_callback(preview_path)
+        except Exception as e:
+            print(f"生成预览图失败: {str(e)}")
+    
+    print("\n6. 截取卡片区域...")
+    image_bytes = capture_element_image(driver, card_rect, output)
+        
+    print("\n7. 保存卡片图片...")
+    _write_image(output_path, image_bytes)
+    print(f'卡片截图已保存至: {output_path}')
+    print("=== 截图完成 ===\n")
+    return ready
+
+
+def get_template_renderer(layout_path):
+    """读取模板布局描述中声明的渲染方式
+
+    Args:
+        layout_path: 布局描述文件路径（template_<编号>.layout.json）
+
+    Returns:
+        str: 'pillow' 或 'chrome'，没有布局描述文件时为 'chrome'
+    """
+    if not os.path.exists(layout_path):
+        return 'chrome'
+    try:
+        with open(layout_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('renderer', 'chrome')
+    except (OSError, ValueError) as e:
+        print(f"布局描述文件读取失败，使用浏览器渲染: {str(e)}")
+        return 'chrome'
+
+def get_template_hash(renderer, template_path, layout_path):
+    """获取模板内容（含内联资源）的哈希，用于渲染缓存"""
+    if renderer == 'pillow':
+        from newYear.utils.pillow_renderer import get_pillow_renderer
+        return get_pillow_renderer().get_layout(layout_path).content_hash
+    return get_template_registry().get(template_path).content_hash
+
+def _render_cache_key(template_number, renderer, template_path, layout_path, replace_data, output,
+                      variant=None):
+    """计算渲染缓存的键
+
+    Args:
+        variant: 渲染方式不同于逐张加载页面时的标识（如批量渲染中在同一页面内替换数据），
+            不同方式生成的图片使用不同的键，不会互相覆盖
+    """
+    options = dict(output.to_dict(), renderer=renderer)
+    if variant:
+        options['variant'] = variant
+    return get_render_cache().make_key(
+        template_number, get_template_hash(renderer, template_path, layout_path), replace_data, options
+    )
+
+def render_card(template_number, data, output_path, output=None, pool=None, preview=None):
+    """渲染贺卡图片（不保存版本信息）
+
+    Args:
+        template_number: 模板编号
+        data: 注入模板的数据
+        output_path: 图片输出路径
+        output: 输出选项或预设名称（见 card_output.OUTPUT_PRESETS），默认为原尺寸PNG
+        pool: 浏览器池，默认使用进程内共享的浏览器池
+        preview: (预览图路径, 回调) 元组，仅在浏览器渲染时生效（见 capture_local_html）；
+            命中缓存或使用Pillow绘制时完整图片很快就绪，不再生成预览图
+
+    Returns:
+        str: 图片输出路径
+    """
+    output = get_output_options(output)
+    template_path = f'newYear/template/template_{template_number}.html'
+    layout_path = f'newYear/template/template_{template_number}.layout.json'
+    if os.path.dirname(output_path):
+        ensure_directory(os.path.dirname(output_path))
+    
+    renderer = get_template_renderer(layout_path)
+    if renderer != 'pillow':
+        print(f"\n2. 检查模板文件: {template_path}")
+        if not os.path.exists(template_path):
+            raise FileNotFoundError(f'模板文件不存在: {template_path}')
+    
+    # 模板和内容都没有变化时直接复用之前生成的图片
+    replace_data = build_replace_data(data)
+    cache = get_render_cache()
+    cache_key = _render_cache_key(template_number, renderer, template_path, layout_path, replace_data, output)
+    if cache.fetch(cache_key, output_path, output.ext):
+        print(f"\n3-4. 命中渲染缓存，直接使用已生成的图片: {output_path}")
+    elif renderer == 'pillow':
+        # 模板声明了Pillow布局，直接绘制，不启动浏览器
+        print(f"\n3-4. 使用Pillow按布局绘制贺卡: {layout_path}")
+        from newYear.utils.pillow_renderer import get_pillow_renderer
+        get_pillow_renderer().render(layout_path, replace_data, output_path, output)
+        cache.store(cache_key, output_path, output.ext)
+    else:
+        print("\n3. 注入数据到模板...")
+        work_dir = tempfile.mkdtemp(prefix='card_render_')
+        try:
+            temp_html_path = inject_data_to_template(template_path, data, work_dir)
+            print(f"临时HTML文件已创建: {temp_html_path}")
+            
+            print("\n4. 生成贺卡图片...")
+            ready = capture_local_html(temp_html_path, output_path, pool=pool, output=output, preview=preview)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        # 等待渲染超时时截到的可能是字体或图片尚未加载完的贺卡，不写入缓存，下次重新渲染
+        if ready:
+            cache.store(cache_key, output_path, output.ext)
+        else:
+            print("页面未渲染就绪，本次结果不写入渲染缓存")
+    return output_path
+
+# 批量渲染时用于标记占位符位置的字符（Unicode私用区）
+_MARKER_START = '\ue000'
+_MARKER_END = '\ue001'
+
+# 批量渲染中在同一页面内替换数据生成的图片，在渲染缓存中使用单独的键
+_BATCH_CACHE_VARIANT = 'batch'
+
+# 找出页面中所有含占位符标记的文本节点和属性，返回出现在文本和属性中的占位符、
+# 脚本中是否使用了占位符、以及模板是否通过 data-render-signal 自行排版。
+# <style> 中的文本按原样使用，其余文本和属性值与HTML解析器一样解码字符引用
+BATCH_BIND_SCRIPT = """
+const pattern = /\\uE000(\\w+)\\uE001/g;
+const bindings = [];
+const textKeys = new Set();
+const attrKeys = new Set();
+let scripted = false;
+const collect = (value, keys) => {
+    for (const m of value.matchAll(pattern)) keys.add(m[1]);
+};
+const walker = document.createTreeWalker(document.documentElement, NodeFilter.SHOW_TEXT);
+while (walker.nextNode()) {
+    const node = walker.currentNode;
+    if (!node.nodeValue.includes('\\uE000')) continue;
+    const parent = node.parentElement;
+    if (parent && parent.closest('script')) {
+        scripted = true;
+        continue;
+    }
+    const decode = !(parent && parent.closest('style'));
+    bindings.push({node: node, attr: null, tpl: node.nodeValue, decode: decode});
+    collect(node.nodeValue, textKeys);
+}
+document.querySelectorAll('*').forEach(el => {
+    for (const attr of el.attributes) {
+        if (attr.value.includes('\\uE000')) {
+            bindings.push({node: el, attr: attr.name, tpl: attr.value, decode: true});
+            collect(attr.value, attrKeys);
+        }
+    }
+});
+window.__cardBindings = bindings;
+const container = document.querySelector('.card-container');
+return {
+    textKeys: Array.from(textKeys),
+    attrKeys: Array.from(attrKeys),
+    scripted: scripted,
+    selfRendering: !!(container && container.hasAttribute('data-render-signal'))
+};
+"""
+
+# 把一张贺卡的数据填入已绑定的文本节点和属性，并派发 card-data-updated 事件。
+# 数据与 inject_data_to_template 一样按HTML源码对待：字符引用（如 &amp;）经解码后填入，
+# 含标签的数据由调用方改为逐张加载页面渲染
+BATCH_APPLY_SCRIPT = """
+const data = arguments[0];
+const pattern = /\\uE000(\\w+)\\uE001/g;
+const decoder = document.createElement('textarea');
+const decode = (html) => {
+    decoder.innerHTML = html;
+    return decoder.value;
+};
+for (const b of window.__cardBindings) {
+    const value = b.tpl.replace(pattern, (m, key) => {
+        if (!(key in data)) return m;
+        return b.decode ? decode(data[key]) : data[key];
+    });
+    if (b.attr === null) {
+        b.node.nodeValue = value;
+    } else {
+        b.node.setAttribute(b.attr, value);
+    }
+}
+window.dispatchEvent(new CustomEvent('card-data-updated', {detail: data}));
+"""
+
+
+def _needs_page_load(replace_data, text_keys, attr_keys):
+    """数据能否直接替换进已加载的页面
+
+    inject_data_to_template 把数据原样写入HTML源码，数据中的标签会成为页面元素，
+    属性值中的引号会提前结束属性；这类数据需要重新加载页面才能得到相同的结果。
+    """
+    for key in text_keys:
+        if '<' in str(replace_data.get(key, '')):
+            return True
+    for key in attr_keys:
+        value = str(replace_data.get(key, ''))
+        if '<' in value or '"' in value or "'" in value:
+            return True
+    return False
+
+
+def render_batch(template_number, items, output_dir='newYear/generate_img', output=None,
+                 ready_timeout=10, pool=None):
+    """批量渲染同一模板的多张贺卡，每渲染完一张就产出一张
+
+    HTML模板只加载一次：先以占位符标记渲染页面，找到各占位符所在的文本节点和属性，
+    之后每张贺卡只需用脚本替换这些节点的内容再截图，字体、图片和布局初始化只发生一次。
+    填入的内容与 generate_card 相同（字符引用解码后显示）；数据中含标签、模板在脚本中使用占位符、
+    或依赖 data-render-signal 在加载时自行排版时，改为在同一浏览器中逐张加载页面渲染。
+    已缓存的贺卡直接复用，Pillow模板逐张绘制。
+
+    Args:
+        template_number: 模板编号
+        items: 可迭代的 (user_id, data) 序列，data 与 generate_card 的 data 相同
+        output_dir: 图片输出目录，文件名为 <user_id>.<扩展名>
+        output: 输出选项或预设名称（见 card_output.OUTPUT_PRESETS），默认为原尺寸PNG
+        ready_timeout: 每张贺卡等待渲染就绪的最长时间（秒）
+        pool: 浏览器池，默认使用进程内共享的浏览器池
+
+    Yields:
+        Tuple[str, Optional[str], Optional[Exception]]: (user_id, 图片路径, 错误)，成功时错误为None
+    """
+    output = get_output_options(output)
+    template_path = f'newYear/template/template_{template_number}.html'
+    layout_path = f'newYear/template/template_{template_number}.layout.json'
+    ensure_directory(output_dir)
+    renderer = get_template_renderer(layout_path)
+    cache = get_render_cache()
+    
+    if renderer == 'pillow':
+        for user_id, data in items:
+            img_path = os.path.join(output_dir, f'{user_id}.{output.ext}')
+            try:
+                yield user_id, render_card(template_number, data, img_path, output=output), None
+            except Exception as e:
+                yield user_id, None, e
+        return
+    
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f'模板文件不存在: {template_path}')
+    template = get_template_registry().get(template_path)
+    markers = {key: f'{_MARKER_START}{key}{_MARKER_END}' for key in template.placeholders}
+    
+    if pool is None:
+        pool = get_browser_pool()
+    work_dir = tempfile.mkdtemp(prefix='card_batch_')
+    try:
+        marker_html = os.path.join(work_dir, 'batch.html')
+        with open(marker_html, 'w', encoding='utf-8') as f:
+            f.write(template.render(markers))
         
+        with pool.lease() as driver:
+            print(f"\n=== 批量渲染模板 {template_number} ===")
+            driver.get(f'file:///{os.path.abspath(marker_html)}')
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CLASS_NAME, 'card-container')))
+            binding = driver.execute_script(BATCH_BIND_SCRIPT)
+            text_keys, attr_keys = set(binding['textKeys']), set(binding['attrKeys'])
+            reusable = (
+                not binding['scripted'] and not binding['selfRendering']
+                and text_keys | attr_keys >= set(markers)
+            )
+            if not reusable:
+                print("模板依赖脚本排版或在脚本中使用占位符，逐张加载页面渲染")
+            # 当前页面是否仍是绑定了占位符的批量页面（逐张加载页面后需要重新加载）
+            page_bound = True
+            
+            for user_id, data in items:
+                img_path = os.path.join(output_dir, f'{user_id}.{output.ext}')
+                try:
+                    replace_data = build_replace_data(data)
+                    cache_key = _render_cache_key(
+                        template_number, renderer, template_path, layout_path, replace_data, output
+                    )
+                    if cache.fetch(cache_key, img_path, output.ext):
+                        yield user_id, img_path, None
+                        continue
+                    
+                    if reusable and not _needs_page_load(replace_data, text_keys, attr_keys):
+                        # 与逐张加载页面的渲染方式不同，结果写入单独的缓存键
+                        cache_key = _render_cache_key(
+                            template_number, renderer, template_path, layout_path, replace_data, output,
+                            variant=_BATCH_CACHE_VARIANT
+                        )
+                        if cache.fetch(cache_key, img_path, output.ext):
+                            yield user_id, img_path, None
+                            continue
+                        if not page_bound:
+                            driver.get(f'file:///{os.path.abspath(marker_html)}')
+                            WebDriverWait(driver, 10).until(
+                                EC.presence_of_element_located((By.CLASS_NAME, 'card-container'))
+                            )
+                            driver.execute_script(BATCH_BIND_SCRIPT)
+                            page_bound = True
+                        driver.execute_script(BATCH_APPLY_SCRIPT, {k: str(v) for k, v in replace_data.items()})
+                        ready = wait_for_render_ready(driver, ready_timeout)
+                        _write_image(img_path, capture_element_image(driver, driver.execute_script(CARD_RECT_SCRIPT), output))
+                    else:
+                        item_html = inject_data_to_template(template_path, data, work_dir)
+                        page_bound = False
+                        ready = _capture_page(
+                            driver, f'file:///{os.path.abspath(item_html)}', img_path, ready_timeout, output
+                        )
+                    # 与 render_card 一样，未渲染就绪的截图不写入缓存
+                    if ready:
+                        cache.store(cache_key, img_path, output.ext)
+                    yield user_id, img_path, None
+                except Exception as e:
+                    print(f"批量渲染失败 - 用户ID: {user_id}, 错误: {str(e)}")
+                    yield user_id, None, e
     finally:
-        if driver:
-            print("\n10. 关闭WebDriver...")
-            driver.quit()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def get_preview_path(user_id):
+    """贺卡预览图的保存路径"""
+    return os.path.join('newYear/generate_img', f"{user_id}_preview.{get_output_options('preview').ext}")
 
+def generate_card(template_number, data, user_id, pool=None, output=None, preview_callback=None):
+    """生成贺卡图片（版本信息由调用方通过 VersionManager 保存）
 
-def generate_card(template_number, data, user_id):
-    """生成贺卡并保存相关信息"""
+    每次调用使用独立的临时目录和从浏览器池租用的浏览器，可以在多个线程中同时调用。
+    模板的布局描述文件声明 "renderer": "pillow" 时改用Pillow直接绘制（见 pillow_renderer）。
+
+    Args:
+        template_number: 模板编号
+        data: 注入模板的数据
+        user_id: 联系人ID，用于命名输出文件
+        pool: 浏览器池，默认使用进程内共享的浏览器池
+        output: 输出选项或预设名称（见 card_output.OUTPUT_PRESETS），默认为原尺寸PNG
+        preview_callback: 指定时在截取完整贺卡前，从同一次页面加载中先截取低分辨率预览图（见 get_preview_path），
+            并以其路径调用 preview_callback(preview_path)；预览失败不影响完整贺卡的生成
+
+    Returns:
+        str: 贺卡图片路径
+    """
     print(f"\n=== 开始生成贺卡 ===")
     print(f"模板编号: {template_number}")
     print(f"用户ID: {user_id}")
@@ -179,44 +777,16 @@ def generate_card(template_number, data, user_id):
         # 确保目录存在
         print("\n1. 检查并创建必要的目录...")
         ensure_directory('newYear/generate_img')
-        ensure_directory('newYear/version_history')
         
         # 构建文件路径
-        template_path = f'newYear/template/template_{template_number}.html'
-        img_filename = f'{user_id}.png'
+        img_filename = f'{user_id}.{get_output_options(output).ext}'
         img_path = os.path.join('newYear/generate_img', img_filename)
-        json_path = os.path.join('newYear/version_history', f'{user_id}.json')
-        
-        print(f"\n2. 检查模板文件: {template_path}")
-        if not os.path.exists(template_path):
-            raise FileNotFoundError(f'模板文件不存在: {template_path}')
-        
-        print("\n3. 注入数据到模板...")
-        temp_html_path = inject_data_to_template(template_path, data)
-        print(f"临时HTML文件已创建: {temp_html_path}")
         
-        print("\n4. 生成贺卡图片...")
-        capture_local_html(temp_html_path, img_path, wait_time=2)
-        
-        print("\n5. 更新JSON文件...")
-        # 只保存必要的文本数据和路径信息
-        json_data = {
-            'template_number': template_number,
-            'image_path': img_path,
-            'generation_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'template_data': {
-                'year': data.get('year', '2025'),
-                'greeting_text': data.get('greeting_text', ''),
-                'poem_text': data.get('poem_text', ''),
-                'idioms_text': data.get('idioms_text', ''),
-                'wishes_text': data.get('wishes_text', ''),
-                'signature': data.get('signature', '')
-            }
-        }
+        preview = None
+        if preview_callback is not None:
+            preview = (get_preview_path(user_id), preview_callback)
         
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=4)
-        print(f"JSON文件已保存: {json_path}")
+        render_card(template_number, data, img_path, output=output, pool=pool, preview=preview)
         
         print("=== 贺卡生成完成 ===\n")
         return img_path
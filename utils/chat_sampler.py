@@ -0,0 +1,117 @@
+"""
+聊天文本采样工具，用于在字符预算内对超长聊天记录进行抽样
+"""
+import heapq
+import random
+from typing import List, Optional
+
+
+class ReservoirSampler:
+    """按字符预算的水塘抽样
+
+    每条消息分配一个随机优先级，只保留优先级最小、且总字符数不超过预算的那部分消息，
+    相当于在字符预算约束下对整个消息流做均匀随机抽样，内存占用与预算成正比。
+    """
+
+    def __init__(self, char_budget: int, seed: Optional[int] = None):
+        self.char_budget = char_budget
+        self._random = random.Random(seed)
+        self._heap = []  # 大顶堆：(-优先级, 序号, 文本)
+        self._chars = 0
+        self._seq = 0
+
+    def add(self, text: str, create_time: Optional[str] = None):
+        """向采样器添加一条消息
+
+        Args:
+            text: 消息内容
+            create_time: 消息时间，水塘抽样不使用，仅为与分层抽样保持接口一致
+        """
+        if not text:
+            return
+        priority = self._random.random()
+        self._seq += 1
+        heapq.heappush(self._heap, (-priority, self._seq, text))
+        self._chars += len(text)
+        self._shrink()
+
+    def set_budget(self, char_budget: int):
+        """修改字符预算，预算缩小时立即丢弃超出部分"""
+        self.char_budget = char_budget
+        self._shrink()
+
+    def _shrink(self):
+        """丢弃优先级最大的消息，直到总字符数不超过预算"""
+        while self._chars > self.char_budget and self._heap:
+            _, _, text = heapq.heappop(self._heap)
+            self._chars -= len(text)
+
+    def get_texts(self) -> List[str]:
+        """按原始顺序返回采样结果"""
+        return [text for _, _, text in sorted(self._heap, key=lambda x: x[1])]
+
+
+class TimeStratifiedSampler:
+    """按时间分层的抽样
+
+    以月份为层，每层内部使用水塘抽样；每出现一个新的月份，就把字符预算在所有层之间重新均分，
+    保证抽样结果覆盖整个时间范围，而不会被聊天最密集的时间段占满。
+    """
+
+    def __init__(self, char_budget: int, seed: Optional[int] = None):
+        self.char_budget = char_budget
+        self._seed = seed
+        self._strata = {}  # 月份 -> ReservoirSampler
+
+    def add(self, text: str, create_time: Optional[str] = None):
+        """向采样器添加一条消息
+
+        Args:
+            text: 消息内容
+            create_time: 消息时间（格式：YYYY-MM-DD HH:MM:SS）
+        """
+        if not text:
+            return
+        stratum_key = (create_time or '')[:7]  # YYYY-MM
+        sampler = self._strata.get(stratum_key)
+        if sampler is None:
+            seed = None if self._seed is None else f"{self._seed}:{stratum_key}"
+            sampler = ReservoirSampler(0, seed=seed)
+            self._strata[stratum_key] = sampler
+            # 重新分配各层的字符预算
+            per_stratum = self.char_budget // len(self._strata)
+            for stratum in self._strata.values():
+                stratum.set_budget(per_stratum)
+        sampler.add(text)
+
+    def get_texts(self) -> List[str]:
+        """按时间顺序返回采样结果"""
+        texts = []
+        for stratum_key in sorted(self._strata):
+            texts.extend(self._strata[stratum_key].get_texts())
+        return texts
+
+
+# 可选的采样策略 -> 说明
+SAMPLE_STRATEGIES = {
+    'reservoir': '水塘抽样',
+    'stratified': '按时间分层抽样',
+}
+
+
+def create_sampler(strategy: str, char_budget: int, seed: Optional[int] = None):
+    """根据策略名称创建采样器
+
+    Args:
+        strategy: 采样策略，'reservoir'（水塘抽样）或 'stratified'（按时间分层抽样）
+        char_budget: 采样文本的字符预算
+        seed: 随机种子，便于复现
+
+    Returns:
+        采样器实例
+    """
+    if strategy == 'reservoir':
+        return ReservoirSampler(char_budget, seed=seed)
+    if strategy == 'stratified':
+        return TimeStratifiedSampler(char_budget, seed=seed)
+    raise ValueError(f"不支持的采样策略: {strategy}")
@@ -0,0 +1,157 @@
+"""
+生成流程压测脚本：对模拟服务（或指定接口）并发执行完整的生成流程，统计吞吐量和延迟分位数
+
+用法：
+    python -m newYear.utils.load_test --requests 200 --concurrency 8 --latency 0.5
+    python -m newYear.utils.load_test --base-url http://127.0.0.1:8765/api/v3 --stream
+"""
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+from newYear.utils.volcano_api import VolcanoAPI
+from newYear.utils.mock_ark_server import MockArkConfig, start_mock_server
+
+SAMPLE_MESSAGES = [
+    "今天工作怎么样？", "还不错，项目进展顺利", "周末要不要一起打球？", "最近加班好累啊",
+    "加油，坚持就是胜利", "生日快乐！", "谢谢，好开心", "下个月要去旅行", "考研成绩出来了吗",
+    "团队聚餐定在周五", "压力有点大", "相信你一定可以的"
+]
+
+
+def build_chat_history(message_count: int) -> List[Dict]:
+    """构造模拟的聊天记录"""
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    history = []
+    for i in range(message_count):
+        create_time = start + timedelta(minutes=37 * i)
+        history.append({
+            'message': random.choice(SAMPLE_MESSAGES),
+            'is_sender': i % 2 == 0,
+            'create_time': create_time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+    return history
+
+
+def run_pipeline(api: VolcanoAPI, index: int, chat_history: List[Dict], render: bool) -> float:
+    """执行一次完整的生成流程，返回耗时（秒）"""
+    started = time.perf_counter()
+    contact_info = {'wxid': f'load_test_{index:05d}', 'name': f'压测联系人{index}'}
+    result = api.generate_greeting(
+        contact_info,
+        chat_history,
+        '温暖、亲切、感人的新年祝福，表达真挚的关心和美好祝愿'
+    )
+    if render:
+        from newYear.utils.card_utils import generate_card
+        generate_card(
+            template_number=1,
+            data={
+                'greeting_text': result.get('greeting', ''),
+                'poem_text': result.get('idioms', ''),
+                'idioms_text': result.get('tags', ''),
+                'wishes_text': result.get('wishes', ''),
+                'signature': contact_info['name'],
+                'year': '2025'
+            },
+            user_id=contact_info['wxid']
+        )
+    return time.perf_counter() - started
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """计算已排序数据的分位数（线性插值）"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def run_load_test(api: VolcanoAPI, total_requests: int, concurrency: int, message_count: int,
+                  render: bool = False) -> Dict:
+    """并发执行生成流程并汇总结果"""
+    chat_history = build_chat_history(message_count)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(run_pipeline, api, i, chat_history, render)
+            for i in range(total_requests)
+        ]
+        for future in as_completed(futures):
+            try:
+                elapsed = future.result()
+                with lock:
+                    latencies.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total_requests,
+        'succeeded': len(latencies),
+        'failed': len(errors),
+        'wall_time': wall_time,
+        'throughput': len(latencies) / wall_time if wall_time else 0.0,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else 0.0,
+        'errors': errors[:5]
+    }
+
+
+def print_report(report: Dict):
+    """打印压测结果"""
+    print("\n=== 压测结果 ===")
+    print(f"请求数: {report['requests']}  成功: {report['succeeded']}  失败: {report['failed']}")
+    print(f"总耗时: {report['wall_time']:.2f}秒  吞吐量: {report['throughput']:.2f} 次/秒")
+    print(f"延迟 P50: {report['p50'] * 1000:.0f}ms  P90: {report['p90'] * 1000:.0f}ms  "
+          f"P95: {report['p95'] * 1000:.0f}ms  P99: {report['p99'] * 1000:.0f}ms  "
+          f"最大: {report['max'] * 1000:.0f}ms")
+    for error in report['errors']:
+        print(f"错误示例: {error}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成流程压测')
+    parser.add_argument('--base-url', default='', help='接口地址，不指定时自动启动本地模拟服务')
+    parser.add_argument('--api-key', default='mock-key')
+    parser.add_argument('--requests', type=int, default=100, help='总请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数')
+    parser.add_argument('--messages', type=int, default=2000, help='每个联系人的模拟聊天记录条数')
+    parser.add_argument('--stream', action='store_true', help='使用流式响应')
+    parser.add_argument('--render', action='store_true', help='同时生成贺卡图片（需要Chrome和模板文件）')
+    parser.add_argument('--latency', type=float, default=0.5, help='模拟服务的平均延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.1, help='模拟服务的延迟浮动（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟服务的错误率（0~1）')
+    args = parser.parse_args()
+
+    base_url = args.base_url
+    server = None
+    if not base_url:
+        server, base_url = start_mock_server(port=0, config=MockArkConfig(
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate
+        ))
+        print(f"已启动本地模拟服务: {base_url}")
+
+    api = VolcanoAPI(args.api_key, base_url=base_url, stream=args.stream, max_connections=args.concurrency)
+    print(f"开始压测: {args.requests} 个请求, 并发 {args.concurrency}")
+    print_report(run_load_test(api, args.requests, args.concurrency, args.messages, render=args.render))
+
+    if server:
+        server.shutdown()
@@ -0,0 +1,181 @@
+"""
+本地模拟的火山方舟（Ark）对话接口，用于在没有真实接口的情况下调试和压测 VolcanoAPI
+
+用法：
+    python -m newYear.utils.mock_ark_server --port 8765 --latency 0.8 --error-rate 0.05
+然后以 base_url="http://127.0.0.1:8765/api/v3" 创建 VolcanoAPI。
+模拟服务不提供端到端加密所需的证书接口，VolcanoAPI 对本机地址默认不加密（见 VolcanoAPI 的 encrypted 参数）。
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 模拟生成的祝福内容
+MOCK_GREETING = {
+    "greeting": "从深夜加班的互相打气到周末球场的并肩奔跑，三百多条消息记录着我们的默契，新的一年继续做彼此的职场损友！",
+    "idioms": "梦想飞扬似朝阳,岁岁安康伴春寒",
+    "tags": "前程似锦,蒸蒸日上,前程万里",
+    "wishes": "愿你在新的一年里，所求皆如愿，所行皆坦途，心中有光，脚下有路。"
+}
+
+
+class MockArkConfig:
+    """模拟服务的行为配置"""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, error_rate: float = 0.0,
+                 stream_chunk_size: int = 8, stream_chunk_delay: float = 0.01):
+        """
+        Args:
+            latency: 每个请求的平均响应延迟（秒）
+            jitter: 延迟的随机浮动范围（秒）
+            error_rate: 返回错误响应的概率（0~1）
+            stream_chunk_size: 流式响应中每个片段的字符数
+            stream_chunk_delay: 流式响应中片段之间的间隔（秒）
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stream_chunk_size = stream_chunk_size
+        self.stream_chunk_delay = stream_chunk_delay
+
+
+class MockArkHandler(BaseHTTPRequestHandler):
+    """处理 /api/v3/chat/completions 请求"""
+
+    protocol_version = 'HTTP/1.1'
+    config = MockArkConfig()
+
+    def log_message(self, format, *args):
+        # 压测时请求量很大，不输出访问日志
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"code": "NotFound", "message": f"未知接口: {self.path}", "type": "NotFound"}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"code": "InvalidParameter", "message": "请求体不是合法的JSON", "type": "BadRequest"}})
+            return
+
+        config = self.config
+        time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+
+        if random.random() < config.error_rate:
+            status, code = random.choice([(429, "RateLimitExceeded"), (500, "InternalServiceError")])
+            self._send_json(status, {"error": {"code": code, "message": "模拟的服务端错误", "type": code}})
+            return
+
+        model = body.get('model', 'mock-model')
+        prompt_chars = sum(len(str(m.get('content', ''))) for m in body.get('messages', []))
+        content = json.dumps(MOCK_GREETING, ensure_ascii=False)
+        usage = {
+            "prompt_tokens": prompt_chars,
+            "completion_tokens": len(content),
+            "total_tokens": prompt_chars + len(content)
+        }
+
+        if body.get('stream'):
+            self._send_stream(model, content, usage)
+        else:
+            self._send_json(200, {
+                "id": f"mock-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+
+    def _send_json(self, status, payload):
+        """发送JSON响应"""
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, model, content, usage):
+        """以SSE格式分片发送响应内容"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        chunk_id = f"mock-{time.time_ns()}"
+        size = max(1, self.config.stream_chunk_size)
+        pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        for i, piece in enumerate(pieces):
+            is_last = i == len(pieces) - 1
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": piece},
+                    "finish_reason": "stop" if is_last else None
+                }]
+            }
+            if is_last:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            if self.config.stream_chunk_delay:
+                time.sleep(self.config.stream_chunk_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_mock_server(host: str = '127.0.0.1', port: int = 8765, config: MockArkConfig = None):
+    """在后台线程中启动模拟服务
+
+    Returns:
+        Tuple[ThreadingHTTPServer, str]: (服务实例, 可直接用于 VolcanoAPI 的 base_url)
+    """
+    handler = type('ConfiguredMockArkHandler', (MockArkHandler,), {'config': config or MockArkConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='MockArkServer', daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}/api/v3"
+    return server, base_url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地模拟的火山方舟对话接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help='平均响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.1, help='延迟随机浮动范围（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='错误响应概率（0~1）')
+    parser.add_argument('--chunk-size', type=int, default=8, help='流式响应每个片段的字符数')
+    parser.add_argument('--chunk-delay', type=float, default=0.01, help='流式响应片段间隔（秒）')
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args.host, args.port, MockArkConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        stream_chunk_size=args.chunk_size,
+        stream_chunk_delay=args.chunk_delay
+    ))
+    print(f"模拟服务已启动: {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,338 @@
+"""
+不依赖浏览器的贺卡渲染器：按模板的布局描述文件直接用Pillow绘制贺卡
+
+布局描述文件与HTML模板放在一起，命名为 template_<编号>.layout.json，例如：
+
+    {
+        "renderer": "pillow",
+        "size": [750, 1334],
+        "background": "newYear/template/images/bg_1.png",
+        "background_color": "#b71c1c",
+        "fonts": {"title": "newYear/template/fonts/title.ttf"},
+        "elements": [
+            {"type": "text", "field": "greeting_text", "box": [60, 200, 630, 240],
+             "font": "title", "size": 48, "min_size": 28, "color": "#ffe9b0",
+             "align": "center", "valign": "middle", "line_spacing": 1.4},
+            {"type": "text", "field": "idioms_text_1", "box": [560, 520, 80, 420],
+             "font": "title", "size": 40, "direction": "vertical"},
+            {"type": "image", "path": "newYear/template/images/seal.png", "box": [600, 1150, 96, 96]}
+        ]
+    }
+
+文本元素的 field 与HTML模板中的占位符一致（见 card_template.PLACEHOLDER_KEYS），
+也可以用 text 字段写固定文本，其中的 {占位符} 会被替换。
+"renderer" 为 "pillow" 时 generate_card 使用本渲染器，否则仍使用浏览器渲染HTML模板。
+"""
+import io
+import os
+import re
+import json
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from newYear.utils.card_output import OutputOptions, get_output_options
+
+_FIELD_PATTERN = re.compile(r'\{(\w+)\}')
+# 不能出现在行首的标点
+_NO_LINE_START = set('，。、；：？！,.;:?!)）》」』”’')
+
+
+class CardLayout:
+    """解析后的布局描述，背景图和图片元素只加载一次"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 布局描述文件路径
+        """
+        self.path = path
+        self.load()
+
+    def load(self):
+        """读取布局描述并加载背景和图片"""
+        self._dependencies: Dict[str, float] = {}
+        self._digest = hashlib.sha256()
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        spec = json.loads(raw.decode('utf-8'))
+        self._digest.update(raw)
+        self._dependencies[self.path] = os.path.getmtime(self.path)
+
+        self.renderer = spec.get('renderer', 'chrome')
+        self.size = tuple(spec.get('size', (750, 1334)))
+        self.fonts = {
+            name: self._resolve(path) for name, path in spec.get('fonts', {}).items()
+        }
+        for path in sorted(self.fonts.values()):
+            # 字体文件较大，按路径、大小和修改时间计入哈希；替换字体文件后布局随之重新加载
+            try:
+                stat = os.stat(path)
+                self._digest.update(f'{path}:{stat.st_size}:{stat.st_mtime}'.encode('utf-8'))
+                self._dependencies[path] = stat.st_mtime
+            except OSError:
+                self._digest.update(path.encode('utf-8'))
+        self.elements = spec.get('elements', [])
+
+        # 背景：先铺底色，再按画布尺寸缩放背景图
+        background = Image.new('RGBA', self.size, spec.get('background_color', '#ffffff'))
+        if spec.get('background'):
+            image = self._open_image(spec['background'], self.size)
+            background.alpha_composite(image)
+        self.background = background
+
+        self.images = {}
+        for element in self.elements:
+            if element.get('type') == 'image':
+                x, y, w, h = element['box']
+                self.images[element['path']] = self._open_image(element['path'], (w, h))
+
+        # 布局及其引用的资源的内容哈希，用于渲染缓存
+        self.content_hash = self._digest.hexdigest()
+
+    def is_stale(self) -> bool:
+        """布局描述或引用的图片、字体是否在加载后被修改"""
+        for path, mtime in self._dependencies.items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _resolve(self, path: str) -> str:
+        """相对路径先按当前工作目录查找，找不到时按布局文件所在目录查找"""
+        if os.path.isabs(path) or os.path.exists(path):
+            return path
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), path)
+
+    def _open_image(self, path: str, size: Tuple[int, int]) -> Image.Image:
+        """加载图片并缩放到指定尺寸"""
+        path = self._resolve(path)
+        with open(path, 'rb') as f:
+            raw = f.read()
+        self._digest.update(raw)
+        with Image.open(io.BytesIO(raw)) as image:
+            image = image.convert('RGBA')
+            if image.size != tuple(size):
+                image = image.resize(tuple(size), Image.LANCZOS)
+        self._dependencies[path] = os.path.getmtime(path)
+        return image
+
+
+class PillowCardRenderer:
+    """用Pillow按布局描述绘制贺卡，可以在多个线程中同时调用"""
+
+    def __init__(self):
+        self._layouts: Dict[str, CardLayout] = {}
+        self._lock = threading.Lock()
+        # FreeType字体对象不在线程间共享，每个线程各自缓存
+        self._local = threading.local()
+
+    def get_layout(self, layout_path: str) -> CardLayout:
+        """获取解析后的布局，文件修改后自动重新加载"""
+        key = os.path.abspath(layout_path)
+        with self._lock:
+            layout = self._layouts.get(key)
+            if layout is None:
+                layout = CardLayout(layout_path)
+                self._layouts[key] = layout
+            elif layout.is_stale():
+                print(f"布局文件已修改，重新加载: {layout_path}")
+                layout = CardLayout(layout_path)
+                self._layouts[key] = layout
+            return layout
+
+    def render(self, layout_path: str, replace_data: Dict, output_path: str,
+               output: Optional[OutputOptions] = None) -> str:
+        """绘制贺卡并保存
+
+        Args:
+            layout_path: 布局描述文件路径
+            replace_data: 占位符对应的数据（见 card_utils.build_replace_data）
+            output_path: 输出图片路径
+            output: 输出选项，默认为原尺寸PNG
+
+        Returns:
+            str: 输出图片路径
+        """
+        image = self.render_image(layout_path, replace_data)
+        get_output_options(output).save_image(image.convert('RGB'), output_path)
+        print(f'贺卡图片已保存至: {output_path}')
+        return output_path
+
+    def render_image(self, layout_path: str, replace_data: Dict) -> Image.Image:
+        """绘制贺卡，返回图片对象"""
+        layout = self.get_layout(layout_path)
+        canvas = layout.background.copy()
+        draw = ImageDraw.Draw(canvas)
+        for element in layout.elements:
+            element_type = element.get('type', 'text')
+            if element_type == 'image':
+                x, y = element['box'][:2]
+                canvas.alpha_composite(layout.images[element['path']], (int(x), int(y)))
+            elif element_type == 'text':
+                text = self._element_text(element, replace_data)
+                if text:
+                    self._draw_text(draw, layout, element, text)
+        return canvas
+
+    def _element_text(self, element: Dict, replace_data: Dict) -> str:
+        """取出文本元素要绘制的内容"""
+        if 'field' in element:
+            text = str(replace_data.get(element['field'], ''))
+        else:
+            text = _FIELD_PATTERN.sub(
+                lambda m: str(replace_data.get(m.group(1), m.group(0))), element.get('text', '')
+            )
+        # HTML模板中的换行以字面的 \n 表示
+        return text.replace('\\n', '\n')
+
+    def _font(self, layout: CardLayout, name: Optional[str], size: int):
+        """获取字体（按线程缓存，字体文件修改后布局的哈希改变，不再使用旧的字体对象）"""
+        cache = getattr(self._local, 'fonts', None)
+        if cache is None:
+            cache = self._local.fonts = {}
+        path = layout.fonts.get(name, name) if name else None
+        key = (path, size, layout.content_hash)
+        font = cache.get(key)
+        if font is None:
+            try:
+                font = ImageFont.truetype(path, size) if path else self._default_font(size)
+            except OSError:
+                print(f"字体加载失败，使用默认字体: {path}")
+                font = self._default_font(size)
+            cache[key] = font
+        return font
+
+    @staticmethod
+    def _default_font(size: int):
+        """Pillow自带的默认字体（旧版本不支持指定字号）"""
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:
+            return ImageFont.load_default()
+
+    def _draw_text(self, draw: ImageDraw.ImageDraw, layout: CardLayout, element: Dict, text: str):
+        """在文本框内绘制文本，放不下时逐步缩小字号"""
+        x, y, width, height = element['box']
+        vertical = element.get('direction') == 'vertical'
+        size = int(element.get('size', 32))
+        min_size = int(element.get('min_size', size))
+        spacing = float(element.get('letter_spacing', 0))
+        line_spacing = float(element.get('line_spacing', 1.3))
+
+        while True:
+            font = self._font(layout, element.get('font'), size)
+            line_height = size * line_spacing
+            if vertical:
+                # 竖排时每一“行”是一列，列长度受文本框高度限制
+                lines = self._wrap(text, lambda s: len(s) * (size + spacing) - spacing, height)
+                used = len(lines) * line_height - (line_height - size)
+                fits = used <= width
+            else:
+                lines = self._wrap(text, lambda s: self._line_width(font, s, spacing), width)
+                used = len(lines) * line_height - (line_height - size)
+                fits = used <= height
+            if fits or size <= min_size:
+                break
+            size = max(min_size, size - 2)
+
+        fill = element.get('color', '#000000')
+        stroke = {
+            'stroke_width': int(element.get('stroke_width', 0)),
+            'stroke_fill': element.get('stroke_color')
+        }
+        align = element.get('align', 'center' if vertical else 'left')
+        valign = element.get('valign', 'top')
+
+        if vertical:
+            # 列从右向左排列
+            if align == 'center':
+                right = x + (width + used) / 2
+            elif align == 'left':
+                right = x + used
+            else:
+                right = x + width
+            for i, line in enumerate(lines):
+                column_x = right - i * line_height - size
+                column_height = len(line) * (size + spacing) - spacing
+                cy = self._offset(y, height, column_height, valign)
+                for char in line:
+                    char_x = column_x + (size - font.getlength(char)) / 2
+                    draw.text((char_x, cy), char, font=font, fill=fill, **stroke)
+                    cy += size + spacing
+            return
+
+        cy = self._offset(y, height, used, valign)
+        for line in lines:
+            line_width = self._line_width(font, line, spacing)
+            if align == 'center':
+                cx = x + (width - line_width) / 2
+            elif align == 'right':
+                cx = x + width - line_width
+            else:
+                cx = x
+            if spacing:
+                for char in line:
+                    draw.text((cx, cy), char, font=font, fill=fill, **stroke)
+                    cx += font.getlength(char) + spacing
+            else:
+                draw.text((cx, cy), line, font=font, fill=fill, **stroke)
+            cy += line_height
+
+    @staticmethod
+    def _offset(start: float, box: float, used: float, valign: str) -> float:
+        """按对齐方式计算起始坐标"""
+        if valign in ('middle', 'center'):
+            return start + (box - used) / 2
+        if valign == 'bottom':
+            return start + box - used
+        return start
+
+    @staticmethod
+    def _line_width(font, line: str, spacing: float) -> float:
+        """计算一行文本的宽度"""
+        if not line:
+            return 0
+        width = font.getlength(line)
+        if spacing:
+            width += spacing * (len(line) - 1)
+        return width
+
+    @staticmethod
+    def _wrap(text: str, measure, limit: float) -> List[str]:
+        """按宽度折行：中文逐字折行，英文尽量在空格处折行，行首避开标点"""
+        lines = []
+        for paragraph in text.split('\n'):
+            line = ''
+            for char in paragraph:
+                candidate = line + char
+                if not line or measure(candidate) <= limit or char in _NO_LINE_START:
+                    line = candidate
+                    continue
+                if char != ' ' and ' ' in line and char.isascii() and line[-1].isascii():
+                    # 英文单词整体移到下一行
+                    head, _, tail = line.rpartition(' ')
+                    lines.append(head)
+                    line = tail + char
+                else:
+                    lines.append(line.rstrip())
+                    line = '' if char == ' ' else char
+            lines.append(line)
+        return lines
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_pillow_renderer() -> PillowCardRenderer:
+    """获取进程内共享的Pillow渲染器"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = PillowCardRenderer()
+        return _renderer
@@ -0,0 +1,130 @@
+"""
+提示词日志记录器，在后台线程中将提示词追加写入按大小轮转、压缩归档的JSONL日志
+"""
+import os
+import json
+import gzip
+import queue
+import shutil
+import atexit
+import threading
+from datetime import datetime
+from typing import Optional
+
+
+class PromptLogger:
+    """异步提示词日志
+
+    调用方只把记录放入队列，由后台线程统一写入 prompts.jsonl；
+    当前日志超过 max_bytes 时压缩归档为 prompts_<时间戳>.jsonl.gz，
+    归档总大小超过 max_archive_bytes 时从最旧的归档开始删除。
+    """
+
+    LOG_NAME = 'prompts.jsonl'
+
+    def __init__(self, log_dir: Optional[str] = None, max_bytes: int = 5 * 1024 * 1024,
+                 max_archive_bytes: int = 50 * 1024 * 1024):
+        """
+        Args:
+            log_dir: 日志目录，默认为项目目录下的 prompts
+            max_bytes: 单个日志文件的最大字节数，超过后轮转
+            max_archive_bytes: 压缩归档的总字节数上限
+        """
+        if log_dir is None:
+            log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'prompts')
+        self.log_dir = log_dir
+        self.log_path = os.path.join(log_dir, self.LOG_NAME)
+        self.max_bytes = max_bytes
+        self.max_archive_bytes = max_archive_bytes
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='PromptLogger', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, wxid: str, prompt: str):
+        """记录一条提示词（非阻塞）"""
+        self._queue.put({
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'wxid': wxid,
+            'prompt': prompt
+        })
+
+    def close(self):
+        """写完队列中剩余的记录并停止后台线程"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        """后台写入循环"""
+        os.makedirs(self.log_dir, exist_ok=True)
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            # 一次取出队列中已有的全部记录，合并为一次写入
+            records = [record]
+            stop = False
+            while True:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    stop = True
+                    break
+                records.append(record)
+            try:
+                self._write(records)
+            except Exception as e:
+                print(f"\nPrompt日志写入失败: {str(e)}")
+            if stop:
+                break
+
+    def _write(self, records):
+        """追加写入记录，必要时轮转日志"""
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            size = f.tell()
+        if size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """压缩归档当前日志并清理超出保留上限的旧归档"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        archive_path = os.path.join(self.log_dir, f'prompts_{timestamp}.jsonl.gz')
+        with open(self.log_path, 'rb') as src, gzip.open(archive_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.log_path)
+
+        archives = sorted(
+            name for name in os.listdir(self.log_dir)
+            if name.startswith('prompts_') and name.endswith('.jsonl.gz')
+        )
+        total = sum(os.path.getsize(os.path.join(self.log_dir, name)) for name in archives)
+        # 归档文件名按时间戳排序，从最旧的开始删除
+        for name in archives:
+            if total <= self.max_archive_bytes:
+                break
+            path = os.path.join(self.log_dir, name)
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+def get_prompt_logger(log_dir: str) -> PromptLogger:
+    """获取进程内共享的提示词日志，同一目录只有一个写入线程
+
+    Args:
+        log_dir: 日志目录
+    """
+    log_dir = os.path.abspath(log_dir)
+    with _loggers_lock:
+        if log_dir not in _loggers:
+            _loggers[log_dir] = PromptLogger(log_dir)
+        return _loggers[log_dir]
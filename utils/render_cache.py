@@ -0,0 +1,146 @@
+"""
+贺卡渲染结果缓存：模板和内容都没有变化时直接复用已生成的图片
+
+缓存键由模板编号、模板内容哈希、规范化后的替换数据和输出选项计算得出；
+缓存文件的修改时间即最近使用时间，超出磁盘预算时从最久未使用的文件开始删除。
+缓存状态全部保存在文件系统中，渲染农场的多个进程可以共用同一个缓存目录。
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, Optional
+
+
+def normalize_replace_data(replace_data: Dict) -> str:
+    """规范化替换数据，使内容相同的数据得到相同的字符串"""
+    normalized = {
+        str(key): unicodedata.normalize('NFC', str(value)).strip()
+        for key, value in replace_data.items()
+    }
+    return json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+
+
+class RenderCache:
+    """基于磁盘的贺卡图片LRU缓存"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_dir: 缓存目录，默认为项目目录下的 render_cache
+            max_bytes: 缓存占用的磁盘上限（字节），默认读取环境变量 CARD_RENDER_CACHE_BYTES，未设置时为500MB
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'render_cache')
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('CARD_RENDER_CACHE_BYTES', 500 * 1024 * 1024))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(template_number, template_hash: str, replace_data: Dict,
+                 output_options: Optional[Dict] = None) -> str:
+        """计算缓存键
+
+        Args:
+            template_number: 模板编号
+            template_hash: 模板内容（含内联资源）的哈希
+            replace_data: 注入模板的替换数据
+            output_options: 输出选项（格式、尺寸等）
+
+        Returns:
+            str: 缓存键
+        """
+        digest = hashlib.sha256()
+        digest.update(str(template_number).encode('utf-8'))
+        digest.update(b'\0' + template_hash.encode('utf-8'))
+        digest.update(b'\0' + normalize_replace_data(replace_data).encode('utf-8'))
+        digest.update(b'\0' + json.dumps(output_options or {}, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def fetch(self, key: str, output_path: str, ext: str = 'png') -> bool:
+        """命中时把缓存的图片复制到输出路径
+
+        Returns:
+            bool: 是否命中
+        """
+        path = self._path(key, ext)
+        try:
+            shutil.copyfile(path, output_path)
+            # 更新修改时间，记录最近使用
+            os.utime(path, None)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"读取渲染缓存失败: {str(e)}")
+            return False
+        return True
+
+    def store(self, key: str, image_path: str, ext: str = 'png'):
+        """把新生成的图片放入缓存，并按磁盘预算清理"""
+        path = self._path(key, ext)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            shutil.copyfile(image_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"写入渲染缓存失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """缓存超出磁盘预算时删除最久未使用的文件"""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_file() or entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    total -= size
+                except OSError as e:
+                    print(f"清理渲染缓存失败: {str(e)}")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file():
+                    os.remove(entry.path)
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.{ext}')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    """获取进程内共享的渲染缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache()
+        return _cache
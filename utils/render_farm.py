@@ -0,0 +1,493 @@
+"""
+贺卡渲染农场：把贺卡渲染任务分发到多个进程并行执行
+
+调用方提交任务后立即返回，任务在队列中排队；每个渲染进程由主进程中的一个线程负责，
+该线程空闲时从队列取出任务，通过管道发给渲染进程并等待结果。渲染进程在第一次提交任务时才启动。
+每个任务有独立的超时时间，超时后只强制结束该任务所在的渲染进程（连同其中的chromedriver和Chrome）并重新启动，
+完成、失败或超时后通过回调通知调用方（回调在农场的后台线程中执行）。
+任务可以要求在同一次页面加载中先截取低分辨率预览图，预览图就绪后通过单独的回调先行通知。
+同一模板的多张贺卡可以作为批量任务提交，在一个渲染进程中只加载一次模板页面（见 card_utils.render_batch）。
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import atexit
+import itertools
+import threading
+import subprocess
+import multiprocessing
+from typing import Callable, Dict, List, Optional
+
+# 未指定进程数时的上限：每个渲染进程都带一个Chrome，进程过多时内存占用大而收益有限
+MAX_DEFAULT_WORKERS = 4
+
+# 渲染进程中与主进程通信的管道，任务执行期间用于发送预览图等中间结果
+_worker_conn = None
+
+
+def _worker_main(conn):
+    """渲染进程的主循环：接收任务、执行并通过管道返回结果"""
+    global _worker_conn
+    _worker_conn = conn
+    # 每个进程同一时间只渲染一张贺卡，只需一个浏览器实例
+    os.environ['CARD_BROWSER_POOL_SIZE'] = '1'
+    from newYear.utils.card_utils import get_browser_pool
+    pool = get_browser_pool()
+    # 新建的浏览器立即报告给主进程，任务卡住时由主进程结束这些进程
+    pool.on_driver_started = lambda pid: conn.send(('driver', pid))
+    try:
+        while True:
+            try:
+                task = conn.recv()
+            except EOFError:
+                break
+            if task is None:
+                break
+            func, args = task
+            try:
+                conn.send(('done', func(*args), None))
+            except Exception as e:
+                try:
+                    conn.send(('done', None, e))
+                except Exception:
+                    # 异常对象无法序列化时只传递错误信息
+                    conn.send(('done', None, RuntimeError(f'{type(e).__name__}: {str(e)}')))
+    finally:
+        pool.shutdown()
+
+
+def _render_job(template_number, data, user_id, output=None, preview=False):
+    """在渲染进程中生成一张贺卡，preview 为True时预览图就绪后先通过管道发给主进程"""
+    from newYear.utils.card_utils import generate_card
+    preview_callback = None
+    if preview:
+        preview_callback = lambda path: _worker_conn.send(('preview', path))
+    return generate_card(template_number=template_number, data=data, user_id=user_id,
+                         output=output, preview_callback=preview_callback)
+
+
+def _send_error_safe(message):
+    """发送含异常的消息，异常对象无法序列化时只传递错误信息"""
+    try:
+        _worker_conn.send(message)
+    except Exception:
+        *head, error = message
+        _worker_conn.send((*head, RuntimeError(f'{type(error).__name__}: {str(error)}')))
+
+
+def _render_batch_job(template_number, items, output=None):
+    """在渲染进程中批量渲染同一模板的贺卡，每完成一张就通过管道把 (序号, 图片路径, 错误) 发给主进程"""
+    from newYear.utils.card_utils import render_batch
+    for index, (_, img_path, error) in enumerate(render_batch(template_number, items, output=output)):
+        _send_error_safe(('item', index, img_path, error))
+
+
+def _warm_up_worker():
+    """在渲染进程中预热浏览器"""
+    from newYear.utils.card_utils import get_browser_pool
+    get_browser_pool().warm_up()
+
+
+def _child_pids(pid: int) -> List[int]:
+    """进程的直接子进程（读取 /proc，没有 /proc 的系统返回空列表）"""
+    children = []
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                stat = f.read()
+            # 进程名中可能有空格和括号，父进程ID是最后一个右括号之后的第二个字段
+            if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+                children.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+
+def kill_process_tree(pid: int):
+    """强制结束进程及其所有子进程
+
+    Windows 上 Process.terminate() 直接调用 TerminateProcess，进程内的清理代码不会执行，
+    浏览器需要从外部结束，这里用 taskkill /T 结束整棵进程树。
+    """
+    if sys.platform == 'win32':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
+    # 先记下子进程，父进程结束后它们会被系统收养
+    for child in _child_pids(pid):
+        kill_process_tree(child)
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def default_worker_count() -> int:
+    """默认的渲染进程数：可用CPU核数，最多 MAX_DEFAULT_WORKERS 个；可通过环境变量 CARD_RENDER_WORKERS 指定"""
+    if os.environ.get('CARD_RENDER_WORKERS'):
+        return max(1, int(os.environ['CARD_RENDER_WORKERS']))
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, MAX_DEFAULT_WORKERS))
+
+
+class RenderJob:
+    """一个贺卡渲染任务"""
+
+    def __init__(self, job_id: str, template_number: int, data: Dict, user_id: str,
+                 callback: Optional[Callable], timeout: float, output=None,
+                 preview_callback: Optional[Callable] = None):
+        self.job_id = job_id
+        self.template_number = template_number
+        self.data = data
+        self.user_id = user_id
+        self.callback = callback
+        self.timeout = timeout
+        self.output = output
+        self.preview_callback = preview_callback
+
+
+class RenderBatch:
+    """同一模板的一组渲染任务，在一个渲染进程中依次完成"""
+
+    def __init__(self, template_number: int, jobs: List[RenderJob], timeout: float, output=None):
+        self.template_number = template_number
+        self.jobs = jobs
+        self.timeout = timeout
+        self.output = output
+
+
+class _Worker:
+    """主进程中负责一个渲染进程的线程"""
+
+    def __init__(self, farm: 'RenderFarm', index: int):
+        self.farm = farm
+        self.name = f'RenderWorker-{index}'
+        self.process = None
+        self.conn = None
+        # 渲染进程中chromedriver的进程ID
+        self.driver_pids = set()
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+
+    def _start_process(self):
+        """启动渲染进程"""
+        parent_conn, child_conn = self.farm._context.Pipe()
+        self.process = self.farm._context.Process(
+            target=_worker_main, args=(child_conn,), name=self.name, daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.driver_pids = set()
+
+    def call(self, func: Callable, args: tuple, timeout: float, on_preview: Optional[Callable] = None,
+             on_item: Optional[Callable] = None):
+        """在渲染进程中执行函数
+
+        Args:
+            func: 在渲染进程中执行的函数（需可序列化）
+            args: 函数参数
+            timeout: 超时时间（秒）；收到批量任务中一张贺卡的结果后重新计时
+            on_preview: 执行期间收到预览图时的回调，签名为 on_preview(preview_path)
+            on_item: 批量任务中每完成一张贺卡时的回调，签名为 on_item(序号, 图片路径, 错误)
+
+        Returns:
+            Tuple: (返回值, 异常)
+
+        Raises:
+            TimeoutError: 超时未返回
+            EOFError: 渲染进程意外退出
+        """
+        if self.process is None or not self.process.is_alive():
+            self._start_process()
+        self.conn.send((func, args))
+        deadline = time.monotonic() + timeout
+        while True:
+            if not self.conn.poll(max(0.0, deadline - time.monotonic())):
+                raise TimeoutError
+            message = self.conn.recv()
+            if message[0] == 'driver':
+                self.driver_pids.add(message[1])
+                continue
+            if message[0] == 'preview':
+                if on_preview is not None:
+                    on_preview(message[1])
+                continue
+            if message[0] == 'item':
+                if on_item is not None:
+                    on_item(*message[1:])
+                deadline = time.monotonic() + timeout
+                continue
+            _, result, error = message
+            return result, error
+
+    def kill(self):
+        """强制结束渲染进程及其中的浏览器，下一个任务会启动新的进程"""
+        for pid in self.driver_pids:
+            kill_process_tree(pid)
+        if self.process is not None:
+            kill_process_tree(self.process.pid)
+            self.process.join(5)
+        if self.conn is not None:
+            self.conn.close()
+        self.process = None
+        self.conn = None
+        self.driver_pids = set()
+
+    def stop(self):
+        """通知渲染进程退出（关闭浏览器），未及时退出时强制结束"""
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+            self.process.join(10)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.kill()
+
+    def _run(self):
+        # 启动渲染进程并预热浏览器
+        try:
+            self.call(_warm_up_worker, (), self.farm.job_timeout)
+        except Exception as e:
+            print(f"渲染进程预热失败: {self.name}, 错误: {str(e)}")
+            self.kill()
+
+        while True:
+            _, _, job = self.farm._queue.get()
+            if job is None:
+                break
+            if isinstance(job, RenderBatch):
+                self._run_batch(job)
+                continue
+            try:
+                img_path, error = self.call(
+                    _render_job,
+                    (job.template_number, job.data, job.user_id, job.output, job.preview_callback is not None),
+                    job.timeout,
+                    on_preview=lambda path, job=job: self.farm._preview(job, path)
+                )
+            except TimeoutError:
+                print(f"渲染任务超时: {job.job_id} ({job.user_id})，结束渲染进程 {self.name}")
+                self.kill()
+                img_path, error = None, TimeoutError(f'贺卡渲染超时（{job.timeout}秒）')
+            except (EOFError, OSError) as e:
+                print(f"渲染进程意外退出: {self.name}")
+                self.kill()
+                img_path, error = None, RuntimeError(f'渲染进程意外退出: {str(e)}')
+            self.farm._finish(job, img_path, error)
+        self.stop()
+
+    def _run_batch(self, batch: RenderBatch):
+        """执行批量任务，每完成一张贺卡就回调；出错时尚未完成的贺卡都以该错误回调"""
+        finished = set()
+
+        def on_item(index, img_path, error):
+            finished.add(index)
+            self.farm._finish(batch.jobs[index], img_path, error)
+
+        try:
+            _, error = self.call(
+                _render_batch_job,
+                (batch.template_number, [(job.user_id, job.data) for job in batch.jobs], batch.output),
+                batch.timeout,
+                on_item=on_item
+            )
+        except TimeoutError:
+            print(f"批量渲染任务超时: 模板 {batch.template_number}，结束渲染进程 {self.name}")
+            self.kill()
+            error = TimeoutError(f'贺卡渲染超时（{batch.timeout}秒）')
+        except (EOFError, OSError) as e:
+            print(f"渲染进程意外退出: {self.name}")
+            self.kill()
+            error = RuntimeError(f'渲染进程意外退出: {str(e)}')
+        for index, job in enumerate(batch.jobs):
+            if index not in finished:
+                self.farm._finish(job, None, error or RuntimeError('批量渲染未返回该贺卡'))
+
+
+class RenderFarm:
+    """多进程贺卡渲染
+
+    回调函数签名为 callback(job_id, img_path, error)，成功时 error 为None，失败时 img_path 为None。
+    提交时指定 preview_callback 的任务在同一次页面加载中先截取预览图，预览回调的签名与 callback 相同，
+    总是在 callback 之前调用；命中渲染缓存或预览失败时不会调用。
+    任务超时后立即以 TimeoutError 回调，只结束并重启该任务所在的渲染进程，其他进程中的任务不受影响。
+    """
+
+    def __init__(self, workers: Optional[int] = None, job_timeout: float = 120):
+        """
+        Args:
+            workers: 渲染进程数，默认见 default_worker_count
+            job_timeout: 默认的单个任务超时时间（秒），从任务开始执行时计时
+        """
+        self.workers = workers or default_worker_count()
+        self.job_timeout = job_timeout
+        # 各平台都用 spawn 启动渲染进程，不继承界面进程的线程和Qt状态
+        self._context = multiprocessing.get_context('spawn')
+        self._queue = queue.PriorityQueue()
+        self._workers: List[_Worker] = []
+        self._start_lock = threading.Lock()
+        self._unfinished = 0
+        self._idle = threading.Condition()
+        self._ids = itertools.count(1)
+        self._closed = False
+
+    def submit(self, template_number: int, data: Dict, user_id: str,
+               callback: Optional[Callable] = None, timeout: Optional[float] = None, output=None,
+               preview_callback: Optional[Callable] = None) -> str:
+        """提交渲染任务（非阻塞）
+
+        Args:
+            template_number: 模板编号
+            data: 注入模板的数据
+            user_id: 联系人ID
+            callback: 完成后的回调，签名为 callback(job_id, img_path, error)
+            timeout: 任务超时时间（秒），默认使用 job_timeout
+            output: 输出选项或预设名称（见 card_output.OUTPUT_PRESETS）
+            preview_callback: 预览图就绪后的回调，签名为 preview_callback(job_id, preview_path, None)，
+                预览图路径见 card_utils.get_preview_path
+
+        Returns:
+            str: 任务ID
+        """
+        job = RenderJob(
+            f'render-{next(self._ids)}', template_number, data, user_id,
+            callback, timeout or self.job_timeout, output, preview_callback
+        )
+        self._enqueue(job, 1)
+        return job.job_id
+
+    def submit_batch(self, template_number: int, items: List, callback: Optional[Callable] = None,
+                     timeout: Optional[float] = None, output=None) -> List[str]:
+        """提交同一模板的一组渲染任务（非阻塞）
+
+        贺卡平均分给各渲染进程，每个进程只加载一次模板页面，依次替换数据截图（见 card_utils.render_batch），
+        每张贺卡仍有自己的任务ID，完成后分别回调。
+
+        Args:
+            template_number: 模板编号
+            items: (user_id, data) 序列
+            callback: 每张贺卡完成后的回调，签名为 callback(job_id, img_path, error)
+            timeout: 单张贺卡的超时时间（秒），默认使用 job_timeout
+            output: 输出选项或预设名称（见 card_output.OUTPUT_PRESETS）
+
+        Returns:
+            List[str]: 与 items 顺序一致的任务ID
+        """
+        timeout = timeout or self.job_timeout
+        jobs = [
+            RenderJob(f'render-{next(self._ids)}', template_number, data, user_id, callback, timeout, output)
+            for user_id, data in items
+        ]
+        chunk_size = max(1, -(-len(jobs) // self.workers))
+        for start in range(0, len(jobs), chunk_size):
+            chunk = jobs[start:start + chunk_size]
+            self._enqueue(RenderBatch(template_number, chunk, timeout, output), len(chunk))
+        return [job.job_id for job in jobs]
+
+    def _enqueue(self, job, count: int):
+        """任务（RenderJob 或 RenderBatch）进入队列，第一次提交时启动渲染进程
+
+        Args:
+            count: 任务包含的贺卡数，计入未完成任务数
+        """
+        if self._closed:
+            raise RuntimeError('渲染农场已关闭')
+        self.warm_up()
+        with self._idle:
+            self._unfinished += count
+        self._queue.put((0, next(self._ids), job))
+
+    def warm_up(self):
+        """启动全部渲染进程并预热其中的浏览器（已启动时直接返回）"""
+        with self._start_lock:
+            if self._workers or self._closed:
+                return
+            self._workers = [_Worker(self, i) for i in range(self.workers)]
+            for worker in self._workers:
+                worker.thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待所有已提交的任务完成
+
+        Returns:
+            bool: 是否在超时前全部完成
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._unfinished == 0, timeout)
+
+    @property
+    def pending_count(self) -> int:
+        """尚未完成的任务数（含排队中的任务）"""
+        with self._idle:
+            return self._unfinished
+
+    def shutdown(self, wait: bool = True):
+        """停止接收任务并关闭渲染进程
+
+        Args:
+            wait: 是否等待已提交的任务完成；为False时丢弃排队中的任务并立即结束渲染进程
+        """
+        if self._closed:
+            return
+        if wait:
+            self.wait()
+        self._closed = True
+        with self._start_lock:
+            workers = list(self._workers)
+        if wait:
+            for _ in workers:
+                self._queue.put((-1, next(self._ids), None))
+            for worker in workers:
+                worker.thread.join()
+        else:
+            for worker in workers:
+                worker.kill()
+
+    def _preview(self, job: RenderJob, preview_path: str):
+        """预览图就绪时回调"""
+        try:
+            job.preview_callback(job.job_id, preview_path, None)
+        except Exception as e:
+            print(f"预览回调执行失败: {str(e)}")
+
+    def _finish(self, job: RenderJob, img_path: Optional[str], error: Optional[BaseException]):
+        """回调并更新未完成任务数"""
+        if job.callback:
+            try:
+                job.callback(job.job_id, img_path, error)
+            except Exception as e:
+                print(f"渲染回调执行失败: {str(e)}")
+        with self._idle:
+            self._unfinished -= 1
+            self._idle.notify_all()
+
+
+_farm = None
+_farm_lock = threading.Lock()
+
+
+def get_render_farm(workers: Optional[int] = None) -> RenderFarm:
+    """获取进程内共享的渲染农场（渲染进程在第一次提交任务时才启动）
+
+    Args:
+        workers: 渲染进程数，仅在首次创建时生效
+    """
+    global _farm
+    with _farm_lock:
+        if _farm is None:
+            _farm = RenderFarm(workers)
+            atexit.register(_farm.shutdown, False)
+        return _farm
@@ -0,0 +1,392 @@
+"""
+基于SQLite的版本管理器，接口与 VersionManager 相同
+
+所有版本保存在 version_history/versions.db 中：
+    contacts  联系人（名称、头像哈希）
+    versions  版本（联系人ID、版本号、创建时间、风格及完整的版本数据JSON）
+    blobs     二进制内容（头像），按SHA-256去重
+贺卡图片与 VersionManager 一样按内容保存在 version_history/blobs 目录中并记录引用计数，
+生成新贺卡覆盖工作目录中的图片后，旧版本仍指向自己的副本。
+versions 表在 (wxid, version_number) 和 create_time 上建有索引，
+“每个联系人的最新版本”“某种风格的所有版本”“今天生成的版本”等查询不再需要在Python中遍历全部数据。
+首次创建数据库时自动迁移已有的版本文件。
+保留策略（见 version_retention）删除的版本直接从 versions 表删除，不再被引用的头像随之删除。
+"""
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime
+from typing import List, Dict, Iterable, Optional
+
+from newYear.utils.version_manager import VersionManager
+from newYear.utils.version_retention import RetentionPolicy
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS contacts (
+    wxid TEXT PRIMARY KEY,
+    name TEXT,
+    avatar_hash TEXT REFERENCES blobs(hash)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    wxid TEXT NOT NULL REFERENCES contacts(wxid),
+    version_number INTEGER NOT NULL,
+    create_time TEXT NOT NULL,
+    style TEXT,
+    avatar_hash TEXT REFERENCES blobs(hash),
+    data TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_versions_contact ON versions(wxid, version_number);
+CREATE INDEX IF NOT EXISTS idx_versions_create_time ON versions(create_time);
+'''
+
+# 未被任何版本或联系人引用的头像
+ORPHAN_BLOBS = '''SELECT hash FROM blobs WHERE hash NOT IN (
+    SELECT avatar_hash FROM versions WHERE avatar_hash IS NOT NULL
+    UNION SELECT avatar_hash FROM contacts WHERE avatar_hash IS NOT NULL)'''
+
+
+class SQLiteVersionManager(VersionManager):
+    """版本数据保存在SQLite数据库中，每次修改立即写入"""
+
+    DB_FILE = 'versions.db'
+
+    def __init__(self, db_path: Optional[str] = None, version_dir: Optional[str] = None):
+        """
+        Args:
+            db_path: 数据库文件路径，默认为 version_history/versions.db
+            version_dir: 版本历史目录（迁移的来源），默认为项目目录下的 version_history
+        """
+        # 不使用快照、日志和索引，只初始化共用的状态（迁移时读取原有的版本文件及其引用的头像和图片）
+        self._init_common(version_dir)
+        self.db_path = db_path or os.path.join(self.version_dir, self.DB_FILE)
+
+        is_new = not os.path.exists(self.db_path)
+        # 渲染完成的回调可能来自其他线程，连接由锁保护
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+        if is_new:
+            self.migrate_from_json()
+
+    def close(self):
+        """关闭数据库连接"""
+        self._retention_stop.set()
+        with self._lock:
+            self.conn.close()
+
+    def migrate_from_json(self) -> int:
+        """把 version_history 中的版本文件（快照和日志）导入数据库（已存在的版本号会跳过，可重复执行）
+
+        Returns:
+            int: 导入的版本数
+        """
+        migrated = 0
+        with self._lock, self.conn:
+            for wxid in sorted(self.list_contacts()):
+                try:
+                    for version in self._read_contact(wxid):
+                        version.setdefault('contact', {})['wxid'] = wxid
+                        version.setdefault('version_number', 1)
+                        version.setdefault('create_time', '')
+                        if self._insert_version(version, ignore_existing=True):
+                            migrated += 1
+                except Exception as e:
+                    print(f"迁移版本数据失败 - 联系人ID: {wxid}, 错误: {str(e)}")
+        if migrated:
+            print(f"已从版本文件迁移 {migrated} 个版本到 {self.db_path}")
+        return migrated
+
+    def _store_blob(self, data) -> Optional[str]:
+        """保存二进制内容，返回其哈希"""
+        data = self.decode_binary(data)
+        if not isinstance(data, bytes) or not data:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        self.conn.execute(
+            'INSERT OR IGNORE INTO blobs (hash, data, size) VALUES (?, ?, ?)',
+            (digest, sqlite3.Binary(data), len(data))
+        )
+        return digest
+
+    def _load_blob(self, digest: Optional[str]) -> Optional[bytes]:
+        """按哈希读取二进制内容"""
+        if not digest:
+            return None
+        row = self.conn.execute('SELECT data FROM blobs WHERE hash = ?', (digest,)).fetchone()
+        return bytes(row['data']) if row else None
+
+    def _insert_version(self, version_info: Dict, ignore_existing: bool = False) -> bool:
+        """写入一个版本并更新联系人信息（调用方负责事务）
+
+        Returns:
+            bool: 是否写入（ignore_existing 时版本号已存在则跳过）
+        """
+        contact = version_info.get('contact', {})
+        wxid = contact['wxid']
+        avatar_hash = self._store_blob(contact.get('avatar'))
+        self.conn.execute(
+            '''INSERT INTO contacts (wxid, name, avatar_hash) VALUES (?, ?, ?)
+               ON CONFLICT(wxid) DO UPDATE SET name = excluded.name,
+                   avatar_hash = COALESCE(excluded.avatar_hash, contacts.avatar_hash)''',
+            (wxid, contact.get('name', ''), avatar_hash)
+        )
+        cursor = self.conn.execute(
+            f'''INSERT {'OR IGNORE ' if ignore_existing else ''}INTO versions
+                (wxid, version_number, create_time, style, avatar_hash, data)
+                VALUES (?, ?, ?, ?, ?, ?)''',
+            (wxid, version_info['version_number'], version_info.get('create_time', ''),
+             version_info.get('style', ''), avatar_hash, self._version_json(version_info))
+        )
+        return cursor.rowcount > 0
+
+    def _version_json(self, version_info: Dict) -> str:
+        """版本数据转为JSON（头像单独保存在 blobs 表中）"""
+        stored = version_info.copy()
+        if 'contact' in stored:
+            stored['contact'] = {k: v for k, v in stored['contact'].items() if k != 'avatar'}
+        if stored.get('style') == 'custom':
+            stored['custom_prompt'] = stored.get('style_content', '')
+        return json.dumps(stored, ensure_ascii=False)
+
+    def _decode_version(self, row: sqlite3.Row) -> Dict:
+        """由数据库行还原版本数据"""
+        version = json.loads(row['data'])
+        contact = version.setdefault('contact', {'wxid': row['wxid']})
+        avatar = self._load_blob(row['avatar_hash'])
+        if avatar is not None:
+            contact['avatar'] = avatar
+        if version.get('image_hash'):
+            version['image_path'] = self.blobs.path(version['image_hash'])
+        return version
+
+    def _attach_blobs(self, version_info: Dict) -> List[str]:
+        """把贺卡图片存入 blobs 目录并记录哈希（头像保存在数据库的 blobs 表中）
+
+        Returns:
+            List[str]: 版本引用的 blobs 目录中的对象（调用方负责增加引用计数），
+                包括从版本文件迁移来的头像哈希
+        """
+        self._attach_image(version_info)
+        return self._blob_refs(version_info)
+
+    def check_consistency(self, repair: bool = False) -> List[str]:
+        """检查数据库的一致性：数据库文件完整性、没有版本的联系人、未被引用的头像
+
+        Args:
+            repair: 是否删除没有版本的联系人和未被引用的头像
+
+        Returns:
+            List[str]: 发现的问题
+        """
+        orphan_contacts = 'SELECT wxid FROM contacts WHERE wxid NOT IN (SELECT wxid FROM versions)'
+        issues = []
+        with self._lock:
+            result = self.conn.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                issues.append(f"数据库文件损坏: {result}")
+            contacts = self.conn.execute(orphan_contacts).fetchall()
+            if contacts:
+                issues.append(f"没有版本的联系人 {len(contacts)} 个")
+                if repair:
+                    with self.conn:
+                        self.conn.execute(f'DELETE FROM contacts WHERE wxid IN ({orphan_contacts})')
+            blobs = self.conn.execute(ORPHAN_BLOBS).fetchall()
+            if blobs:
+                issues.append(f"未被引用的头像 {len(blobs)} 个")
+                if repair:
+                    with self.conn:
+                        self.conn.execute(f'DELETE FROM blobs WHERE hash IN ({ORPHAN_BLOBS})')
+        return issues
+
+    def load_versions(self):
+        """数据库按需查询，无需预先加载"""
+
+    def mark_dirty(self, contact_id: str):
+        """每次修改立即写入数据库，无需标记"""
+
+    def save_versions(self, contact_ids: Optional[Iterable[str]] = None):
+        """每次修改立即写入数据库，无需单独保存"""
+
+    def flush(self):
+        """每次修改在事务提交时已写入数据库"""
+
+    def add_version(self, version_info, wait: bool = True):
+        """添加新版本（wait 仅为与 VersionManager 接口一致，事务提交即已写入）"""
+        contact_id = version_info['contact']['wxid']
+        self.apply_style_content(version_info)
+        # 图片存入 blobs 目录，引用计数在版本写入数据库前保存，避免对象被误删
+        for ref in self._attach_blobs(version_info):
+            self.blobs.incref(ref)
+        self.blobs.flush()
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                'SELECT MAX(version_number) AS latest FROM versions WHERE wxid = ?', (contact_id,)
+            ).fetchone()
+            version_info['version_number'] = (row['latest'] or 0) + 1
+            version_info['create_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._insert_version(version_info)
+        self._notify('added', version_info)
+        return version_info
+
+    def update_version(self, version_info):
+        """更新版本信息（版本不存在时不做任何修改）"""
+        contact_id = version_info['contact']['wxid']
+        self.apply_style_content(version_info)
+        with self._lock, self.conn:
+            old = self.conn.execute(
+                'SELECT data FROM versions WHERE wxid = ? AND version_number = ?',
+                (contact_id, version_info.get('version_number'))
+            ).fetchone()
+            if not old:
+                print(f"更新版本失败，版本不存在 - 联系人ID: {contact_id}, 版本号: {version_info.get('version_number')}")
+                return
+            # 新引用的对象先增加引用计数并保存
+            for ref in self._attach_blobs(version_info):
+                self.blobs.incref(ref)
+            self.blobs.flush()
+            old_refs = self._blob_refs(json.loads(old['data']))
+            avatar_hash = self._store_blob(version_info['contact'].get('avatar'))
+            self.conn.execute(
+                '''UPDATE versions SET create_time = ?, style = ?,
+                       avatar_hash = COALESCE(?, avatar_hash), data = ?
+                   WHERE wxid = ? AND version_number = ?''',
+                (version_info.get('create_time', ''), version_info.get('style', ''), avatar_hash,
+                 self._version_json(version_info), contact_id, version_info.get('version_number'))
+            )
+
+        # 事务提交后再释放旧版本的引用
+        for ref in old_refs:
+            self.blobs.decref(ref)
+        self.blobs.flush()
+        self._notify('updated', version_info)
+
+    def delete_versions(self, contact_id: str, version_numbers: Iterable[int]) -> List[Dict]:
+        """删除联系人的指定版本，并删除不再被引用的头像和图片
+
+        Returns:
+            List[Dict]: 被删除的版本
+        """
+        numbers = set(version_numbers)
+        with self._lock, self.conn:
+            removed = [v for v in self.find_versions(contact_id=contact_id) if v.get('version_number') in numbers]
+            if not removed:
+                return []
+            self.conn.executemany(
+                'DELETE FROM versions WHERE wxid = ? AND version_number = ?',
+                [(contact_id, v['version_number']) for v in removed]
+            )
+            self.conn.execute(f'DELETE FROM blobs WHERE hash IN ({ORPHAN_BLOBS})')
+
+        # 删除提交后再释放版本引用的图片（及迁移来的头像），引用计数归零的对象在 flush 时删除
+        for version in removed:
+            for ref in self._blob_refs(version):
+                self.blobs.decref(ref)
+        self.blobs.flush()
+        for version in removed:
+            self._notify('deleted', version)
+        return removed
+
+    def apply_retention(self, policy: Optional[RetentionPolicy] = None) -> int:
+        """按保留策略删除旧版本，并清理未被引用的图片
+
+        Returns:
+            int: 删除的版本数
+        """
+        policy = policy or RetentionPolicy()
+        deleted = 0
+        if policy.enabled:
+            with self._lock:
+                contact_ids = [row['wxid'] for row in self.conn.execute('SELECT DISTINCT wxid FROM versions')]
+            for contact_id in contact_ids:
+                try:
+                    expired = policy.expired(self.find_versions(contact_id=contact_id))
+                    if expired:
+                        deleted += len(self.delete_versions(contact_id, [v['version_number'] for v in expired]))
+                except Exception as e:
+                    print(f"清理旧版本失败 - 联系人ID: {contact_id}, 错误: {str(e)}")
+        orphans = self.blobs.collect_garbage()
+        if deleted or orphans:
+            print(f"版本清理完成: 删除 {deleted} 个旧版本, {orphans} 个未引用的图片")
+        return deleted
+
+    def get_contact_versions(self, contact_id):
+        """获取指定联系人的所有版本（按版本号排序）"""
+        return self.find_versions(contact_id=contact_id)
+
+    def get_all_versions(self):
+        """获取所有版本，联系人ID -> 版本列表"""
+        all_versions = {}
+        for version in self.find_versions():
+            all_versions.setdefault(version['contact']['wxid'], []).append(version)
+        return all_versions
+
+    def get_latest_version(self, contact_id: str) -> Optional[Dict]:
+        """获取联系人的最新版本"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT * FROM versions WHERE wxid = ? ORDER BY version_number DESC LIMIT 1', (contact_id,)
+            ).fetchone()
+            return self._decode_version(row) if row else None
+
+    def get_version_index(self) -> List[Dict]:
+        """获取每个联系人最新版本的摘要，按创建时间排序（格式同 VersionManager.get_version_index）"""
+        with self._lock:
+            rows = self.conn.execute('''
+                SELECT v.wxid, v.version_number, v.create_time, latest.version_count,
+                       c.name, COALESCE(v.avatar_hash, c.avatar_hash) AS avatar_hash
+                FROM (SELECT wxid, MAX(version_number) AS version_number, COUNT(*) AS version_count
+                      FROM versions GROUP BY wxid) AS latest
+                JOIN versions v ON v.wxid = latest.wxid AND v.version_number = latest.version_number
+                LEFT JOIN contacts c ON c.wxid = v.wxid
+                ORDER BY v.create_time
+            ''').fetchall()
+            return [{
+                'contact': {'wxid': row['wxid'], 'name': row['name'] or '', 'avatar': self._load_blob(row['avatar_hash'])},
+                'version_number': row['version_number'],
+                'create_time': row['create_time'],
+                'version_count': row['version_count'],
+                'is_summary': True
+            } for row in rows]
+
+    def find_versions(self, contact_id: Optional[str] = None, style: Optional[str] = None,
+                      since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """按条件查询版本
+
+        Args:
+            contact_id: 联系人ID
+            style: 风格
+            since: 创建时间下限（含），格式同 create_time，如 '2025-01-28' 表示当天及以后
+            until: 创建时间上限（不含）
+
+        Returns:
+            List[Dict]: 版本列表，按联系人和版本号排序
+        """
+        conditions, params = [], []
+        if contact_id is not None:
+            conditions.append('wxid = ?')
+            params.append(contact_id)
+        if style is not None:
+            conditions.append('style = ?')
+            params.append(style)
+        if since is not None:
+            conditions.append('create_time >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('create_time < ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT * FROM versions {where} ORDER BY wxid, version_number', params
+            ).fetchall()
+            return [self._decode_version(row) for row in rows]
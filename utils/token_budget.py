@@ -0,0 +1,78 @@
+"""
+Token预算工具，用于在发送请求前估算提示词和生成内容的Token数，并限制单次请求和整批生成的Token用量
+"""
+import re
+import threading
+from typing import Optional
+
+# 中日韩字符（含全角标点）约 0.6 个Token/字，其余文本约 4 个字符/Token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_CHARS_PER_TOKEN = 4
+
+
+class TokenBudgetExceeded(Exception):
+    """Token用量超出预算"""
+    pass
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的Token数
+
+    Args:
+        text: 待估算的文本
+
+    Returns:
+        int: 估算的Token数
+    """
+    if not text:
+        return 0
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    other_chars = len(text) - cjk_chars
+    return int(cjk_chars * CJK_TOKENS_PER_CHAR + other_chars / OTHER_CHARS_PER_TOKEN) + 1
+
+
+class TokenBudget:
+    """整批生成的Token预算
+
+    发送请求前按估算值预留额度，收到响应后再按实际用量结算；
+    预留失败时抛出 TokenBudgetExceeded，调用方据此停止后续请求。
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None):
+        """
+        Args:
+            max_tokens: 整批允许使用的Token总数，为None时不限制
+        """
+        self.max_tokens = max_tokens
+        self.used_tokens = 0
+        self.reserved_tokens = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int):
+        """预留额度"""
+        with self._lock:
+            if self.max_tokens is not None and self.used_tokens + self.reserved_tokens + tokens > self.max_tokens:
+                raise TokenBudgetExceeded(
+                    f"本批次Token预算不足：已用 {self.used_tokens}，预留 {self.reserved_tokens}，"
+                    f"本次需要约 {tokens}，上限 {self.max_tokens}"
+                )
+            self.reserved_tokens += tokens
+
+    def settle(self, reserved: int, actual: int):
+        """按实际用量结算已预留的额度"""
+        with self._lock:
+            self.reserved_tokens = max(0, self.reserved_tokens - reserved)
+            self.used_tokens += actual
+
+    def release(self, reserved: int):
+        """请求失败时释放预留的额度"""
+        self.settle(reserved, 0)
+
+    @property
+    def remaining_tokens(self) -> Optional[int]:
+        """剩余可用的Token数"""
+        if self.max_tokens is None:
+            return None
+        with self._lock:
+            return max(0, self.max_tokens - self.used_tokens - self.reserved_tokens)
@@ -0,0 +1,136 @@
+"""
+版本存储格式的性能对比：生成大量模拟版本，分别测量各快照格式的保存、加载耗时和文件大小
+
+    python -m newYear.utils.version_benchmark --versions 10000 --contacts 500
+"""
+import os
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from newYear.utils.version_manager import VersionManager
+from newYear.utils.version_serializer import SERIALIZERS
+
+
+def make_versions(count: int, contacts: int) -> Dict[str, List[Dict]]:
+    """生成模拟的版本数据，联系人ID -> 版本列表"""
+    start = datetime(2025, 1, 20, 9, 0, 0)
+    versions: Dict[str, List[Dict]] = {}
+    for i in range(count):
+        wxid = f'wxid_bench_{i % contacts:05d}'
+        contact_versions = versions.setdefault(wxid, [])
+        contact_versions.append({
+            'contact': {
+                'wxid': wxid,
+                'name': f'联系人{i % contacts}'
+            },
+            'version_number': len(contact_versions) + 1,
+            'create_time': (start + timedelta(seconds=i * 7)).strftime('%Y-%m-%d %H:%M:%S'),
+            'style': 'warm',
+            'style_prompt': '温馨亲切的语气，回忆过去一年的点滴，表达真诚的感谢与祝福。' * 3,
+            'style_content': '温馨亲切的语气，回忆过去一年的点滴，表达真诚的感谢与祝福。' * 3,
+            'greeting': f'新春快乐！感谢你这一年的陪伴与支持，愿新的一年万事顺意、阖家幸福。（{i}）' * 2,
+            'poem': '春风送暖入屠苏，\n瑞雪迎春兆丰年。\n金蛇狂舞辞旧岁，\n万家灯火贺新年。',
+            'idioms': '万事如意 | 心想事成 | 岁岁平安 | 前程似锦',
+            'wishes': '身体健康，工作顺利，家庭和睦，平安喜乐。',
+            'signature': '小明',
+            'template_number': i % 6 + 1,
+            'image_hash': hashlib.sha256(str(i).encode('utf-8')).hexdigest() + '.jpg'
+        })
+    return versions
+
+
+def directory_size(path: str) -> int:
+    """目录中快照文件的总大小（不含 blobs 目录）"""
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def run_benchmark(versions: Dict[str, List[Dict]], serializer: str, append: int = 0) -> Dict:
+    """测量一种快照格式
+
+    Args:
+        versions: 模拟的版本数据
+        serializer: 快照格式名称
+        append: 额外追加的版本数（测量日志写入），为0时不测
+
+    Returns:
+        Dict: 各项耗时（秒）和文件大小（字节）
+    """
+    work_dir = tempfile.mkdtemp(prefix='version_bench_')
+    try:
+        manager = VersionManager(version_dir=work_dir, serializer=serializer)
+        manager.versions = {}
+        for wxid, items in versions.items():
+            # 每个联系人一个约4KB的头像对象
+            avatar_hash = manager.blobs.put(hashlib.sha256(wxid.encode('utf-8')).digest() * 128)
+            manager.versions[wxid] = [
+                dict(version, contact=dict(version['contact'], avatar_hash=avatar_hash)) for version in items
+            ]
+        started = time.perf_counter()
+        manager.save_versions(list(manager.versions))
+        save_time = time.perf_counter() - started
+        size = directory_size(work_dir)
+
+        # 启动时只读索引
+        started = time.perf_counter()
+        reloaded = VersionManager(version_dir=work_dir, serializer=serializer)
+        index_time = time.perf_counter() - started
+
+        # 读取全部快照
+        started = time.perf_counter()
+        reloaded.load_versions()
+        load_time = time.perf_counter() - started
+        loaded = sum(len(items) for items in reloaded.versions.values())
+
+        report = {
+            'serializer': serializer,
+            'versions': loaded,
+            'save': save_time,
+            'index': index_time,
+            'load': load_time,
+            'size': size
+        }
+        if append:
+            sample = next(iter(versions.values()))[0]
+            started = time.perf_counter()
+            for i in range(append):
+                version = dict(sample, contact=dict(sample['contact'], wxid=f'wxid_bench_{i % 50:05d}'))
+                reloaded.add_version(version, wait=False)
+            reloaded.flush()
+            report['append'] = time.perf_counter() - started
+        reloaded.close()
+        manager.close()
+        return report
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(report: Dict):
+    """打印一种格式的结果"""
+    line = (f"{report['serializer']:<13} 保存 {report['save'] * 1000:8.1f}ms  "
+            f"启动(索引) {report['index'] * 1000:7.1f}ms  加载全部 {report['load'] * 1000:8.1f}ms  "
+            f"大小 {report['size'] / 1024 / 1024:6.2f}MB")
+    if 'append' in report:
+        line += f"  追加 {report['append'] * 1000:7.1f}ms"
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='版本存储格式性能对比')
+    parser.add_argument('--versions', type=int, default=10000, help='版本总数')
+    parser.add_argument('--contacts', type=int, default=500, help='联系人数')
+    parser.add_argument('--append', type=int, default=1000, help='额外追加的版本数（测量日志写入），0为不测')
+    parser.add_argument('--formats', default=','.join(SERIALIZERS), help='要测量的格式，逗号分隔')
+    args = parser.parse_args()
+
+    data = make_versions(args.versions, args.contacts)
+    print(f"版本数: {args.versions}  联系人数: {args.contacts}")
+    for name in args.formats.split(','):
+        try:
+            print_report(run_benchmark(data, name.strip(), args.append))
+        except ImportError as e:
+            print(f"{name:<13} 跳过: {str(e)}")
@@ -1,115 +1,757 @@
 """
 版本管理器，用于管理生成内容的版本
+
+启动时只读取轻量的索引文件（_index.json，记录每个联系人的最新版本号、创建时间、名称和头像），
+各联系人的完整版本数据在首次访问时才从对应的JSON文件加载。
+头像和贺卡图片保存在按内容寻址的 blobs 目录中（见 blob_store），版本数据中只记录 avatar_hash 和 image_hash。
+
+新增和修改的版本不再重写整个JSON文件，而是作为一行追加到联系人的日志（{wxid}.journal），
+多个写入合并后只调用一次 fsync（组提交）；日志超过一定行数后在后台合并到JSON快照文件。
+加载时先读快照再按版本号重放日志，崩溃时写了一半的最后一行会被丢弃。
+快照文件的格式可以配置（见 version_serializer），读取时按扩展名识别，已有文件无需转换。
+按保留策略（见 version_retention）在后台删除旧版本，删除作为一行记录追加到日志，版本引用的图片随引用计数归零删除。
 """
 import os
 import json
+import queue
+import atexit
 import base64
+import argparse
+import threading
+from concurrent.futures import Future
 from datetime import datetime
-from typing import List, Dict
+from typing import Callable, List, Dict, Iterable, Optional, Tuple
+
+from newYear.utils.blob_store import BlobStore
+from newYear.utils.version_retention import RetentionPolicy, env_number
+from newYear.utils.version_serializer import SNAPSHOT_READERS, get_serializer, serializer_for_path
+
+
+class _JournalWriter:
+    """日志写入线程：排队中的写入请求一起写入，每个文件只调用一次 fsync"""
+    
+    def __init__(self, before_write: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            before_write: 每批记录写入前在写入线程中调用，用于先保存这些记录依赖的数据（如对象的引用计数）
+        """
+        self._before_write = before_write
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='VersionJournalWriter', daemon=True)
+        self._thread.start()
+        
+    def append(self, path: str, record: Dict) -> Future:
+        """追加一条记录，返回的 Future 在记录写入磁盘后完成"""
+        future = Future()
+        self._queue.put((path, json.dumps(record, ensure_ascii=False) + '\n', future))
+        return future
+        
+    def flush(self):
+        """等待已排队的记录全部写入磁盘"""
+        future = Future()
+        self._queue.put((None, '', future))
+        future.result()
+        
+    def _run(self):
+        while True:
+            # 上一批 fsync 期间到达的请求合并为一批
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            by_path = {}
+            for path, line, future in batch:
+                if path is not None:
+                    by_path.setdefault(path, []).append((line, future))
+            if by_path and self._before_write is not None:
+                self._before_write()
+            for path, items in by_path.items():
+                try:
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(''.join(line for line, _ in items))
+                        f.flush()
+                        os.fsync(f.fileno())
+                except Exception as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                else:
+                    for _, future in items:
+                        future.set_result(None)
+            for path, _, future in batch:
+                if path is None:
+                    future.set_result(None)
+
 
 class VersionManager:
-    def __init__(self):
+    # 索引文件名（不对应任何联系人）
+    INDEX_FILE = '_index.json'
+    # 日志文件扩展名
+    JOURNAL_EXT = '.journal'
+    # 日志超过该行数时在后台合并到快照文件
+    COMPACT_THRESHOLD = 100
+    
+    def __init__(self, version_dir: Optional[str] = None, serializer: Optional[str] = None):
+        """
+        Args:
+            version_dir: 版本历史目录，默认为项目目录下的 version_history
+            serializer: 快照文件的写入格式（见 version_serializer.get_serializer）
+        """
+        self._init_common(version_dir, serializer)
+            
+        # 已加载的版本数据，联系人ID -> 版本列表（按需加载）
+        self.versions = {}
+        # 有改动、尚未写入文件的联系人
+        self._dirty = set()
+        # 版本索引，联系人ID -> 摘要信息
+        self._index = {}
+        self._index_dirty = False
+        # 索引中需要在保存时更新文件签名的联系人
+        self._index_pending = set()
+        
+        # 版本引用的对象在追加日志前已增加引用计数，写入线程每批先保存一次引用计数再写日志，
+        # 日志中出现的版本引用的对象在磁盘上一定有引用计数，同时多个版本只需一次 fsync
+        self._journal = _JournalWriter(before_write=self.blobs.flush)
+        self._compact_queue = queue.Queue()
+        self._compacting = set()
+        self._compactor = threading.Thread(target=self._compact_loop, name='VersionCompactor', daemon=True)
+        self._compactor.start()
+        atexit.register(self.close)
+        
+        # 只加载索引
+        self.load_index()
+        
+    def _init_common(self, version_dir: Optional[str] = None, serializer: Optional[str] = None):
+        """初始化各种存储方式共用的状态（子类不调用 __init__ 时需要调用）
+        
+        Args:
+            version_dir: 版本历史目录，默认为项目目录下的 version_history
+            serializer: 快照文件的写入格式（见 version_serializer.get_serializer）
+        """
         # 设置版本历史目录
-        self.version_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'version_history')
+        self.version_dir = version_dir or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'version_history')
+        self.serializer = get_serializer(serializer)
         
         # 确保目录存在
-        if not os.path.exists(self.version_dir):
-            os.makedirs(self.version_dir)
-            
-        # 初始化版本数据
-        self.versions = {}
+        os.makedirs(self.version_dir, exist_ok=True)
         
-        # 加载所有版本数据
-        self.load_versions()
+        # 头像和贺卡图片
+        self.blobs = BlobStore(os.path.join(self.version_dir, 'blobs'))
+        # 版本变化的监听者
+        self._listeners = []
+        # 版本数据可能同时被界面线程和后台线程访问
+        self._lock = threading.RLock()
+        # 各联系人日志中的记录数
+        self._journal_lines = {}
+        # 后台清理线程（start_retention 启动）
+        self._retention = None
+        self._retention_stop = threading.Event()
+        
+    def load_index(self):
+        """加载版本索引，并按快照和日志文件的修改时间和大小更新过期或缺失的条目"""
+        index_path = os.path.join(self.version_dir, self.INDEX_FILE)
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            self._index = {}
+        except Exception as e:
+            print(f"版本索引损坏，重新建立: {str(e)}")
+            self._index = {}
+            
+        found = self.list_contacts()
+        for wxid in found:
+            cached = self._index.get(wxid)
+            if cached and cached.get('files') == self._file_signature(wxid):
+                continue
+            # 文件在索引建立后被修改过，重新读取该联系人
+            try:
+                self._set_index_entry(wxid, self._read_contact(wxid))
+            except Exception as e:
+                print(f"加载版本数据失败 - 联系人ID: {wxid}, 错误: {str(e)}")
+                self._index.pop(wxid, None)
+                self._index_dirty = True
+                
+        for wxid in set(self._index) - found:
+            del self._index[wxid]
+            self._index_dirty = True
+            
+        if self._index_dirty:
+            self._save_index()
+            
+    def list_contacts(self) -> set:
+        """版本历史目录中有快照或日志文件的联系人"""
+        found = set()
+        for entry in os.scandir(self.version_dir):
+            if entry.name == self.INDEX_FILE:
+                continue
+            name, ext = os.path.splitext(entry.name)
+            if ext in SNAPSHOT_READERS or ext == self.JOURNAL_EXT:
+                found.add(name)
+        return found
         
     def load_versions(self):
-        """加载所有版本数据"""
-        if not os.path.exists(self.version_dir):
+        """加载所有联系人的完整版本数据"""
+        for wxid in list(self._index):
+            self._ensure_loaded(wxid)
+            
+    def _ensure_loaded(self, wxid: str) -> List[Dict]:
+        """确保联系人的完整版本数据已加载"""
+        with self._lock:
+            if wxid not in self.versions:
+                if wxid in self._index:
+                    try:
+                        self.versions[wxid] = self._read_contact(wxid)
+                        self._migrate_avatars(wxid)
+                    except Exception as e:
+                        print(f"加载版本数据失败 - 联系人ID: {wxid}, 错误: {str(e)}")
+                        self.versions[wxid] = []
+                else:
+                    self.versions[wxid] = []
+            return self.versions[wxid]
+        
+    def _read_contact(self, wxid: str) -> List[Dict]:
+        """从快照文件和日志读取联系人的版本数据"""
+        snapshot_path = self.find_snapshot(wxid)
+        if snapshot_path:
+            with open(snapshot_path, 'rb') as f:
+                encoded_versions = serializer_for_path(snapshot_path).loads(f.read())
+        else:
+            # 尚未合并过，只有日志
+            encoded_versions = []
+        if isinstance(encoded_versions, dict):
+            # 旧格式（字典）
+            encoded_versions = [encoded_versions['latest_version']] if 'latest_version' in encoded_versions else []
+        encoded_versions = self._replay_journal(wxid, encoded_versions)
+        # 解码版本数据
+        return [self.process_version_data(version, encode=False) for version in encoded_versions]
+        
+    def _replay_journal(self, wxid: str, encoded_versions: List[Dict]) -> List[Dict]:
+        """在快照上按版本号重放日志记录"""
+        path = self.get_journal_file(wxid)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._journal_lines[wxid] = 0
+            return encoded_versions
+            
+        if data and not data.endswith(b'\n'):
+            # 写入时崩溃留下的半行，截掉后才能继续追加
+            print(f"丢弃日志中不完整的记录 - 联系人ID: {wxid}")
+            data = data[:data.rfind(b'\n') + 1]
+            with open(path, 'r+b') as f:
+                f.truncate(len(data))
+                
+        positions = {version.get('version_number'): i for i, version in enumerate(encoded_versions)}
+        lines = data.decode('utf-8').splitlines()
+        for line_number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"跳过损坏的日志记录 - 联系人ID: {wxid}, 行号: {line_number}")
+                continue
+            if record.get('op') == 'put':
+                version = record['version']
+                number = version.get('version_number')
+                if number in positions:
+                    encoded_versions[positions[number]] = version
+                else:
+                    positions[number] = len(encoded_versions)
+                    encoded_versions.append(version)
+            elif record.get('op') == 'delete':
+                number = record.get('version_number')
+                if number in positions:
+                    encoded_versions[positions.pop(number)] = None
+        self._journal_lines[wxid] = len(lines)
+        return [version for version in encoded_versions if version is not None]
+        
+    def _append_journal(self, contact_id: str, record: Dict) -> Future:
+        """把一条记录追加到日志，日志过长时安排后台合并
+        
+        Args:
+            contact_id: 联系人ID
+            record: {'op': 'put', 'version': ...} 或 {'op': 'delete', 'version_number': ...}
+        """
+        future = self._journal.append(self.get_journal_file(contact_id), record)
+        self._journal_lines[contact_id] = self._journal_lines.get(contact_id, 0) + 1
+        self._set_index_entry(contact_id, self.versions[contact_id])
+        if self._journal_lines[contact_id] >= self.COMPACT_THRESHOLD and contact_id not in self._compacting:
+            self._compacting.add(contact_id)
+            self._compact_queue.put(contact_id)
+        return future
+        
+    def _compact_loop(self):
+        """后台合并线程"""
+        while True:
+            contact_id = self._compact_queue.get()
+            try:
+                self.compact(contact_id)
+            except Exception as e:
+                print(f"合并版本日志失败 - 联系人ID: {contact_id}, 错误: {str(e)}")
+            finally:
+                self._compacting.discard(contact_id)
+                
+    def compact(self, contact_id: str):
+        """把联系人的日志合并到快照文件"""
+        with self._lock:
+            self._ensure_loaded(contact_id)
+            self.save_versions([contact_id])
+            
+    def flush(self):
+        """等待排队中的日志记录写入磁盘"""
+        self._journal.flush()
+        
+    def close(self):
+        """写完日志并保存索引"""
+        self._retention_stop.set()
+        with self._lock:
+            self._journal.flush()
+            if self._index_dirty:
+                self._save_index()
+        
+    def _migrate_avatars(self, wxid: str):
+        """把旧版本中内嵌的头像移到 blobs 目录，文件改为只记录头像哈希"""
+        migrated = False
+        for version in self.versions[wxid]:
+            contact = version.get('contact', {})
+            if isinstance(contact.get('avatar'), bytes) and not contact.get('avatar_hash'):
+                contact['avatar_hash'] = self.blobs.put(contact['avatar'])
+                self.blobs.incref(contact['avatar_hash'])
+                migrated = True
+        if migrated:
+            self.blobs.flush()
+            self.mark_dirty(wxid)
+            self.save_versions([wxid])
+            
+    def _attach_blobs(self, version_info: Dict) -> List[str]:
+        """把版本的头像和贺卡图片存入 blobs 目录并记录哈希
+        
+        Returns:
+            List[str]: 版本引用的对象（调用方负责增加引用计数）
+        """
+        contact = version_info.get('contact', {})
+        avatar = self.decode_binary(contact.get('avatar'))
+        if isinstance(avatar, bytes) and avatar:
+            contact['avatar'] = avatar
+            contact['avatar_hash'] = self.blobs.put(avatar)
+        self._attach_image(version_info)
+        return self._blob_refs(version_info)
+        
+    def _attach_image(self, version_info: Dict):
+        """把版本的贺卡图片存入 blobs 目录，image_path 改为指向该副本"""
+        image_path = version_info.get('image_path')
+        image_hash = version_info.get('image_hash')
+        if image_path and not (image_hash and image_path == self.blobs.path(image_hash)) and os.path.exists(image_path):
+            # 生成的图片每次都写到同一路径，保存一份副本作为该版本的图片
+            version_info['image_hash'] = self.blobs.put_file(image_path)
+            version_info['image_path'] = self.blobs.path(version_info['image_hash'])
+        
+    @staticmethod
+    def _blob_refs(version_info: Dict) -> List[str]:
+        """版本引用的对象"""
+        refs = [version_info.get('contact', {}).get('avatar_hash'), version_info.get('image_hash')]
+        return [ref for ref in refs if ref]
+        
+    def _file_signature(self, wxid: str) -> List:
+        """快照和日志文件的修改时间和大小，用于判断索引条目是否过期"""
+        signature = []
+        for path in (self.find_snapshot(wxid), self.get_journal_file(wxid)):
+            if path is None:
+                signature.append(None)
+                continue
+            try:
+                stat = os.stat(path)
+                signature.append([stat.st_mtime, stat.st_size])
+            except FileNotFoundError:
+                signature.append(None)
+        return signature
+        
+    def _set_index_entry(self, wxid: str, versions: List[Dict]):
+        """根据版本数据更新索引条目（文件签名在保存索引时更新）"""
+        if not versions:
+            self._index.pop(wxid, None)
+            self._index_dirty = True
             return
+        latest = max(versions, key=lambda v: v.get('version_number', 0))
+        contact = latest.get('contact', {})
+        self._index[wxid] = {
+            'wxid': wxid,
+            'name': contact.get('name', ''),
+            'avatar_hash': contact.get('avatar_hash'),
+            'avatar': None if contact.get('avatar_hash') else self.encode_binary(contact.get('avatar')),
+            'latest_version': latest.get('version_number', 0),
+            'create_time': latest.get('create_time', ''),
+            'version_count': len(versions),
+            'files': self._index.get(wxid, {}).get('files')
+        }
+        self._index_pending.add(wxid)
+        self._index_dirty = True
+        
+    def _save_index(self):
+        """写入索引文件"""
+        # 日志写入磁盘后再记录文件签名，否则下次启动会把该联系人当作过期重新读取
+        self._journal.flush()
+        for wxid in self._index_pending:
+            if wxid in self._index:
+                self._index[wxid]['files'] = self._file_signature(wxid)
+        self._index_pending.clear()
+        index_path = os.path.join(self.version_dir, self.INDEX_FILE)
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._index, f, ensure_ascii=False)
+            os.replace(tmp_path, index_path)
+            self._index_dirty = False
+        except Exception as e:
+            print(f"保存版本索引失败: {str(e)}")
             
-        # 遍历版本文件
-        for filename in os.listdir(self.version_dir):
-            if filename.endswith('.json'):
-                wxid = filename[:-5]  # 移除.json后缀
-                file_path = os.path.join(self.version_dir, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        encoded_versions = json.load(f)
-                        # 解码版本数据
-                        self.versions[wxid] = [
-                            self.process_version_data(version, encode=False)
-                            for version in encoded_versions
-                        ]
-                except Exception as e:
-                    print(f"加载版本数据失败 - 联系人ID: {wxid}, 错误: {str(e)}")
-                    
-    def save_versions(self):
-        """保存版本数据到文件"""
+    def get_version_index(self) -> List[Dict]:
+        """获取每个联系人最新版本的摘要（不加载完整版本数据），按创建时间排序
+        
+        Returns:
+            List[Dict]: 摘要列表，格式与版本信息相同（contact、version_number、create_time），
+                并带有 is_summary=True
+        """
+        summaries = []
+        with self._lock:
+            entries = sorted(self._index.values(), key=lambda e: e.get('create_time', ''))
+        for entry in entries:
+            summaries.append({
+                'contact': {
+                    'wxid': entry['wxid'],
+                    'name': entry.get('name', ''),
+                    'avatar': self.blobs.get(entry.get('avatar_hash')) or self.decode_binary(entry.get('avatar'))
+                },
+                'version_number': entry.get('latest_version', 0),
+                'create_time': entry.get('create_time', ''),
+                'version_count': entry.get('version_count', 0),
+                'is_summary': True
+            })
+        return summaries
+        
+    def get_latest_version(self, contact_id: str) -> Optional[Dict]:
+        """获取联系人的最新版本（按需加载）"""
+        versions = self._ensure_loaded(contact_id)
+        if not versions:
+            return None
+        return max(versions, key=lambda v: v.get('version_number', 0))
+        
+
+    def add_listener(self, callback: Callable[[str, Dict], None]):
+        """注册版本变化的监听者
+        
+        Args:
+            callback: callback(event, version_info)，event 为 'added'、'updated' 或 'deleted'；
+                在版本写入磁盘后调用，调用线程为修改版本的线程或日志写入线程，界面需要自行切换到主线程
+        """
+        self._listeners.append(callback)
+        
+    def remove_listener(self, callback: Callable[[str, Dict], None]):
+        """移除版本变化的监听者"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+            
+    def _notify(self, event: str, version_info: Dict):
+        """通知监听者某个版本发生了变化"""
+        for callback in list(self._listeners):
+            try:
+                callback(event, version_info)
+            except Exception as e:
+                print(f"版本变化通知失败: {str(e)}")
+                
+    def mark_dirty(self, contact_id: str):
+        """标记联系人的版本数据有改动，下次保存时写入文件"""
+        self._dirty.add(contact_id)
+        
+    def save_versions(self, contact_ids: Optional[Iterable[str]] = None):
+        """把版本数据完整写入快照文件，并删除已合并的日志
+        
+        Args:
+            contact_ids: 要保存的联系人，默认只保存有改动的联系人
+        """
         # 确保目录存在
         os.makedirs(self.version_dir, exist_ok=True)
         
-        # 遍历所有联系人的版本数据
-        for contact_id, versions in self.versions.items():
-            file_path = os.path.join(self.version_dir, f"{contact_id}.json")
+        with self._lock:
+            # 排队中的日志记录已包含在内存数据中，先写完再删除日志
+            self._journal.flush()
+            if contact_ids is None:
+                contact_ids = list(self._dirty)
+            for contact_id in contact_ids:
+                if contact_id not in self.versions:
+                    self._dirty.discard(contact_id)
+                    continue
+                try:
+                    self._write_contact(contact_id)
+                    self._dirty.discard(contact_id)
+                    journal_path = self.get_journal_file(contact_id)
+                    if os.path.exists(journal_path):
+                        os.remove(journal_path)
+                    self._journal_lines[contact_id] = 0
+                    self._set_index_entry(contact_id, self.versions[contact_id])
+                except Exception as e:
+                    print(f"保存版本数据失败 - 联系人ID: {contact_id}, 错误: {str(e)}")
+            if self._index_dirty:
+                self._save_index()
+                
+    def _encode_version(self, version_info: Dict) -> Dict:
+        """转换为写入文件的格式"""
+        # 处理二进制数据
+        processed_version = self.process_version_data(version_info, encode=True)
+        # 处理自定义风格内容
+        if processed_version.get('style') == 'custom':
+            processed_version['custom_prompt'] = processed_version.get('style_content', '')
+        return processed_version
+        
+    def _write_contact(self, contact_id: str):
+        """把一个联系人的版本数据写入文件（先写临时文件再替换，避免写到一半的文件）"""
+        file_path = self.get_version_file(contact_id)
+        
+        # 处理每个版本中的数据
+        processed_versions = [self._encode_version(version) for version in self.versions[contact_id]]
+        
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.serializer.dumps(processed_versions))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # 更换格式后删除旧格式的快照
+        for ext in SNAPSHOT_READERS:
+            old_path = os.path.join(self.version_dir, f"{contact_id}{ext}")
+            if old_path != file_path and os.path.exists(old_path):
+                os.remove(old_path)
+                
+    def check_consistency(self, repair: bool = False) -> List[str]:
+        """检查版本文件的一致性
+        
+        检查以下问题：
+            - 文件无法解析（修复时改名为 .corrupt 保留）
+            - 旧格式的文件，包括以前 generate_card 写入的贺卡记录（修复时转换为版本列表）
+            - 版本缺少联系人ID或版本号、版本号重复（修复时补全，内容相同的重复版本只保留一个，其余重新编号）
+            - 写入中断残留的临时文件（修复时删除）
+            - 图片文件或对象不存在（只报告）
+            - 对象的引用计数与实际引用不符（修复时按实际引用重建）
+        
+        Args:
+            repair: 是否修复发现的问题
             
-            # 处理每个版本中的数据
-            processed_versions = []
-            for version in versions:
-                # 处理二进制数据
-                processed_version = self.process_version_data(version, encode=True)
-                # 处理自定义风格内容
-                if processed_version.get('style') == 'custom':
-                    processed_version['custom_prompt'] = processed_version.get('style_content', '')
-                processed_versions.append(processed_version)
-            
-            # 保存到文件
+        Returns:
+            List[str]: 发现的问题
+        """
+        # 先把日志合并到快照，只需检查快照文件
+        for entry in list(os.scandir(self.version_dir)):
+            if entry.name.endswith(self.JOURNAL_EXT):
+                self.compact(entry.name[:-len(self.JOURNAL_EXT)])
+        self.save_versions()
+        issues = []
+        refs = []
+        for entry in sorted(os.scandir(self.version_dir), key=lambda e: e.name):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith('.tmp'):
+                issues.append(f"残留的临时文件: {entry.name}")
+                if repair:
+                    os.remove(entry.path)
+                continue
+            wxid, ext = os.path.splitext(entry.name)
+            if ext not in SNAPSHOT_READERS or entry.name == self.INDEX_FILE:
+                continue
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(processed_versions, f, ensure_ascii=False, indent=2)
+                with open(entry.path, 'rb') as f:
+                    raw = serializer_for_path(entry.path).loads(f.read())
             except Exception as e:
-                print(f"保存版本数据失败 - 联系人ID: {contact_id}, 错误: {str(e)}")
+                issues.append(f"{wxid}: 文件无法解析 ({str(e)})")
+                if repair:
+                    os.replace(entry.path, f"{entry.path}.corrupt")
+                    self.versions.pop(wxid, None)
+                    self._dirty.discard(wxid)
+                continue
+            
+            problems, versions = self._normalize_versions(wxid, raw)
+            issues.extend(f"{wxid}: {problem}" for problem in problems)
+            if problems and repair:
+                self.versions[wxid] = [self.process_version_data(version, encode=False) for version in versions]
+                self.mark_dirty(wxid)
+                self.save_versions([wxid])
+                self._migrate_avatars(wxid)
+                versions = [self.process_version_data(version, encode=True) for version in self.versions[wxid]]
                 
+            for version in versions:
+                refs.extend(self._blob_refs(version))
+                image_hash = version.get('image_hash')
+                if image_hash and not self.blobs.exists(image_hash):
+                    issues.append(f"{wxid}: V{version.get('version_number')} 的图片对象不存在: {image_hash}")
+                elif not image_hash and version.get('image_path') and not os.path.exists(version['image_path']):
+                    issues.append(f"{wxid}: V{version.get('version_number')} 的图片不存在: {version['image_path']}")
+                avatar_hash = version.get('contact', {}).get('avatar_hash')
+                if avatar_hash and not self.blobs.exists(avatar_hash):
+                    issues.append(f"{wxid}: V{version.get('version_number')} 的头像对象不存在: {avatar_hash}")
+                    
+        expected = {}
+        for ref in refs:
+            expected[ref] = expected.get(ref, 0) + 1
+        orphans = [key for key in self.blobs.keys() if key not in expected]
+        if expected != self.blobs.refcounts() or orphans:
+            issues.append(f"对象引用计数与实际引用不符（未被引用的对象 {len(orphans)} 个）")
+            if repair:
+                self.blobs.rebuild_refs(refs)
+                
+        if repair:
+            # 按修复后的文件重建索引
+            self.load_index()
+        return issues
+        
+    def _normalize_versions(self, wxid: str, raw) -> Tuple[List[str], List[Dict]]:
+        """把文件内容整理为版本列表（不修改文件）
+        
+        Returns:
+            Tuple[List[str], List[Dict]]: 发现的问题和整理后的版本列表（编码后的格式）
+        """
+        problems = []
+        if isinstance(raw, dict):
+            if 'latest_version' in raw:
+                problems.append("旧格式（latest_version）")
+                versions = [raw['latest_version']]
+            elif 'template_data' in raw:
+                problems.append("贺卡记录格式（以前由 generate_card 写入）")
+                versions = [self._version_from_card_record(wxid, raw)]
+            else:
+                problems.append("无法识别的格式")
+                versions = []
+        elif isinstance(raw, list):
+            versions = [version for version in raw if isinstance(version, dict)]
+            if len(versions) != len(raw):
+                problems.append(f"{len(raw) - len(versions)} 个无效的版本")
+        else:
+            problems.append("无法识别的格式")
+            versions = []
+            
+        numbers = [v.get('version_number') for v in versions if isinstance(v.get('version_number'), int)]
+        next_number = max(numbers, default=0) + 1
+        seen = {}
+        result = []
+        for version in versions:
+            contact = version.setdefault('contact', {})
+            if contact.get('wxid') != wxid:
+                problems.append("版本缺少联系人ID或联系人ID不一致")
+                contact['wxid'] = wxid
+            number = version.get('version_number')
+            if not isinstance(number, int) or number < 1:
+                problems.append("缺少版本号")
+                version['version_number'] = next_number
+                next_number += 1
+            elif number in seen:
+                if seen[number] == version:
+                    problems.append(f"重复的版本 V{number}")
+                    continue
+                problems.append(f"版本号重复 V{number}")
+                version['version_number'] = next_number
+                next_number += 1
+            seen[version['version_number']] = version
+            result.append(version)
+        return problems, result
+        
+    @staticmethod
+    def _version_from_card_record(wxid: str, record: Dict) -> Dict:
+        """把以前 generate_card 写入的贺卡记录转换为版本"""
+        data = record.get('template_data', {})
+        return {
+            'contact': {'wxid': wxid, 'name': wxid},
+            'create_time': record.get('generation_time', ''),
+            'style': '',
+            'greeting': data.get('greeting_text', ''),
+            'poem': data.get('poem_text', ''),
+            'idioms': data.get('idioms_text', ''),
+            'wishes': data.get('wishes_text', ''),
+            'signature': data.get('signature', ''),
+            'template_number': record.get('template_number'),
+            'image_path': record.get('image_path'),
+            'version_number': 1
+        }
+        
     def get_version_file(self, wxid: str) -> str:
-        """获取联系人的版本文件路径"""
-        return os.path.join(self.version_dir, f"{wxid}.json")
+        """获取联系人的快照文件路径（按当前的写入格式）"""
+        return os.path.join(self.version_dir, f"{wxid}{self.serializer.ext}")
         
-    def add_version(self, version_info):
-        """添加新版本"""
-        contact_id = version_info['contact']['wxid']
+    def find_snapshot(self, wxid: str) -> Optional[str]:
+        """查找联系人已有的快照文件（优先当前的写入格式），不存在时返回None"""
+        candidates = [self.get_version_file(wxid)]
+        candidates += [os.path.join(self.version_dir, f"{wxid}{ext}") for ext in SNAPSHOT_READERS]
+        for path in candidates:
+            if os.path.exists(path):
+                return path
+        return None
         
-        # 获取该联系人的所有版本
-        if contact_id not in self.versions:
-            self.versions[contact_id] = []
-        contact_versions = self.versions[contact_id]
+    def get_journal_file(self, wxid: str) -> str:
+        """获取联系人的日志文件路径"""
+        return os.path.join(self.version_dir, f"{wxid}{self.JOURNAL_EXT}")
         
-        # 添加版本号
-        version_number = len(contact_versions) + 1
-        version_info['version_number'] = version_number
+    def add_version(self, version_info, wait: bool = True):
+        """添加新版本
         
-        # 添加创建时间
-        version_info['create_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        Args:
+            version_info: 版本信息
+            wait: 是否等待日志写入磁盘；批量添加时可传 False 让多个版本合并 fsync，之后调用 flush()，
+                此时监听者在日志写入磁盘后由日志写入线程通知
+        """
+        contact_id = version_info['contact']['wxid']
         
         # 处理风格内容
-        style = version_info.get('style', '')
-        if style == 'custom':
-            # 自定义风格使用 custom_prompt
-            custom_prompt = version_info.get('custom_prompt', '')
-            version_info['style_content'] = custom_prompt
-        else:
-            # 预设风格使用 style_prompt
-            style_prompt = version_info.get('style_prompt', '')
-            version_info['style_content'] = style_prompt
-            # 移除自定义提示词
-            version_info.pop('custom_prompt', None)
+        self.apply_style_content(version_info)
         
-        # 添加新版本
-        contact_versions.append(version_info)
+        # 头像和图片存入 blobs 目录，先增加引用计数（日志写入线程在写入这条记录前保存），避免对象被误删
+        for ref in self._attach_blobs(version_info):
+            self.blobs.incref(ref)
         
-        # 保存到文件
-        self.save_versions()
+        with self._lock:
+            # 获取该联系人的所有版本（先加载已有的历史，避免覆盖）
+            contact_versions = self._ensure_loaded(contact_id)
+            
+            # 添加版本号（旧版本可能已被删除，不能按版本数计算）
+            version_number = max((v.get('version_number', 0) for v in contact_versions), default=0) + 1
+            version_info['version_number'] = version_number
+            
+            # 添加创建时间
+            version_info['create_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            
+            # 添加新版本，只在日志中追加一行
+            contact_versions.append(version_info)
+            future = self._append_journal(contact_id, {'op': 'put', 'version': self._encode_version(version_info)})
+        if wait:
+            future.result()
+            self._notify('added', version_info)
+        else:
+            # 监听者只在版本写入磁盘后得到通知
+            future.add_done_callback(lambda f: self._on_journal_written(f, 'added', version_info))
         
         return version_info
         
+    def _on_journal_written(self, future: Future, event: str, version_info: Dict):
+        """日志记录写入完成后通知监听者，写入失败时只打印错误"""
+        error = future.exception()
+        if error is not None:
+            print(f"保存版本失败 - 联系人ID: {version_info['contact']['wxid']}, 错误: {str(error)}")
+            return
+        self._notify(event, version_info)
+        
+    @staticmethod
+    def apply_style_content(version_info: Dict):
+        """按风格设置 style_content：自定义风格使用 custom_prompt，预设风格使用 style_prompt"""
+        if version_info.get('style', '') == 'custom':
+            version_info['style_content'] = version_info.get('custom_prompt', '')
+        else:
+            version_info['style_content'] = version_info.get('style_prompt', '')
+            # 移除自定义提示词
+            version_info.pop('custom_prompt', None)
+        
     def process_version_data(self, version_info: Dict, encode: bool = True) -> Dict:
         """处理版本数据中的二进制内容"""
         processed = version_info.copy()  # 创建副本以避免修改原始数据
@@ -118,6 +760,10 @@ class VersionManager:
         if 'contact' in processed:
             processed['contact'] = self.process_contact_data(processed['contact'], encode)
             
+        # 版本的贺卡图片（对象缺失时由 check_consistency 报告）
+        if not encode and processed.get('image_hash'):
+            processed['image_path'] = self.blobs.path(processed['image_hash'])
+            
         # 确保自定义风格内容被正确处理
         if processed.get('style') == 'custom':
             custom_prompt = processed.get('custom_prompt', '')
@@ -129,7 +775,13 @@ class VersionManager:
     def process_contact_data(self, contact_info: Dict, encode: bool = True) -> Dict:
         """处理联系人数据中的二进制内容"""
         processed = contact_info.copy()
-        if 'avatar' in processed:
+        if processed.get('avatar_hash'):
+            # 头像保存在 blobs 目录中
+            if encode:
+                processed.pop('avatar', None)
+            else:
+                processed['avatar'] = self.blobs.get(processed['avatar_hash'])
+        elif 'avatar' in processed:
             if encode:
                 processed['avatar'] = self.encode_binary(processed['avatar'])
             else:
@@ -153,38 +805,204 @@ class VersionManager:
         
     def get_contact_versions(self, contact_id):
         """获取指定联系人的所有版本"""
-        return self.versions.get(contact_id, [])
+        return self._ensure_loaded(contact_id)
         
     def get_all_versions(self):
-        """获取所有版本"""
+        """获取所有版本（会加载全部联系人的完整数据，列表展示请使用 get_version_index）"""
+        self.load_versions()
         return self.versions 
 
     def update_version(self, version_info):
-        """更新版本信息"""
+        """更新版本信息（版本不存在时不做任何修改）"""
         contact_id = version_info['contact']['wxid']
+        version_number = version_info.get('version_number')
         
         # 处理风格内容
-        style = version_info.get('style', '')
-        if style == 'custom':
-            # 自定义风格使用 custom_prompt
-            custom_prompt = version_info.get('custom_prompt', '')
-            version_info['style_content'] = custom_prompt
-        else:
-            # 预设风格使用 style_prompt
-            style_prompt = version_info.get('style_prompt', '')
-            version_info['style_content'] = style_prompt
-            # 移除自定义提示词
-            version_info.pop('custom_prompt', None)
+        self.apply_style_content(version_info)
+        
+        with self._lock:
+            # 获取该联系人的所有版本
+            contact_versions = self._ensure_loaded(contact_id)
+            
+            # 查找要更新的版本，不存在时不能写入日志，否则重放时会凭空多出一个版本
+            position = next((i for i, version in enumerate(contact_versions)
+                             if version.get('version_number') == version_number), None)
+            if position is None:
+                print(f"更新版本失败，版本不存在 - 联系人ID: {contact_id}, 版本号: {version_number}")
+                return
             
-        # 获取该联系人的所有版本
-        contact_versions = self.versions.get(contact_id, [])
+            # 新引用的对象先增加引用计数（日志写入线程在写入这条记录前保存）
+            for ref in self._attach_blobs(version_info):
+                self.blobs.incref(ref)
+            
+            old_refs = self._blob_refs(contact_versions[position])
+            contact_versions[position] = version_info
+                    
+            # 在日志中追加修改后的版本
+            future = self._append_journal(contact_id, {'op': 'put', 'version': self._encode_version(version_info)})
+        future.result()
+        
+        # 日志写入后再释放旧版本的引用
+        for ref in old_refs:
+            self.blobs.decref(ref)
+        self.blobs.flush()
+        self._notify('updated', version_info)
+        
+    def set_starred(self, contact_id: str, version_number: int, starred: bool = True) -> Optional[Dict]:
+        """设置版本的星标，星标版本不会被保留策略删除
+        
+        Returns:
+            Optional[Dict]: 修改后的版本，版本不存在时返回None
+        """
+        for version in self.get_contact_versions(contact_id):
+            if version.get('version_number') == version_number:
+                version = dict(version, starred=starred)
+                self.update_version(version)
+                return version
+        return None
+        
+    def delete_versions(self, contact_id: str, version_numbers: Iterable[int]) -> List[Dict]:
+        """删除联系人的指定版本，并释放版本引用的头像和图片
+        
+        Args:
+            contact_id: 联系人ID
+            version_numbers: 要删除的版本号
+            
+        Returns:
+            List[Dict]: 被删除的版本
+        """
+        numbers = set(version_numbers)
+        with self._lock:
+            contact_versions = self._ensure_loaded(contact_id)
+            removed = [v for v in contact_versions if v.get('version_number') in numbers]
+            if not removed:
+                return []
+            contact_versions[:] = [v for v in contact_versions if v.get('version_number') not in numbers]
+            for version in removed:
+                future = self._append_journal(contact_id, {'op': 'delete', 'version_number': version['version_number']})
+        future.result()
+        
+        # 删除记录写入后再释放引用，引用计数归零的图片在 flush 时删除
+        for version in removed:
+            for ref in self._blob_refs(version):
+                self.blobs.decref(ref)
+        self.blobs.flush()
+        for version in removed:
+            self._notify('deleted', version)
+        return removed
         
-        # 查找并更新版本
-        for i, version in enumerate(contact_versions):
-            if version.get('version_number') == version_info.get('version_number'):
-                contact_versions[i] = version_info
-                break
+    def apply_retention(self, policy: Optional[RetentionPolicy] = None) -> int:
+        """按保留策略删除旧版本，并清理未被引用的图片
+        
+        删除作为记录追加到各联系人的日志（由后台合并），索引在全部处理完后保存一次；
+        每个联系人单独加锁，清理期间界面仍可以添加版本。
+        原本未加载的联系人处理完后从内存中移除，不会因清理而常驻内存。
+        
+        Args:
+            policy: 保留策略，默认按环境变量创建（见 version_retention）
+            
+        Returns:
+            int: 删除的版本数
+        """
+        policy = policy or RetentionPolicy()
+        deleted = 0
+        if policy.enabled:
+            for contact_id in sorted(self.list_contacts()):
+                try:
+                    with self._lock:
+                        was_loaded = contact_id in self.versions
+                        expired = policy.expired(self._ensure_loaded(contact_id))
+                    # 等待日志写入时不持有锁；期间新增的版本只会更新，不影响已选出的旧版本
+                    if expired:
+                        deleted += len(self.delete_versions(contact_id, [v['version_number'] for v in expired]))
+                    if not was_loaded:
+                        with self._lock:
+                            if contact_id not in self._dirty:
+                                self.versions.pop(contact_id, None)
+                except Exception as e:
+                    print(f"清理旧版本失败 - 联系人ID: {contact_id}, 错误: {str(e)}")
+            with self._lock:
+                if self._index_dirty:
+                    self._save_index()
+        orphans = self.blobs.collect_garbage()
+        if deleted or orphans:
+            print(f"版本清理完成: 删除 {deleted} 个旧版本, {orphans} 个未引用的图片")
+        return deleted
+        
+    def start_retention(self, policy: Optional[RetentionPolicy] = None, interval_hours: Optional[float] = None):
+        """启动后台清理线程：立即清理一次，之后每隔 interval_hours 小时清理一次
+        
+        Args:
+            policy: 保留策略，默认按环境变量创建
+            interval_hours: 清理间隔，默认读取环境变量 CARD_VERSION_RETENTION_HOURS，未设置时为24
+        """
+        if self._retention is not None:
+            return
+        policy = policy or RetentionPolicy()
+        if interval_hours is None:
+            interval_hours = env_number('CARD_VERSION_RETENTION_HOURS', 24, float)
+            
+        def run():
+            while not self._retention_stop.is_set():
+                try:
+                    self.apply_retention(policy)
+                except Exception as e:
+                    print(f"版本清理失败: {str(e)}")
+                self._retention_stop.wait(interval_hours * 3600)
                 
-        # 保存更新后的版本
-        self.versions[contact_id] = contact_versions
-        self.save_versions() 
+        self._retention = threading.Thread(target=run, name='VersionRetention', daemon=True)
+        self._retention.start()
+
+
+def create_version_manager(backend: Optional[str] = None, retention: bool = True):
+    """创建版本管理器
+    
+    Args:
+        backend: 'json'（每个联系人一个快照文件，格式见 version_serializer）或 'sqlite'（见 sqlite_version_manager），
+            默认读取环境变量 CARD_VERSION_BACKEND，未设置时为 'json'
+        retention: 配置了保留策略（环境变量 CARD_VERSION_KEEP_LAST / CARD_VERSION_MAX_AGE_DAYS）时是否启动后台清理线程；
+            命令行工具自行调用 apply_retention 时应为False
+    """
+    backend = (backend or os.environ.get('CARD_VERSION_BACKEND', 'json')).lower()
+    if backend == 'sqlite':
+        from newYear.utils.sqlite_version_manager import SQLiteVersionManager
+        manager = SQLiteVersionManager()
+    elif backend == 'json':
+        manager = VersionManager()
+    else:
+        raise ValueError(f'未知的版本存储方式: {backend}')
+    
+    # 配置了保留策略时在后台清理旧版本
+    if retention:
+        policy = RetentionPolicy()
+        if policy.enabled:
+            manager.start_retention(policy)
+    return manager
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='检查版本历史的一致性，或按保留策略清理旧版本')
+    parser.add_argument('--repair', action='store_true', help='修复发现的问题')
+    parser.add_argument('--backend', default=None, help='json 或 sqlite，默认读取环境变量 CARD_VERSION_BACKEND')
+    parser.add_argument('--prune', action='store_true', help='按保留策略删除旧版本（策略见 version_retention）')
+    parser.add_argument('--keep-last', type=int, default=None, help='每个联系人保留的最新版本数')
+    parser.add_argument('--max-age-days', type=int, default=None, help='删除超过该天数的版本')
+    args = parser.parse_args()
+
+    # 命令行只执行一次检查或清理，不启动后台清理线程
+    manager = create_version_manager(args.backend, retention=False)
+    if args.prune:
+        policy = RetentionPolicy(keep_last=args.keep_last, max_age_days=args.max_age_days)
+        print(f"保留策略: {policy}")
+        print(f"删除了 {manager.apply_retention(policy)} 个旧版本")
+        manager.close()
+    else:
+        found = manager.check_consistency(repair=args.repair)
+        for issue in found:
+            print(issue)
+        if not found:
+            print("未发现问题")
+        elif args.repair:
+            print(f"已修复 {len(found)} 个问题（图片缺失无法修复）")
+        else:
+            print(f"发现 {len(found)} 个问题，使用 --repair 修复")
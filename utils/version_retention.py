@@ -0,0 +1,101 @@
+"""
+版本历史的保留策略：限制每个联系人保留的版本数和版本的保存天数
+
+    CARD_VERSION_KEEP_LAST       每个联系人保留的最新版本数，0为不限（默认）
+    CARD_VERSION_MAX_AGE_DAYS    删除超过该天数的版本，0为不限（默认）
+    CARD_VERSION_KEEP_STARRED    星标版本是否不受上面两项限制，默认为1
+    CARD_VERSION_RETENTION_HOURS 后台清理的间隔（小时），默认为24
+
+每个联系人的最新版本始终保留（发送贺卡时使用）。
+环境变量的值无法解析时打印警告并使用默认值，不影响程序启动。
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+
+def env_number(name: str, default, cast=int):
+    """读取数值型环境变量，未设置或无法解析时返回默认值
+
+    Args:
+        name: 环境变量名
+        default: 默认值
+        cast: 转换函数，int 或 float
+
+    Returns:
+        环境变量的值
+    """
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"警告: 环境变量 {name}={value!r} 无法解析，使用默认值 {default}")
+        return default
+
+
+class RetentionPolicy:
+    """版本保留策略"""
+
+    def __init__(self, keep_last: Optional[int] = None, keep_starred: Optional[bool] = None,
+                 max_age_days: Optional[int] = None):
+        """
+        Args:
+            keep_last: 每个联系人保留的最新版本数，0为不限，默认读取环境变量 CARD_VERSION_KEEP_LAST
+            keep_starred: 星标版本是否始终保留，默认读取环境变量 CARD_VERSION_KEEP_STARRED，未设置时为True
+            max_age_days: 删除超过该天数的版本，0为不限，默认读取环境变量 CARD_VERSION_MAX_AGE_DAYS
+        """
+        if keep_last is None:
+            keep_last = env_number('CARD_VERSION_KEEP_LAST', 0)
+        if keep_starred is None:
+            keep_starred = os.environ.get('CARD_VERSION_KEEP_STARRED', '1') != '0'
+        if max_age_days is None:
+            max_age_days = env_number('CARD_VERSION_MAX_AGE_DAYS', 0)
+        self.keep_last = max(0, keep_last)
+        self.keep_starred = keep_starred
+        self.max_age_days = max(0, max_age_days)
+
+    @property
+    def enabled(self) -> bool:
+        """是否会删除版本"""
+        return bool(self.keep_last or self.max_age_days)
+
+    def expired(self, versions: List[Dict], now: Optional[datetime] = None) -> List[Dict]:
+        """选出一个联系人应删除的版本
+
+        Args:
+            versions: 联系人的所有版本
+            now: 当前时间，默认为 datetime.now()
+
+        Returns:
+            List[Dict]: 应删除的版本
+        """
+        if not self.enabled:
+            return []
+        cutoff = None
+        if self.max_age_days:
+            cutoff = (now or datetime.now()) - timedelta(days=self.max_age_days)
+
+        ordered = sorted(versions, key=lambda v: v.get('version_number', 0), reverse=True)
+        expired = []
+        for rank, version in enumerate(ordered):
+            if rank == 0 or (self.keep_starred and version.get('starred')):
+                continue
+            if self.keep_last and rank >= self.keep_last:
+                expired.append(version)
+            elif cutoff and self._created_before(version, cutoff):
+                expired.append(version)
+        return expired
+
+    @staticmethod
+    def _created_before(version: Dict, cutoff: datetime) -> bool:
+        """版本是否在 cutoff 之前创建，创建时间无法解析时视为否"""
+        try:
+            return datetime.strptime(version.get('create_time', ''), '%Y-%m-%d %H:%M:%S') < cutoff
+        except ValueError:
+            return False
+
+    def __repr__(self):
+        return (f"RetentionPolicy(keep_last={self.keep_last}, keep_starred={self.keep_starred}, "
+                f"max_age_days={self.max_age_days})")
@@ -0,0 +1,103 @@
+"""
+版本快照文件的序列化格式
+
+    json          带缩进的JSON（默认，便于直接查看）
+    json-compact  不带缩进和多余空格的JSON，写入和解析更快、文件更小
+    msgpack       MessagePack二进制格式，需要安装 msgpack
+
+写入格式由环境变量 CARD_VERSION_FORMAT 指定；读取时按文件扩展名选择格式，已有文件无需转换。
+"""
+import os
+import json
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+
+class VersionSerializer(ABC):
+    """快照文件的序列化格式"""
+
+    name = ''
+    ext = ''
+
+    @abstractmethod
+    def dumps(self, versions) -> bytes:
+        """把版本列表序列化为快照文件内容"""
+
+    @abstractmethod
+    def loads(self, data: bytes):
+        """解析快照文件内容"""
+
+
+class JSONSerializer(VersionSerializer):
+    """JSON格式，indent 为None时输出紧凑格式"""
+
+    ext = '.json'
+
+    def __init__(self, indent: Optional[int] = 2):
+        self.indent = indent
+        self.name = 'json' if indent else 'json-compact'
+
+    def dumps(self, versions) -> bytes:
+        if self.indent:
+            return json.dumps(versions, ensure_ascii=False, indent=self.indent).encode('utf-8')
+        return json.dumps(versions, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+
+class MessagePackSerializer(VersionSerializer):
+    """MessagePack格式"""
+
+    name = 'msgpack'
+    ext = '.msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError('使用 msgpack 格式需要安装 msgpack: pip install msgpack')
+        self._msgpack = msgpack
+
+    def dumps(self, versions) -> bytes:
+        return self._msgpack.packb(versions, use_bin_type=True)
+
+    def loads(self, data: bytes):
+        return self._msgpack.unpackb(data, raw=False)
+
+
+SERIALIZERS = {
+    'json': lambda: JSONSerializer(indent=2),
+    'json-compact': lambda: JSONSerializer(indent=None),
+    'msgpack': MessagePackSerializer,
+}
+
+# 快照文件可能的扩展名 -> 读取用的格式
+SNAPSHOT_READERS = {
+    '.json': 'json',
+    '.msgpack': 'msgpack',
+}
+
+_instances: Dict[str, VersionSerializer] = {}
+
+
+def get_serializer(name: Optional[str] = None) -> VersionSerializer:
+    """获取序列化格式
+
+    Args:
+        name: 'json'、'json-compact' 或 'msgpack'，默认读取环境变量 CARD_VERSION_FORMAT，未设置时为 'json'
+    """
+    name = (name or os.environ.get('CARD_VERSION_FORMAT', 'json')).lower()
+    if name not in SERIALIZERS:
+        raise ValueError(f'未知的版本文件格式: {name}')
+    if name not in _instances:
+        _instances[name] = SERIALIZERS[name]()
+    return _instances[name]
+
+
+def serializer_for_path(path: str) -> VersionSerializer:
+    """按文件扩展名选择读取用的格式"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in SNAPSHOT_READERS:
+        raise ValueError(f'无法识别的版本文件: {path}')
+    return get_serializer(SNAPSHOT_READERS[ext])
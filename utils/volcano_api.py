@@ -1,19 +1,180 @@
 import json
-from typing import Dict, List, Tuple
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple, Optional
+import httpx
 from volcenginesdkarkruntime import Ark
 import os
 from datetime import datetime
+from urllib.parse import urlparse
+
+from newYear.utils.chat_sampler import create_sampler
+from newYear.utils.prompt_logger import PromptLogger, get_prompt_logger
+from newYear.utils.token_budget import TokenBudget, TokenBudgetExceeded, estimate_tokens
+
+# 火山方舟默认接口地址
+ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+
+
+def is_local_url(url: str) -> bool:
+    """接口地址是否指向本机（如本地模拟服务）"""
+    return urlparse(url).hostname in ('localhost', '127.0.0.1', '::1')
+
 
 class VolcanoAPI:
     """火山引擎API调用工具类"""
     
-    def __init__(self, api_key: str):
+    # 进程内共享的实例，键为 (api_key, base_url)
+    _shared_instances = {}
+    _shared_lock = threading.Lock()
+    
+    # 生成内容（greeting/idioms/tags/wishes 的JSON）的预估Token数
+    EXPECTED_COMPLETION_TOKENS = 300
+    # 单次请求的提示词Token上限（模型上下文32k，需为生成内容留出余量）
+    DEFAULT_MAX_PROMPT_TOKENS = 30000
+    # 计费单价（元/千Token）
+    PROMPT_PRICE_PER_1K = 0.0008
+    COMPLETION_PRICE_PER_1K = 0.002
+    # 尚无实测数据时使用的单次请求耗时（秒）
+    DEFAULT_REQUEST_SECONDS = 8.0
+    
+    def __init__(self, api_key: str, sample_strategy: str = 'reservoir', sample_char_budget: int = 200000,
+                 prompt_logger: Optional[PromptLogger] = None, base_url: str = ARK_BASE_URL,
+                 stream: bool = False, max_connections: Optional[int] = None,
+                 max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS, encrypted: Optional[bool] = None):
+        """
+        Args:
+            api_key: 火山引擎API Key
+            sample_strategy: 关键词提取的文本采样策略，'reservoir'（水塘抽样）或 'stratified'（按时间分层抽样）
+            sample_char_budget: 参与关键词提取的文本字符预算，超出部分按采样策略抽样
+            prompt_logger: 可选的提示词日志记录器，为None时不记录提示词
+            base_url: 接口地址，可指向本地模拟服务（见 mock_ark_server）
+            stream: 是否以流式方式接收生成内容
+            max_connections: 连接池大小（保持长连接），为None时使用SDK默认的连接池
+            max_prompt_tokens: 单次请求允许的提示词Token上限，超出时不发送请求
+            encrypted: 是否启用端到端加密（SDK需先从接口获取证书），为None时接口地址指向本机则不加密
+        """
         self.api_key = api_key
+        self.sample_strategy = sample_strategy
+        self.sample_char_budget = sample_char_budget
+        self.prompt_logger = prompt_logger
+        self.base_url = base_url
+        self.stream = stream
+        self.max_prompt_tokens = max_prompt_tokens
+        if encrypted is None:
+            encrypted = not is_local_url(base_url)
+        self.encrypted = encrypted
+        # 实测的请求耗时统计，用于估算批量生成时间
+        self._request_seconds_total = 0.0
+        self._request_count = 0
+        self._stats_lock = threading.Lock()
+        # 正在使用客户端的请求或批量生成数，被替换的共享实例在全部结束后才关闭连接池
+        self._users = 0
+        self._retired = False
+        self._usage_lock = threading.Lock()
+        self.max_connections = max_connections or 0
+        self._http_client = None
+        if max_connections:
+            self._http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=120
+                ),
+                timeout=httpx.Timeout(600, connect=10)
+            )
         self.client = Ark(
-            base_url="https://ark.cn-beijing.volces.com/api/v3",
-            api_key=api_key
+            base_url=base_url,
+            api_key=api_key,
+            http_client=self._http_client
         )
         
+    @classmethod
+    def get_shared(cls, api_key: str, base_url: str = ARK_BASE_URL, concurrency: int = 1,
+                   sample_strategy: str = 'reservoir', prompt_log_dir: Optional[str] = None) -> 'VolcanoAPI':
+        """获取进程内共享的API实例
+        
+        同一个API Key在整个进程生命周期内只创建一个客户端，多次生成和重新生成复用同一个连接池。
+        更换API Key后，原Key的客户端不再被返回，其连接池在进行中的请求（及 in_use 期间的批量生成）结束后关闭。
+        
+        Args:
+            api_key: 火山引擎API Key
+            base_url: 接口地址
+            concurrency: 同时进行的生成任务数，连接池为该数量再加一个连接（供预热和连接测试使用）
+            sample_strategy: 关键词提取的文本采样策略（见 chat_sampler.SAMPLE_STRATEGIES），
+                只影响之后的分析，修改时沿用已有的客户端
+            prompt_log_dir: 提示词日志目录（见 prompt_logger），为None或空时不记录提示词
+            
+        Returns:
+            VolcanoAPI: 共享的API实例
+        """
+        key = (api_key, base_url)
+        max_connections = max(1, concurrency) + 1
+        prompt_logger = get_prompt_logger(prompt_log_dir) if prompt_log_dir else None
+        with cls._shared_lock:
+            api = cls._shared_instances.get(key)
+            if api is not None and api.max_connections >= max_connections:
+                api.sample_strategy = sample_strategy
+                api.prompt_logger = prompt_logger
+                return api
+            # 同一接口地址只保留当前Key的客户端（连接池不够大时也重新创建），旧客户端空闲后关闭
+            for stale_key in [k for k in cls._shared_instances if k[1] == base_url]:
+                cls._shared_instances.pop(stale_key).close()
+            api = cls(api_key, sample_strategy=sample_strategy, prompt_logger=prompt_logger,
+                      base_url=base_url, max_connections=max_connections)
+            cls._shared_instances[key] = api
+            return api
+            
+    def warm_up(self):
+        """预热连接：提前完成DNS解析和TLS握手，使第一次生成无需等待建连"""
+        if not self._http_client:
+            return
+        try:
+            with self.in_use():
+                self._http_client.get(self.base_url, timeout=10)
+            print(f"\nAPI连接预热完成: {self.base_url}")
+        except Exception as e:
+            print(f"\nAPI连接预热失败: {str(e)}")
+            
+    def warm_up_async(self):
+        """在后台线程中预热连接"""
+        threading.Thread(target=self.warm_up, name='VolcanoAPIWarmUp', daemon=True).start()
+        
+    @contextmanager
+    def in_use(self):
+        """使用期间不关闭连接池：close() 推迟到最后一个使用者结束时执行
+        
+        单个请求内部已自动使用；批量生成期间由调用方包住整批，避免两次请求之间被关闭。
+        """
+        with self._usage_lock:
+            self._users += 1
+        try:
+            yield self
+        finally:
+            with self._usage_lock:
+                self._users -= 1
+                close_now = self._retired and self._users == 0
+            if close_now:
+                self._close_client()
+                
+    def close(self):
+        """关闭连接池；仍在使用时等最后一个使用者结束后再关闭"""
+        with self._usage_lock:
+            self._retired = True
+            if self._users:
+                return
+        self._close_client()
+        
+    def _close_client(self):
+        """立即关闭连接池"""
+        if self._http_client:
+            self._http_client.close()
+        
+    def _extra_headers(self) -> Dict[str, str]:
+        """请求附加的头部：启用加密时由SDK对请求和响应做端到端加密"""
+        return {'x-is-encrypted': 'true'} if self.encrypted else {}
+        
     def test_connection(self) -> Tuple[bool, str]:
         """测试API连接是否正常
         
@@ -23,13 +184,14 @@ class VolcanoAPI:
         try:
             # 构造一个简单的测试请求
             test_prompt = "你好，这是一个测试消息。"
-            response = self.client.chat.completions.create(
-                model="Doubao-vision-lite-32k",
-                messages=[
-                    {"role": "user", "content": test_prompt}
-                ],
-                extra_headers={'x-is-encrypted': 'true'}
-            )
+            with self.in_use():
+                response = self.client.chat.completions.create(
+                    model="Doubao-vision-lite-32k",
+                    messages=[
+                        {"role": "user", "content": test_prompt}
+                    ],
+                    extra_headers=self._extra_headers()
+                )
             
             if response and response.choices:
                 return True, "API连接成功"
@@ -39,38 +201,179 @@ class VolcanoAPI:
         except Exception as e:
             return False, f"API请求异常: {str(e)}"
         
-    def generate_greeting(self, contact_info: Dict, chat_history: List[Dict], style_prompt: str) -> Dict:
+    def generate_greeting(self, contact_info: Dict, chat_history: Optional[List[Dict]], style_prompt: str,
+                          budget: Optional[TokenBudget] = None, chat_analysis: Optional[Dict] = None) -> Dict:
         """生成新年祝福内容
         
         Args:
             contact_info: 联系人信息，包含姓名和wxid
-            chat_history: 聊天记录列表
+            chat_history: 聊天记录列表（指定 chat_analysis 时不使用，可为None）
             style_prompt: 风格提示词
+            budget: 可选的整批Token预算，预算不足时不发送请求
+            chat_analysis: 预估时已得到的聊天记录分析结果（见 analyze_chat_histories），指定时不再重复分析
             
         Returns:
             Dict: 包含生成的祝福内容
         """
+        reserved = 0
         try:
             # 分析聊天记录，提取关键信息
-            chat_analysis = self._analyze_chat_history(chat_history)
+            if chat_analysis is None:
+                chat_analysis = self._analyze_chat_history(chat_history)
             
             # 构建完整的提示词
             prompt = self._build_prompt(contact_info, chat_analysis, style_prompt)
             
+            # 检查Token预算
+            prompt_tokens = estimate_tokens(prompt)
+            if self.max_prompt_tokens and prompt_tokens > self.max_prompt_tokens:
+                raise TokenBudgetExceeded(
+                    f"提示词过长：约 {prompt_tokens} Token，超过单次上限 {self.max_prompt_tokens}"
+                )
+            if budget:
+                reserved = prompt_tokens + self.EXPECTED_COMPLETION_TOKENS
+                budget.reserve(reserved)
+            
+            # 记录提示词（后台异步写入）
+            if self.prompt_logger:
+                self.prompt_logger.log(contact_info.get('wxid', 'unknown'), prompt)
+            
             # 调用API生成内容
-            response = self.client.chat.completions.create(
-                model="ep-20250120142713-z5cs6",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                extra_headers={'x-is-encrypted': 'true'}
-            )
+            started = time.perf_counter()
+            with self.in_use():
+                response = self.client.chat.completions.create(
+                    model="ep-20250120142713-z5cs6",
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    stream=self.stream,
+                    extra_headers=self._extra_headers()
+                )
+                
+                # 解析响应内容（流式响应在读完之前仍占用连接）
+                if self.stream:
+                    content = self._collect_stream(response)
+                    usage = None
+                else:
+                    content = response.choices[0].message.content
+                    usage = getattr(response, 'usage', None)
+            self._record_request_time(time.perf_counter() - started)
             
-            # 解析响应内容
-            return self._parse_response(response)
+            # 按实际用量结算预算（流式响应没有用量信息时按估算值结算）
+            if budget:
+                if usage and getattr(usage, 'total_tokens', None):
+                    actual = usage.total_tokens
+                else:
+                    actual = prompt_tokens + estimate_tokens(content)
+                budget.settle(reserved, actual)
+                reserved = 0
+                
+            return self._parse_content(content)
             
         except Exception as e:
+            if budget and reserved:
+                budget.release(reserved)
             raise Exception(f"生成祝福内容失败：{str(e)}")
+            
+    def _record_request_time(self, seconds: float):
+        """记录一次请求的耗时"""
+        with self._stats_lock:
+            self._request_seconds_total += seconds
+            self._request_count += 1
+            
+    def get_average_request_seconds(self) -> float:
+        """获取单次请求的平均耗时（秒），尚无实测数据时返回默认值"""
+        if not self._request_count:
+            return self.DEFAULT_REQUEST_SECONDS
+        return self._request_seconds_total / self._request_count
+        
+    def estimate_request(self, contact_info: Dict, chat_history: Optional[List[Dict]], style_prompt: str,
+                         chat_analysis: Optional[Dict] = None) -> Dict:
+        """估算单个联系人生成请求的Token用量
+        
+        Args:
+            contact_info: 联系人信息
+            chat_history: 聊天记录列表；为None时使用默认分析结果构建提示词（不读取聊天记录，适合快速预估）
+            style_prompt: 风格提示词
+            chat_analysis: 已有的聊天记录分析结果，指定时不使用 chat_history
+            
+        Returns:
+            Dict: 包含 prompt_tokens、completion_tokens、total_tokens
+        """
+        if chat_analysis is None:
+            if chat_history is None:
+                chat_analysis = self._get_default_analysis()
+            else:
+                chat_analysis = self._analyze_chat_history(chat_history)
+        prompt = self._build_prompt(contact_info, chat_analysis, style_prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': self.EXPECTED_COMPLETION_TOKENS,
+            'total_tokens': prompt_tokens + self.EXPECTED_COMPLETION_TOKENS
+        }
+        
+    def estimate_batch(self, contacts: List[Dict], style_prompt: str, chat_histories: Optional[Dict[str, List[Dict]]] = None,
+                       concurrency: int = 1, chat_analyses: Optional[Dict[str, Dict]] = None) -> Dict:
+        """估算一批联系人的Token用量、耗时和费用
+        
+        Args:
+            contacts: 联系人信息列表
+            style_prompt: 风格提示词
+            chat_histories: 可选，wxid到聊天记录的映射；缺省时按默认分析结果估算
+            concurrency: 并发生成的任务数
+            chat_analyses: 可选，wxid到聊天记录分析结果的映射（见 analyze_chat_histories），优先于 chat_histories
+            
+        Returns:
+            Dict: 包含 contacts、prompt_tokens、completion_tokens、total_tokens、
+                  oversized（提示词超出单次上限的联系人wxid列表）、estimated_seconds、estimated_cost
+        """
+        prompt_tokens = 0
+        completion_tokens = 0
+        oversized = []
+        for contact in contacts:
+            history = chat_histories.get(contact['wxid']) if chat_histories else None
+            analysis = chat_analyses.get(contact['wxid']) if chat_analyses else None
+            estimate = self.estimate_request(contact, history, style_prompt, chat_analysis=analysis)
+            prompt_tokens += estimate['prompt_tokens']
+            completion_tokens += estimate['completion_tokens']
+            if self.max_prompt_tokens and estimate['prompt_tokens'] > self.max_prompt_tokens:
+                oversized.append(contact['wxid'])
+                
+        rounds = -(-len(contacts) // max(1, concurrency))  # 向上取整
+        return {
+            'contacts': len(contacts),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'oversized': oversized,
+            'estimated_seconds': rounds * self.get_average_request_seconds(),
+            'estimated_cost': round(
+                prompt_tokens / 1000 * self.PROMPT_PRICE_PER_1K
+                + completion_tokens / 1000 * self.COMPLETION_PRICE_PER_1K, 4
+            )
+        }
+        
+    def analyze_chat_histories(self, contacts: List[Dict], load_history: Callable[[str], List[Dict]],
+                               cancelled: Optional[Callable[[], bool]] = None) -> Dict[str, Dict]:
+        """逐个读取并分析联系人的聊天记录，只保留分析结果（聊天记录读完即释放）
+        
+        结果可同时用于 estimate_batch 预估和 generate_greeting 生成，聊天记录只需读取和分析一次。
+        
+        Args:
+            contacts: 联系人信息列表
+            load_history: 按wxid读取聊天记录的函数
+            cancelled: 可选，返回True时停止分析并返回已完成的部分
+            
+        Returns:
+            Dict[str, Dict]: wxid到分析结果的映射
+        """
+        analyses = {}
+        for contact in contacts:
+            if cancelled and cancelled():
+                break
+            analyses[contact['wxid']] = self._analyze_chat_history(load_history(contact['wxid']))
+        return analyses
         
     def _analyze_chat_history(self, chat_history: List[Dict]) -> Dict:
         """深度分析聊天记录，提取有价值的信息用于生成个性化祝福
@@ -102,64 +405,67 @@ class VolcanoAPI:
             
         # 1. 基础统计
         total_messages = len(chat_history)
-        sent_messages = sum(1 for msg in chat_history if msg['is_sender'])
-        received_messages = total_messages - sent_messages
+        sent_messages = 0
+        total_msg_length = 0
         
         # 2. 时间分析
         time_distribution = defaultdict(int)
-        time_gaps = []
+        gap_total = 0.0
+        gap_count = 0
         last_time = None
         
-        # 3. 文本处理准备
-        all_text = []
-        life_events = []
-        emotional_words = []
+        # 3. 文本处理准备（关键词提取只使用字符预算内的采样文本，统计数据仍来自全部消息）
+        text_sampler = create_sampler(self.sample_strategy, self.sample_char_budget)
+        life_events = set()
+        emotional_words = set()
         
         # 4. 关键词和话题识别的正则模式
-        life_event_patterns = [
+        life_event_patterns = [re.compile(pattern) for pattern in (
             r'考试|毕业|工作|加班|项目|旅行|旅游|生日|结婚|搬家|升职|考研',
             r'开心|难过|焦虑|压力|困难|成功|失败|努力|坚持|梦想|目标',
             r'家人|朋友|同事|领导|团队|公司|学校|家庭'
-        ]
+        )]
         
-        emotional_patterns = [
+        emotional_patterns = [re.compile(pattern) for pattern in (
             r'开心|快乐|高兴|激动|兴奋|满意|感动|温暖|感激|感谢',
             r'难过|伤心|焦虑|烦恼|痛苦|压力|疲惫|失望|生气|担心',
             r'加油|支持|鼓励|期待|希望|梦想|努力|坚持|相信|祝福'
-        ]
+        )]
         
         for msg in chat_history:
             text = msg['message']
             create_time = datetime.strptime(msg['create_time'], '%Y-%m-%d %H:%M:%S')
             
+            if msg['is_sender']:
+                sent_messages += 1
+            total_msg_length += len(text)
+            
             # 更新时间分布
             hour = create_time.hour
             time_distribution[hour] += 1
             
             # 计算消息时间间隔
             if last_time:
-                gap = (create_time - last_time).total_seconds() / 3600  # 转换为小时
-                time_gaps.append(gap)
+                gap_total += (create_time - last_time).total_seconds() / 3600  # 转换为小时
+                gap_count += 1
             last_time = create_time
             
-            # 文本分析
-            all_text.append(text)
+            # 文本采样
+            text_sampler.add(text, msg['create_time'])
             
             # 识别生活事件
             for pattern in life_event_patterns:
-                matches = re.findall(pattern, text)
-                if matches:
-                    life_events.extend(matches)
+                life_events.update(pattern.findall(text))
                     
             # 识别情感词
             for pattern in emotional_patterns:
-                matches = re.findall(pattern, text)
-                if matches:
-                    emotional_words.extend(matches)
+                emotional_words.update(pattern.findall(text))
+        
+        received_messages = total_messages - sent_messages
         
         # 5. 分析聊天频率
-        if time_gaps:
-            avg_gap = sum(time_gaps) / len(time_gaps)
+        if gap_count:
+            avg_gap = gap_total / gap_count
             if avg_gap < 24:
                 chat_frequency = "频繁"
             elif avg_gap < 72:
@@ -172,8 +478,8 @@ class VolcanoAPI:
         # 6. 分析关系亲密度
         intimacy_score = 0
         intimacy_score += min(total_messages / 1000, 5)  # 消息数量得分，最高5分
-        intimacy_score += len(set(emotional_words)) / 2  # 情感词丰富度得分
-        intimacy_score += min(24 / (avg_gap if time_gaps else 168), 3)  # 时间间隔得分，最高3分
+        intimacy_score += len(emotional_words) / 2  # 情感词丰富度得分
+        intimacy_score += min(24 / (avg_gap if gap_count else 168), 3)  # 时间间隔得分，最高3分
         
         if intimacy_score > 7:
             relationship_level = "密切"
@@ -183,7 +489,7 @@ class VolcanoAPI:
             relationship_level = "一般"
             
         # 7. 提取关键话题
-        combined_text = ' '.join(all_text)
+        combined_text = ' '.join(text_sampler.get_texts())
         top_keywords = jieba.analyse.extract_tags(
             combined_text,
             topK=10,
@@ -193,7 +499,7 @@ class VolcanoAPI:
         
         # 8. 分析互动方式
         response_rate = received_messages / sent_messages if sent_messages > 0 else 0
-        avg_msg_length = sum(len(msg['message']) for msg in chat_history) / total_messages
+        avg_msg_length = total_msg_length / total_messages
         
         if response_rate > 0.8 and avg_msg_length > 10:
             interaction_style = "深入交流"
@@ -210,8 +516,8 @@ class VolcanoAPI:
             "sent_messages": sent_messages,
             "received_messages": received_messages,
             "common_topics": [word for word, weight in top_keywords[:5]],
-            "emotional_keywords": list(set(emotional_words))[:5],
-            "key_life_events": list(set(life_events))[:5],
+            "emotional_keywords": list(emotional_words)[:5],
+            "key_life_events": list(life_events)[:5],
             "interaction_style": interaction_style,
             "chat_time_distribution": dict(sorted(time_distribution.items())),
             "intimacy_score": round(intimacy_score, 2)
@@ -327,40 +633,26 @@ class VolcanoAPI:
     "wishes": "美好祝愿..."
 }}"""
 
-        # 保存prompt到本地文件
-        try:
-            # 确保目录存在
-            os.makedirs('newYear/prompts', exist_ok=True)
-            
-            # 生成文件名（使用时间戳和联系人ID）
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"prompt_{timestamp}_{contact_info.get('wxid', 'unknown')}.txt"
-            filepath = os.path.join('newYear/prompts', filename)
-            
-            # 保存文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(f"=== 生成时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n\n")
-                f.write(prompt)
-                
-            print(f"\nPrompt已保存至: {filepath}")
-            
-        except Exception as e:
-            print(f"\nPrompt保存失败: {str(e)}")
-        
         return prompt
             
-    def _parse_response(self, response) -> Dict:
-        """解析API响应内容
+    def _collect_stream(self, stream) -> str:
+        """拼接流式响应中的全部内容片段"""
+        parts = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+        return ''.join(parts)
+        
+    def _parse_content(self, content: str) -> Dict:
+        """解析模型生成的文本内容
         
         Args:
-            response: API响应内容
+            content: 模型返回的原始文本
             
         Returns:
             Dict: 解析后的祝福内容
         """
         try:
-            print("\n解析响应...")
-            content = response.choices[0].message.content
             print("\n生成的原始内容:", content)
             
             # 尝试解析JSON内容